@@ -0,0 +1,57 @@
+"""Compares two result files from bench/run_scenarios.py, usually from two commits.
+
+    python3 bench/compare.py before.json after.json --threshold 10
+
+Prints each result with its change, and exits with status 1 if any result got worse by more
+than --threshold percent.
+"""
+import argparse
+import json
+import sys
+
+
+def load_results(path):
+    with open(path, "r") as f:
+        data = json.load(f)
+    return data.get("commit"), data["results"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10, help="percent change that counts as a regression")
+    args = parser.parse_args()
+    before_commit, before = load_results(args.before)
+    after_commit, after = load_results(args.after)
+
+    print(f"{'result':<40} {before_commit or 'before':>12} {after_commit or 'after':>12} {'change':>9}")
+    regressions = []
+    for name in sorted(set(before) | set(after)):
+        before_value = before.get(name, {}).get("value")
+        after_value = after.get(name, {}).get("value")
+        better = (after.get(name) or before.get(name))["better"]
+        change = ""
+        flag = ""
+        if before_value is not None and after_value is not None and before_value != 0:
+            change_percent = (after_value - before_value) / abs(before_value) * 100
+            change = f"{change_percent:+.1f}%"
+            worse_percent = change_percent if better == "lower" else -change_percent if better == "higher" else 0
+            if worse_percent > args.threshold:
+                flag = " REGRESSION"
+                regressions.append(name)
+        print(f"{name:<40} {format_value(before_value):>12} {format_value(after_value):>12} {change:>9}{flag}")
+
+    if regressions:
+        print(f"[WARN] {len(regressions)} results regressed by more than {args.threshold}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+def format_value(value):
+    if value is None:
+        return "-"
+    return f"{value:.3f}".rstrip("0").rstrip(".")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Generates a synthetic media library with GStreamer test sources, for the other benchmarks to run against.
+
+Files are spread over a random directory tree, with a random codec, resolution and duration each.
+The same arguments and --seed always produce the same tree. --placeholders adds empty files with
+video extensions, which is enough for the scan and selection benchmarks and takes no time to create.
+
+    python3 bench/generate_library.py --out /tmp/vts-bench-media --files 40 --placeholders 20000
+
+Writes bench-library.json (the arguments and every file) to the root of the library.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import time
+
+import gi
+gi.require_version("Gst", "1.0")
+from gi.repository import Gst
+
+MANIFEST_NAME = "bench-library.json"
+
+# codec -> (extension, video encoder, video parser, muxer, audio encoder)
+CODECS = {
+    "h264": (".mp4", "x264enc speed-preset=ultrafast key-int-max={gop}", "h264parse", "mp4mux", "avenc_aac"),
+    "h265": (".mkv", "x265enc speed-preset=ultrafast key-int-max={gop}", "h265parse", "matroskamux", "avenc_aac"),
+    "vp9": (".webm", "vp9enc deadline=1 cpu-used=8 keyframe-max-dist={gop}", "identity", "webmmux", "opusenc"),
+}
+PATTERNS = ["smpte", "ball", "snow", "circular", "pinwheel", "spokes", "gradient", "colors"]
+WORDS = ["holiday", "concert", "family", "trip", "archive", "camera", "clips", "misc", "2019", "2020", "2021", "raw", "edited"]
+FRAME_RATE = 30
+AUDIO_RATE = 48000
+SAMPLES_PER_BUFFER = 1024
+
+
+def make_tree(rng, dir_count, depth):
+    dirs = [""]
+    while len(dirs) < dir_count:
+        parent = rng.choice([d for d in dirs if d.count(os.sep) < depth - 1] or [""])
+        name = os.path.join(parent, f"{rng.choice(WORDS)}-{len(dirs)}")
+        dirs.append(name)
+    return dirs
+
+
+def encode(path, codec, width, height, duration_s, gop_s, pattern, freq):
+    _, video_encoder, parser, muxer, audio_encoder = CODECS[codec]
+    frames = max(1, round(duration_s * FRAME_RATE))
+    audio_buffers = max(1, math.ceil(duration_s * AUDIO_RATE / SAMPLES_PER_BUFFER))
+    pipeline = Gst.parse_launch(
+        f"videotestsrc num-buffers={frames} pattern={pattern} ! video/x-raw,width={width},height={height},framerate={FRAME_RATE}/1 "
+        f"! timeoverlay ! videoconvert ! {video_encoder.format(gop=max(1, round(gop_s * FRAME_RATE)))} ! {parser} ! queue ! mux. "
+        f"audiotestsrc num-buffers={audio_buffers} samplesperbuffer={SAMPLES_PER_BUFFER} wave=sine freq={freq} "
+        f"! audio/x-raw,rate={AUDIO_RATE},channels=2 ! audioconvert ! {audio_encoder} ! queue ! mux. "
+        f"{muxer} name=mux ! filesink location=\"{path}\""
+    )
+    pipeline.set_state(Gst.State.PLAYING)
+    try:
+        msg = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        if msg.type == Gst.MessageType.ERROR:
+            err, debug = msg.parse_error()
+            raise Exception(f"{err}: {debug}")
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+
+def parse_csv(csv):
+    return [item.strip() for item in csv.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", required=True, help="the library's root directory, which is created if needed")
+    parser.add_argument("--files", type=int, default=20, help="how many real video files to encode")
+    parser.add_argument("--placeholders", type=int, default=0, help="how many empty files with video extensions to add")
+    parser.add_argument("--dirs", type=int, default=10)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--codecs", default="h264,h265,vp9", help=f"any of {','.join(CODECS)}")
+    parser.add_argument("--resolutions", default="640x360,1280x720,1920x1080")
+    parser.add_argument("--durations-s", default="10,30", help="min,max duration of each file")
+    parser.add_argument("--gop-s", type=float, default=2, help="seconds between keyframes")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    codecs = parse_csv(args.codecs)
+    for codec in codecs:
+        if codec not in CODECS:
+            parser.error(f"unknown codec {codec}")
+    resolutions = [tuple(int(n) for n in resolution.split("x")) for resolution in parse_csv(args.resolutions)]
+    min_duration_s, max_duration_s = (float(n) for n in parse_csv(args.durations_s))
+
+    Gst.init(None)
+    os.makedirs(args.out, exist_ok=True)
+    rng = random.Random(args.seed)
+    dirs = make_tree(rng, max(1, args.dirs), max(1, args.depth))
+    files = []
+    start = time.perf_counter()
+    for i in range(args.files):
+        codec = rng.choice(codecs)
+        width, height = rng.choice(resolutions)
+        duration_s = round(rng.uniform(min_duration_s, max_duration_s), 1)
+        rel_path = os.path.join(rng.choice(dirs), f"{rng.choice(WORDS)}-{i}-{codec}-{height}p{CODECS[codec][0]}")
+        path = os.path.join(args.out, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pattern, freq = rng.choice(PATTERNS), rng.randint(220, 880)
+        if not os.path.exists(path):
+            print(f"[INFO] encoding {rel_path} ({duration_s}s)")
+            encode(path, codec, width, height, duration_s, args.gop_s, pattern, freq)
+        files.append({"path": rel_path, "codec": codec, "width": width, "height": height, "duration_s": duration_s})
+    for i in range(args.placeholders):
+        rel_path = os.path.join(rng.choice(dirs), f"{rng.choice(WORDS)}-placeholder-{i}{rng.choice(['.mp4', '.mkv', '.webm'])}")
+        path = os.path.join(args.out, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "a").close()
+        files.append({"path": rel_path, "codec": None})
+
+    with open(os.path.join(args.out, MANIFEST_NAME), "w") as f:
+        json.dump({"args": vars(args), "files": files}, f, indent=2)
+    print(f"[INFO] generated {args.files} files and {args.placeholders} placeholders in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
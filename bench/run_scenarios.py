@@ -0,0 +1,318 @@
+"""Runs headless benchmark scenarios against a library made by generate_library.py.
+
+    scan       cold (empty index) and warm (nothing changed) LibraryIndex refreshes
+    selection  classifying the library with a FileFilter, and picking files from FileGroups
+    probe      ProbePool latency with an empty MediaInfoCache, then with a warm one
+    stream     runs stream.py against the library, with the output in a temporary directory, and
+               collects the metrics it reports: FileBin ready latency, transition lateness and
+               encoder speed (encoded fps divided by the output frame rate)
+    offline    renders the stream as fast as possible (stream.py --offline) to find the maximum
+               speed, and the render time each clip costs (from runs with two clip lengths)
+
+    python3 bench/run_scenarios.py --library /tmp/vts-bench-media --output before.json
+
+Prints (or writes) a single JSON object of results, which bench/compare.py can compare between commits.
+"""
+import argparse
+import json
+import os
+import select
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+from file_filter import FileFilter, ClassificationCache
+from file_group import FileGroup
+from ipc import IpcChannel, ListAssembler, IPC_FD_ENV
+from library_index import LibraryIndex, VIDEO_EXTENSIONS
+from preset_manager import PresetManager
+
+def result(value, unit, better="lower"):
+    return {"value": round(value, 3) if value is not None else None, "unit": unit, "better": better}
+
+
+def timed_ms(function):
+    start = time.perf_counter()
+    value = function()
+    return (time.perf_counter() - start) * 1000, value
+
+
+def run_scan(args, temp_dir):
+    index = LibraryIndex(args.library, VIDEO_EXTENSIONS, os.path.join(temp_dir, "library-index.json"))
+    cold_ms, _ = timed_ms(index.refresh)
+    warm_ms, _ = timed_ms(index.refresh)
+    save_ms, _ = timed_ms(index.save)
+    loaded_index = LibraryIndex(args.library, VIDEO_EXTENSIONS, index.snapshot_path)
+    load_ms, _ = timed_ms(loaded_index.load)
+    return {
+        "scan.files": result(len(index.get_files()), "files", None),
+        "scan.cold_refresh_ms": result(cold_ms, "ms"),
+        "scan.warm_refresh_ms": result(warm_ms, "ms"),
+        "scan.snapshot_save_ms": result(save_ms, "ms"),
+        "scan.snapshot_load_ms": result(load_ms, "ms"),
+    }
+
+
+def run_selection(args, temp_dir):
+    index = LibraryIndex(args.library, VIDEO_EXTENSIONS, os.path.join(temp_dir, "library-index.json"))
+    index.refresh()
+    preset = PresetManager(os.path.join(temp_dir, "presets.json")).get_active_preset()
+    # terms that the generator uses in names, so all three groups have files
+    preset["BOOSTED_CONTAINS_CSV"] = "concert,holiday"
+    preset["SUPPRESSED_CONTAINS_CSV"] = "archive,misc"
+    preset["EXCLUDE_CONTAINS_CSV"] = "raw"
+    classification_cache = ClassificationCache(index)
+    classify_ms, classified = timed_ms(lambda: classification_cache.get(FileFilter(preset)))
+    cached_ms, _ = timed_ms(lambda: classification_cache.get(FileFilter(preset)))
+
+    selections = 0
+    start = time.perf_counter()
+    for files in classified[:3]:
+        if not files:
+            continue
+        group = FileGroup()
+        for _ in range(args.selections // 3):
+            group.setup(files, 1)
+            if not group.eligible_files:
+                group.next_iteration()
+            group.select_file()
+            selections += 1
+    elapsed_s = time.perf_counter() - start
+    return {
+        "selection.classify_ms": result(classify_ms, "ms"),
+        "selection.cached_classify_ms": result(cached_ms, "ms"),
+        "selection.selections_per_s": result(selections / elapsed_s if elapsed_s else None, "selections/s", "higher"),
+    }
+
+
+def run_probe(args, temp_dir):
+    from media_info_cache import MediaInfoCache
+    from probe_pool import ProbePool
+    with open(os.path.join(args.library, "bench-library.json")) as f:
+        paths = [os.path.join(args.library, entry["path"]) for entry in json.load(f)["files"] if entry["codec"]]
+    media_info_cache = MediaInfoCache(os.path.join(temp_dir, "media-info.db"))
+    probe_pool = ProbePool(media_info_cache)
+
+    def probe_all():
+        latencies = []
+        for path in paths:
+            latency_ms, _ = timed_ms(lambda: probe_pool.submit(path).result())
+            latencies.append(latency_ms)
+        return latencies
+
+    cold_latencies = probe_all()
+    warm_latencies = probe_all()
+    return {
+        "probe.files": result(len(paths), "files", None),
+        "probe.cold_mean_ms": result(statistics.mean(cold_latencies) if cold_latencies else None, "ms"),
+        "probe.cold_p95_ms": result(percentile(cold_latencies, 95), "ms"),
+        "probe.warm_mean_ms": result(statistics.mean(warm_latencies) if warm_latencies else None, "ms"),
+    }
+
+
+def run_stream(args, temp_dir):
+    encoder_speeds = []
+    def on_metrics(snapshot, elapsed_s):
+        speed = find_metric(snapshot, "encoder_speed")
+        if speed and elapsed_s > args.warmup_s:
+            encoder_speeds.append(speed["value"])
+    snapshot, _ = run_stream_process(args, temp_dir, args.clip_duration_s, [], args.stream_duration_s, on_metrics)
+
+    filebin_ready = find_metric(snapshot, "filebin_ready_ms")
+    transition_lateness = find_metric(snapshot, "transition_lateness_ms")
+    force_cleanups = find_metric(snapshot, "force_cleanups_total")
+    starvations = find_metric(snapshot, "planner_starvations")
+    return {
+        "stream.filebin_ready_mean_ms": result(histogram_mean(filebin_ready), "ms"),
+        "stream.filebin_ready_p95_ms": result(histogram_percentile(filebin_ready, 95), "ms"),
+        "stream.transitions": result(transition_lateness["count"] if transition_lateness else 0, "transitions", None),
+        "stream.transition_lateness_mean_ms": result(histogram_mean(transition_lateness), "ms"),
+        "stream.transition_lateness_p95_ms": result(histogram_percentile(transition_lateness, 95), "ms"),
+        "stream.encoder_speed_mean": result(statistics.mean(encoder_speeds) if encoder_speeds else None, "x real time", "higher"),
+        "stream.encoder_speed_min": result(min(encoder_speeds) if encoder_speeds else None, "x real time", "higher"),
+        "stream.force_cleanups": result(force_cleanups["value"] if force_cleanups else 0, "cleanups"),
+        "stream.planner_starvations": result(starvations["value"] if starvations else 0, "starvations"),
+    }
+
+
+def run_offline(args, temp_dir):
+    # the same length of stream with clips of two lengths, so the difference in render time is the cost of the extra clips
+    runs = []
+    for clip_duration_s in (args.clip_duration_s, args.clip_duration_s * 2):
+        run_dir = os.path.join(temp_dir, f"clips-{clip_duration_s}s")
+        os.makedirs(run_dir)
+        stream_args = ["--offline", "--offline-sink", "fakesink", "--offline-duration-s", str(args.offline_duration_s)]
+        snapshot, elapsed_s = run_stream_process(args, run_dir, clip_duration_s, stream_args, args.offline_timeout_s)
+        clips = find_metric(snapshot, "clips_started_total")
+        frames = find_metric(snapshot, "encoded_frames_total")
+        runs.append((elapsed_s, clips["value"] if clips else 0, frames["value"] if frames else 0, snapshot))
+
+    (short_elapsed_s, short_clips, short_frames, snapshot), (long_elapsed_s, long_clips, _, _) = runs
+    transition_lateness = find_metric(snapshot, "transition_lateness_ms")
+    clip_overhead_ms = None
+    if short_clips > long_clips:
+        clip_overhead_ms = (short_elapsed_s - long_elapsed_s) * 1000 / (short_clips - long_clips)
+    return {
+        "offline.speed": result(args.offline_duration_s / short_elapsed_s, "x real time", "higher"),
+        "offline.fps": result(short_frames / short_elapsed_s, "fps", "higher"),
+        "offline.clips": result(short_clips, "clips", None),
+        "offline.clip_overhead_ms": result(clip_overhead_ms, "ms"),
+        "offline.transition_lateness_mean_ms": result(histogram_mean(transition_lateness), "ms"),
+    }
+
+
+def run_stream_process(args, temp_dir, clip_duration_s, stream_args, duration_s, on_metrics=None):
+    """Runs stream.py against the library until it exits or duration_s passes.
+    Returns (the last metrics it reported, seconds it ran for)"""
+    hls_dir = os.path.join(temp_dir, "hls")
+    metadata_dir = os.path.join(temp_dir, "metadata")
+    os.makedirs(hls_dir)
+    os.makedirs(metadata_dir)
+    channel, child_sock = IpcChannel.create_pair()
+    env = dict(os.environ, **{
+        IPC_FD_ENV: str(child_sock.fileno()),
+        "VTS_MEDIA_DIR": os.path.abspath(args.library),
+        "VTS_HLS_DIR": hls_dir,
+        "VTS_METADATA_DIR": metadata_dir,
+        # short clips, so a short run has plenty of transitions, and no auto-pause since nobody is watching
+        "CLIP_DURATION_S": str(clip_duration_s),
+        "CLIP_DURATION_MIN_S": str(min(5, clip_duration_s)),
+        "AUTO_PAUSE_S": "1000000",
+    })
+    if args.seed is not None:
+        env["VTS_SEED"] = str(args.seed)
+    log_path = os.path.join(temp_dir, "stream.log")
+    with open(log_path, "w") as log:
+        process = subprocess.Popen([sys.executable, "-u", "stream.py"] + stream_args, cwd=SRC_DIR, pass_fds=[child_sock.fileno()],
+                                   env=env, stdout=log, stderr=subprocess.STDOUT)
+    child_sock.close()
+    snapshot = []
+    # the stream sends its metrics in parts (see IpcChannel.send_list)
+    metrics_assembler = ListAssembler()
+    start = time.monotonic()
+    try:
+        while time.monotonic() - start < duration_s and process.poll() is None:
+            select.select([channel], [], [], 1)
+            for message in channel.receive():
+                if message["type"] != "metrics":
+                    continue
+                metrics = metrics_assembler.add(message, "metrics")
+                if metrics is None:
+                    continue
+                snapshot = metrics
+                if on_metrics:
+                    on_metrics(snapshot, time.monotonic() - start)
+        elapsed_s = time.monotonic() - start
+        # the last metrics might have been sent right before it exited
+        for message in channel.receive():
+            if message["type"] == "metrics":
+                snapshot = metrics_assembler.add(message, "metrics") or snapshot
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        channel.close()
+    if not snapshot:
+        with open(log_path) as log:
+            raise Exception("the stream didn't report any metrics:\n" + "".join(log.readlines()[-20:]))
+    return snapshot, elapsed_s
+
+
+def find_metric(snapshot, name):
+    for metric in snapshot:
+        if metric["name"] == name:
+            return metric
+    return None
+
+
+def histogram_mean(metric):
+    if not metric or not metric["count"]:
+        return None
+    return metric["sum"] / metric["count"]
+
+
+def histogram_percentile(metric, percent):
+    """The upper bound of the bucket that the percentile falls in"""
+    if not metric or not metric["count"]:
+        return None
+    target = metric["count"] * percent / 100
+    for bound, count in metric["buckets"]:
+        if count >= target:
+            return None if bound == "+Inf" else bound
+    return None
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+SCENARIOS = {"scan": run_scan, "selection": run_selection, "probe": run_probe, "stream": run_stream, "offline": run_offline}
+
+
+def median_results(runs):
+    results = {}
+    for name, first in runs[0].items():
+        values = [run[name]["value"] for run in runs if run[name]["value"] is not None]
+        results[name] = dict(first, value=round(statistics.median(values), 3) if values else None)
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--library", required=True, help="a directory made by generate_library.py")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"any of {','.join(SCENARIOS)}")
+    parser.add_argument("--selections", type=int, default=30000)
+    parser.add_argument("--stream-duration-s", type=float, default=120)
+    parser.add_argument("--warmup-s", type=float, default=15, help="encoder speed isn't sampled until the stream has run this long")
+    parser.add_argument("--clip-duration-s", type=float, default=8)
+    parser.add_argument("--offline-duration-s", type=float, default=300, help="stream time rendered by the offline scenario")
+    parser.add_argument("--offline-timeout-s", type=float, default=900)
+    parser.add_argument("--seed", type=int, default=1, help="passed to the stream, so every run plays the same clips")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each in-process scenario, the median is reported")
+    parser.add_argument("--output", help="write the results to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = {}
+    for name in [name.strip() for name in args.scenarios.split(",") if name.strip()]:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+        runs = []
+        # the streams take minutes and are already averages, the others are short enough to be noisy
+        for i in range(1 if name in ("stream", "offline") else args.repeat):
+            print(f"[INFO] running the {name} scenario ({i + 1})", file=sys.stderr)
+            with tempfile.TemporaryDirectory(prefix=f"vts-bench-{name}-") as temp_dir:
+                runs.append(SCENARIOS[name](args, temp_dir))
+        results.update(median_results(runs))
+
+    output = json.dumps({
+        "benchmark": "scenarios",
+        "commit": get_commit(),
+        "library": os.path.abspath(args.library),
+        "results": results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Measures how many HLS segments a running VTS server can serve to concurrent clients.
+
+Each client repeatedly downloads the newest segment listed in the playlist (like a player
+that's catching up), while one extra client polls the playlist to measure its latency under load.
+
+    python3 bench/serve_throughput.py --url http://localhost:3000 --concurrency 8 --duration-s 20
+
+Prints a single JSON object, so results from different commits can be compared.
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.request
+
+
+def fetch(url):
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=30) as response:
+        size = len(response.read())
+    return size, time.perf_counter() - start
+
+
+def get_newest_segment_url(base_url):
+    with urllib.request.urlopen(f"{base_url}/playlist.m3u8", timeout=30) as response:
+        lines = response.read().decode("utf-8").splitlines()
+    segments = [line for line in lines if line and not line.startswith("#")]
+    if not segments:
+        raise Exception("the playlist doesn't list any segments yet")
+    return f"{base_url}/{segments[-1].lstrip('/')}"
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:3000")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration-s", type=float, default=20)
+    args = parser.parse_args()
+    base_url = args.url.rstrip("/")
+    segment_url = get_newest_segment_url(base_url)
+
+    lock = threading.Lock()
+    segment_latencies = []
+    playlist_latencies = []
+    totals = {"bytes": 0, "errors": 0}
+    deadline = time.perf_counter() + args.duration_s
+
+    def segment_client():
+        while time.perf_counter() < deadline:
+            try:
+                size, latency = fetch(segment_url)
+            except Exception:
+                with lock:
+                    totals["errors"] += 1
+                continue
+            with lock:
+                totals["bytes"] += size
+                segment_latencies.append(latency)
+
+    def playlist_client():
+        while time.perf_counter() < deadline:
+            try:
+                _, latency = fetch(f"{base_url}/playlist.m3u8")
+            except Exception:
+                with lock:
+                    totals["errors"] += 1
+                continue
+            with lock:
+                playlist_latencies.append(latency)
+            time.sleep(0.5)
+
+    threads = [threading.Thread(target=segment_client) for _ in range(args.concurrency)]
+    threads.append(threading.Thread(target=playlist_client))
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed_s = time.perf_counter() - start
+
+    print(json.dumps({
+        "benchmark": "serve_throughput",
+        "concurrency": args.concurrency,
+        "duration_s": round(elapsed_s, 3),
+        "segment_requests": len(segment_latencies),
+        "segments_per_s": round(len(segment_latencies) / elapsed_s, 2),
+        "mbytes_per_s": round(totals["bytes"] / elapsed_s / 1e6, 2),
+        "segment_latency_p50_ms": round(statistics.median(segment_latencies) * 1000, 2) if segment_latencies else None,
+        "segment_latency_p95_ms": round(percentile(segment_latencies, 95) * 1000, 2) if segment_latencies else None,
+        "playlist_latency_p95_ms": round(percentile(playlist_latencies, 95) * 1000, 2) if playlist_latencies else None,
+        "errors": totals["errors"],
+    }))
+
+
+if __name__ == "__main__":
+    main()
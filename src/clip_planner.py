@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import deque
+
+
+class ClipPlanner:
+    """Keeps a bounded queue of fully-resolved ClipInfos, refilled on a background thread.
+
+    produce is called on the planner thread and must return the next ClipInfo. Because of that,
+    whatever produce uses (such as the ClipInfoManager) should only be used by this thread.
+    """
+    def __init__(self, produce, depth, on_reset=None):
+        self.produce = produce
+        self.depth = depth
+        self.on_reset = on_reset
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.reset_pending = False
+        self.error = None
+        self.starved_count = 0
+        self.starving = False
+        self._thread = threading.Thread(target=self._run, name="clip-planner", daemon=True)
+        self._thread.start()
+
+    def next_clipinfo(self):
+        """Returns the next planned clip, or None if there isn't one yet. This is called from the main loop, so it
+        never waits for the planner. Raises the planner's error if planning is failing"""
+        with self.condition:
+            if not self.queue:
+                if not self.starving:
+                    self.starving = True
+                    self.starved_count += 1
+                    print("[WARN] clip planner queue is empty, retrying shortly")
+                if self.error:
+                    raise self.error
+                return None
+            self.starving = False
+            clip = self.queue.popleft()
+            self.condition.notify_all()
+            return clip
+
+    def peek(self):
+        """Returns the next planned clip without removing it, or None if nothing is planned yet"""
+        with self.condition:
+            return self.queue[0] if self.queue else None
+
+    def reset(self):
+        """Discard all planned clips, such as after the presets change"""
+        with self.condition:
+            self.queue.clear()
+            self.generation += 1
+            self.reset_pending = True
+            self.error = None
+            self.condition.notify_all()
+
+    def set_depth(self, depth):
+        with self.condition:
+            self.depth = depth
+            self.condition.notify_all()
+
+    def get_queue_depth(self):
+        return len(self.queue)
+
+    def get_planned_ms(self):
+        """The amount of playback time covered by the planned clips"""
+        with self.condition:
+            return sum(clip.duration_ms - clip.fadeout_ms for clip in self.queue)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.queue) < self.depth or self.reset_pending)
+                generation = self.generation
+                reset_pending = self.reset_pending
+                self.reset_pending = False
+            try:
+                if reset_pending and self.on_reset:
+                    self.on_reset()
+                clip = self.produce()
+            except Exception as e:
+                print(f"Error planning clip: {e}")
+                with self.condition:
+                    self.error = e
+                    self.condition.notify_all()
+                time.sleep(1)
+                continue
+            with self.condition:
+                self.error = None
+                if generation == self.generation:
+                    self.queue.append(clip)
+                    self.condition.notify_all()
@@ -0,0 +1,55 @@
+class EncoderProfile:
+    """How much CPU the stream may use, and how x264enc trades it for quality.
+
+    rate_control is either "qual" (constant quality, where quantizer works like x264's CRF) or "cbr"
+    (a constant bitrate, capped by a VBV buffer, for bandwidth-limited clients).
+    """
+    def __init__(self, x264_threads, speed_preset, rate_control="qual", quantizer=18, bitrate_kbps=0,
+                 vbv_buffer_ms=0, lookahead=40, filebin_threads=1):
+        self.x264_threads = x264_threads # 0 lets x264 decide (about 1.5x the cores)
+        self.speed_preset = speed_preset # 1=ultrafast, 4=faster, 6=medium, 9=veryslow
+        self.rate_control = rate_control
+        self.quantizer = quantizer # high values (> 30) are noticable, but low values (< 20) seem to have no effect on quality or file size
+        self.bitrate_kbps = bitrate_kbps # 0 means it's estimated from the output's resolution and frame rate
+        self.vbv_buffer_ms = vbv_buffer_ms # 0 uses x264enc's default
+        self.lookahead = lookahead # frames, more is better quality but more latency and memory
+        self.filebin_threads = filebin_threads # n-threads of each clip's videoconvert & videoscale, 0 means one per core
+
+    def apply(self, x264enc, width, height, frame_rate):
+        x264enc.set_property("threads", self.x264_threads)
+        x264enc.set_property("speed-preset", self.speed_preset)
+        x264enc.set_property("rc-lookahead", self.lookahead)
+        if self.rate_control == "cbr":
+            x264enc.set_property("pass", "cbr")
+            x264enc.set_property("bitrate", self.bitrate_kbps or estimate_bitrate_kbps(width, height, frame_rate))
+            if self.vbv_buffer_ms:
+                x264enc.set_property("vbv-buf-capacity", self.vbv_buffer_ms)
+        else:
+            x264enc.set_property("quantizer", self.quantizer)
+            x264enc.set_property("pass", "qual")
+
+
+ENCODER_PROFILES = {
+    # a Raspberry Pi class box, which needs every shortcut to keep up at 720p
+    "low-power": EncoderProfile(x264_threads=2, speed_preset=1, quantizer=21, lookahead=0),
+    # the original constants
+    "balanced": EncoderProfile(x264_threads=0, speed_preset=4),
+    # a many-core server with CPU to spare
+    "quality": EncoderProfile(x264_threads=0, speed_preset=6, lookahead=60, filebin_threads=0),
+    # constant bitrate with a 1 second VBV buffer, for clients on capped connections
+    "capped": EncoderProfile(x264_threads=0, speed_preset=4, rate_control="cbr", vbv_buffer_ms=1000),
+}
+DEFAULT_PROFILE = "balanced"
+
+
+def get_encoder_profile(name):
+    profile = ENCODER_PROFILES.get(name.strip().lower())
+    if not profile:
+        print(f"[WARN] unknown ENCODER_PROFILE {name}, using {DEFAULT_PROFILE}")
+        return ENCODER_PROFILES[DEFAULT_PROFILE]
+    return profile
+
+
+def estimate_bitrate_kbps(width, height, frame_rate):
+    # about 0.1 bits per pixel, which is fine for h264 at the faster presets
+    return max(500, round(width * height * frame_rate * 0.1 / 1000))
@@ -0,0 +1,183 @@
+import functools
+import operator
+import os
+import re
+import threading
+from collections import OrderedDict
+
+EXCLUDED = "excluded"
+SUPPRESSED = "suppressed"
+NEUTRAL = "neutral"
+BOOSTED = "boosted"
+GROUP_INDEXES = {SUPPRESSED: 0, NEUTRAL: 1, BOOSTED: 2, EXCLUDED: 3} # positions in the classify_files result
+
+FILTER_KEYS = [
+    "BASE_DIRECTORY",
+    "EXCLUDE_STARTSWITH_CSV", "EXCLUDE_CONTAINS_CSV", "EXCLUDE_NOTSTARTSWITH_CSV", "EXCLUDE_NOTCONTAINS_CSV",
+    "BOOSTED_STARTSWITH_CSV", "BOOSTED_CONTAINS_CSV", "BOOSTED_NOTSTARTSWITH_CSV", "BOOSTED_NOTCONTAINS_CSV",
+    "SUPPRESSED_STARTSWITH_CSV", "SUPPRESSED_CONTAINS_CSV", "SUPPRESSED_NOTSTARTSWITH_CSV", "SUPPRESSED_NOTCONTAINS_CSV",
+]
+
+
+class PrefixTrie:
+    def __init__(self):
+        self.root = {}
+
+    def add(self, term, mask):
+        node = self.root
+        for char in term:
+            node = node.setdefault(char, {})
+        node[None] = node.get(None, 0) | mask
+
+    def match(self, text):
+        """Returns the OR of the masks of every term that text starts with"""
+        mask = 0
+        node = self.root
+        for char in text:
+            mask |= node.get(None, 0)
+            node = node.get(char)
+            if node is None:
+                return mask
+        return mask | node.get(None, 0)
+
+
+class FileFilter:
+    """The EXCLUDE/BOOSTED/SUPPRESSED settings of a preset, compiled so that a path is classified in one pass.
+
+    Each of the 12 csv settings gets a bit. All STARTSWITH terms go in one prefix trie, and all CONTAINS
+    terms go in one regex that reports every term found in the path. A path is then classified by
+    checking which bits were matched.
+    """
+    # each group has 4 bits, in the same order as FILTER_KEYS: STARTSWITH, CONTAINS, NOTSTARTSWITH, NOTCONTAINS
+    EXCLUDE_BITS = 0b1111
+    BOOSTED_BITS = 0b1111 << 4
+    SUPPRESSED_BITS = 0b1111 << 8
+    POSITIVE_BITS = 0b001100110011
+    NEGATIVE_BITS = 0b110011001100
+
+    def __init__(self, preset):
+        self.key = tuple(preset[key].strip(" \t\n\r") for key in FILTER_KEYS)
+        self.base_directory = preset["BASE_DIRECTORY"].strip(" \t\n\r/\\")
+        self.trie = PrefixTrie()
+        self.present_mask = 0
+        contains_masks = {}
+        bit = 1
+        for key, csv in zip(FILTER_KEYS[1:], self.key[1:]):
+            if "STARTSWITH" in key:
+                terms = [term.strip().lstrip("/").lower() for term in csv.split(",") if term.strip()]
+                for term in terms:
+                    self.trie.add(term, bit)
+            else:
+                terms = [term.strip().lower() for term in csv.split(",") if term.strip()]
+                for term in terms:
+                    contains_masks[term] = contains_masks.get(term, 0) | bit
+            if terms:
+                self.present_mask |= bit
+            bit <<= 1
+
+        # the regex only reports one term per position, so a term's mask also includes the terms it starts with
+        self.contains_masks = {
+            term: functools.reduce(operator.or_, (mask for other, mask in contains_masks.items() if term.startswith(other)))
+            for term in contains_masks
+        }
+        self.contains_pattern = None
+        if contains_masks:
+            terms = sorted(contains_masks, key=len, reverse=True)
+            self.contains_pattern = re.compile("(?=(" + "|".join(re.escape(term) for term in terms) + "))")
+
+    def matched_bits(self, lower_path):
+        mask = self.trie.match(lower_path)
+        if self.contains_pattern:
+            for match in self.contains_pattern.finditer(lower_path):
+                mask |= self.contains_masks[match.group(1)]
+        return mask
+
+    def in_base_directory(self, path):
+        return not self.base_directory or path.startswith(self.base_directory + os.sep)
+
+    def classify(self, path, enable_excludes=True):
+        """Returns EXCLUDED, SUPPRESSED, NEUTRAL or BOOSTED for a path relative to the media root"""
+        if self.base_directory:
+            lower_path = path[len(self.base_directory) + 1:].lower()
+        else:
+            lower_path = path.lower()
+        mask = self.matched_bits(lower_path)
+        if enable_excludes and self._group_matches(mask, self.EXCLUDE_BITS):
+            return EXCLUDED
+        bias = 0
+        if self._group_matches(mask, self.BOOSTED_BITS):
+            bias += 1
+        if self._group_matches(mask, self.SUPPRESSED_BITS):
+            bias -= 1
+        if bias == -1:
+            return SUPPRESSED
+        if bias == 0:
+            return NEUTRAL
+        return BOOSTED
+
+    def classify_files(self, paths, enable_excludes=True):
+        """Returns (suppressed_files, neutral_files, boosted_files, excluded_files)"""
+        groups = {EXCLUDED: [], SUPPRESSED: [], NEUTRAL: [], BOOSTED: []}
+        for path in paths:
+            groups[self.classify(path, enable_excludes)].append(path)
+        return (groups[SUPPRESSED], groups[NEUTRAL], groups[BOOSTED], groups[EXCLUDED])
+
+    def _group_matches(self, mask, group_bits):
+        if mask & group_bits & self.POSITIVE_BITS:
+            return True
+        # a NOT setting matches when it has terms, but none of them were found
+        return bool(self.present_mask & group_bits & self.NEGATIVE_BITS & ~mask)
+
+
+class ClassificationCache:
+    """Caches the classified file lists of recently used filters until the library index changes.
+
+    The same list objects are returned until then, so callers can cheaply tell that nothing changed.
+    Changes made through apply_changes update the cached lists in place instead, so they keep being
+    the same objects.
+    """
+    def __init__(self, library_index, max_entries=4):
+        self.library_index = library_index
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # (filter key, enable_excludes) -> (library version, classified lists, filter)
+        self.lock = threading.Lock()
+
+    def get(self, file_filter, enable_excludes=True):
+        """Returns (suppressed_files, neutral_files, boosted_files, excluded_files)"""
+        key = (file_filter.key, enable_excludes)
+        version = self.library_index.version
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] == version:
+                self.entries.move_to_end(key)
+                return entry[1]
+        files = self.library_index.get_files(file_filter.base_directory)
+        result = file_filter.classify_files(files, enable_excludes)
+        with self.lock:
+            self.entries[key] = (version, result, file_filter)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return result
+
+    def apply_changes(self, added, removed):
+        """Applies files added or removed by another process to the library index (see LibraryIndex.apply_changes).
+        Only the changed files are classified. Returns (added, removed) with the files that actually changed"""
+        with self.library_index.lock, self.lock:
+            version = self.library_index.version
+            added, removed = self.library_index.apply_changes(added, removed)
+            for key, (entry_version, result, file_filter) in list(self.entries.items()):
+                if entry_version != version:
+                    continue # already out of date, so it's classified again on the next get
+                enable_excludes = key[1]
+                for path in removed:
+                    if file_filter.in_base_directory(path):
+                        try:
+                            result[GROUP_INDEXES[file_filter.classify(path, enable_excludes)]].remove(path)
+                        except ValueError:
+                            pass
+                for path in added:
+                    if file_filter.in_base_directory(path):
+                        result[GROUP_INDEXES[file_filter.classify(path, enable_excludes)]].append(path)
+                self.entries[key] = (self.library_index.version, result, file_filter)
+            return added, removed
@@ -0,0 +1,163 @@
+import math
+import random
+from collections import deque
+
+
+class IndexedSet:
+    """A set that also supports O(1) random selection, by keeping its items in a list"""
+    def __init__(self, items=()):
+        self.items = []
+        self.positions = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item in self.positions:
+            return
+        self.positions[item] = len(self.items)
+        self.items.append(item)
+
+    def remove(self, item):
+        position = self.positions.pop(item)
+        last_item = self.items.pop()
+        if position < len(self.items):
+            self.items[position] = last_item
+            self.positions[last_item] = position
+
+    def discard(self, item):
+        if item in self.positions:
+            self.remove(item)
+
+    def choice(self, rng=random):
+        return self.items[rng.randrange(len(self.items))]
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class FileGroup():
+    """A shuffle bag of files. Each iteration plays every file once, in a random order,
+    and files played within the last recent_window_length picks aren't eligible.
+
+    Every file is in exactly one of: played (this iteration), held (not played, but recent),
+    or eligible. Picking a file and adding/removing a file are O(1), and starting a new
+    iteration is O(n), which is O(1) amortized over the n picks of an iteration.
+    """
+    def __init__(self, recent_window_length=30, rng=random):
+        self.rng = rng
+        self.recent_files_queue = deque(maxlen=recent_window_length)
+        self.all_files = IndexedSet()
+        self.eligible = IndexedSet()
+        self.held = set()
+        self.files_set = set() # files played this iteration
+        self.recent_set = set()
+        self.synced_files = None
+        self.iteration_index = 0
+        self.select_count = 0
+        self.cleanup()
+
+    def setup(self, files, iteration_count):
+        if files is not self.synced_files:
+            self.sync(files)
+        self.files = self.all_files
+        self.iteration_count = iteration_count
+        self.iteration_index %= iteration_count
+        self.eligible_files = self.eligible
+        self.remaining_iteration_file_count = len(self.eligible) + len(self.held)
+        if len(self.eligible_files) == 0 and self.remaining_iteration_file_count > 0:
+            print("[WARN] unexpected situation in random filepicker logic") # I don't think this is possible, but hard to definitively prove
+            self.remaining_iteration_file_count = 0
+        self.remaining_iterations = self.iteration_count - 1 - self.iteration_index
+        self.remaining_total_file_count = self.remaining_iteration_file_count + (self.remaining_iterations * len(self.files))
+
+    def sync(self, files):
+        """Bring the group's files in line with files, only touching what changed"""
+        new_files = set(files)
+        for f in [f for f in self.all_files if f not in new_files]:
+            self._remove_file(f)
+        for f in files:
+            self._add_file(f)
+        self._update_recent_set()
+        self.synced_files = files
+
+    def add_file(self, f):
+        if f not in self.all_files:
+            self._add_file(f)
+            self._update_recent_set()
+
+    def remove_file(self, f):
+        if f in self.all_files:
+            self._remove_file(f)
+            self._update_recent_set()
+
+    def _add_file(self, f):
+        if f in self.all_files:
+            return
+        self.all_files.add(f)
+        if f in self.recent_set:
+            self.held.add(f)
+        else:
+            self.eligible.add(f)
+
+    def _remove_file(self, f):
+        if f not in self.all_files:
+            return
+        self.all_files.remove(f)
+        self.eligible.discard(f)
+        self.held.discard(f)
+        self.files_set.discard(f)
+
+    def cleanup(self):
+        self.files = None
+        self.eligible_files = None
+        self.iteration_count = None
+        self.remaining_iterations = None
+        self.remaining_iteration_file_count = None
+        self.remaining_total_file_count = None
+
+    def get_adjusted_remaining_total_file_count(self, factor):
+        adjusted_iteration_count = self.iteration_count / factor
+        if self.iteration_index >= adjusted_iteration_count:
+            return self.remaining_total_file_count
+        adjusted_remaining_iterations = adjusted_iteration_count - 1 - self.iteration_index
+        return self.remaining_iteration_file_count + (adjusted_remaining_iterations * len(self.files))
+
+    def next_iteration(self):
+        self.files_set.clear()
+        self.held = set(f for f in self.recent_set if f in self.all_files)
+        self.eligible = IndexedSet(f for f in self.all_files if f not in self.held)
+        self.iteration_index += 1
+        self.iteration_index %= self.iteration_count
+        self.setup(self.synced_files, self.iteration_count)
+
+    def select_file(self):
+        selected_file = self.eligible.choice(self.rng)
+        self.select_count += 1
+        self.eligible.remove(selected_file)
+        self.files_set.add(selected_file)
+        self.recent_files_queue.append(selected_file)
+        self._update_recent_set()
+        return selected_file
+
+    def _update_recent_set(self):
+        # only the last n/2 picks are excluded, so that small groups can still be shuffled
+        recent_exclude_count = min(self.recent_files_queue.maxlen, math.floor(len(self.all_files) / 2))
+        new_recent_set = set(list(self.recent_files_queue)[-recent_exclude_count:]) if recent_exclude_count > 0 else set()
+        if new_recent_set == self.recent_set:
+            return
+        # sorted, so that a seeded rng picks the same files regardless of string hashing
+        for f in sorted(self.recent_set - new_recent_set):
+            if f in self.held:
+                self.held.remove(f)
+                self.eligible.add(f)
+        for f in sorted(new_recent_set - self.recent_set):
+            if f in self.eligible:
+                self.eligible.remove(f)
+                self.held.add(f)
+        self.recent_set = new_recent_set
@@ -0,0 +1,195 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal ctypes wrapper around the linux inotify API"""
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Returns a list of (wd, mask, cookie, name) tuples for all pending events"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            if not data:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                events.append((wd, mask, cookie, name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LibraryWatcher:
+    """Keeps a LibraryIndex up to date from inotify events.
+
+    inotify doesn't fire for changes made on the remote side of a network mount, so the index
+    is also refreshed from directory mtimes every fallback_interval_s (or every
+    no_inotify_interval_s if inotify isn't available at all).
+
+    on_change is called with the lists of added and removed files, or with (None, None) after
+    a refresh, since the index could then have changed in any way.
+    """
+    def __init__(self, library_index, fallback_interval_s=300, no_inotify_interval_s=60, save_interval_s=0, on_change=None):
+        self.library_index = library_index
+        self.fallback_interval_s = fallback_interval_s
+        self.no_inotify_interval_s = no_inotify_interval_s
+        self.save_interval_s = save_interval_s # 0 means the snapshot is never saved by the watcher
+        self.on_change = on_change
+        self.inotify = None
+        self.watches = {} # wd -> relative dir path
+        self.watched_dirs = {} # relative dir path -> wd
+        self.dirty = False
+        self.last_refresh_ms = None
+        self._thread = None
+
+    def start(self):
+        """Bring the index up to date, then keep it updated from a daemon thread"""
+        try:
+            self.inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            print(f"[WARN] inotify is unavailable ({e}), falling back to polling every {self.no_inotify_interval_s}s")
+            self.inotify = None
+        self._refresh()
+        self._thread = threading.Thread(target=self._run, name="library-watcher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        next_refresh = time.monotonic() + self._refresh_interval_s()
+        next_save = time.monotonic() + self.save_interval_s
+        while True:
+            timeout = max(0, min(next_refresh, next_save if self.save_interval_s else next_refresh) - time.monotonic())
+            try:
+                if self.inotify:
+                    readable, _, _ = select.select([self.inotify.fd], [], [], timeout)
+                    if readable:
+                        self._handle_events(self.inotify.read_events())
+                else:
+                    time.sleep(timeout)
+                now = time.monotonic()
+                if now >= next_refresh:
+                    self._refresh()
+                    next_refresh = now + self._refresh_interval_s()
+                if self.save_interval_s and now >= next_save:
+                    if self.dirty:
+                        self.dirty = False
+                        self.library_index.save()
+                    next_save = now + self.save_interval_s
+            except Exception as e:
+                print(f"Error in library watcher: {e}")
+                time.sleep(1)
+
+    def _refresh_interval_s(self):
+        return self.fallback_interval_s if self.inotify else self.no_inotify_interval_s
+
+    def _refresh(self):
+        start = time.monotonic()
+        if self.library_index.refresh():
+            self._changed(None, None)
+        self._sync_watches()
+        self.last_refresh_ms = (time.monotonic() - start) * 1000
+
+    def _handle_events(self, events):
+        added = []
+        removed = []
+        for wd, mask, cookie, name in events:
+            if mask & IN_Q_OVERFLOW:
+                print("[WARN] inotify queue overflowed, refreshing the library index")
+                self._refresh()
+                continue
+            if mask & IN_IGNORED:
+                rel_dir = self.watches.pop(wd, None)
+                if rel_dir is not None and self.watched_dirs.get(rel_dir) == wd:
+                    del self.watched_dirs[rel_dir]
+                continue
+            rel_dir = self.watches.get(wd)
+            if rel_dir is None or not name:
+                continue
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                removed.extend(self.library_index.remove_path(rel_path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) or (mask & IN_CREATE and mask & IN_ISDIR):
+                added_files = self.library_index.add_path(rel_path)
+                added.extend(added_files)
+                if mask & IN_ISDIR:
+                    self._sync_watches()
+        if added or removed:
+            self._changed(added, removed)
+
+    def _sync_watches(self):
+        if not self.inotify:
+            return
+        index_dirs = set(self.library_index.get_dirs())
+        for rel_dir in [d for d in self.watched_dirs if d not in index_dirs]:
+            wd = self.watched_dirs.pop(rel_dir)
+            self.watches.pop(wd, None)
+            self.inotify.rm_watch(wd)
+        for rel_dir in index_dirs:
+            if rel_dir in self.watched_dirs:
+                continue
+            path = os.path.join(self.library_index.root_dir, rel_dir) if rel_dir else self.library_index.root_dir
+            try:
+                wd = self.inotify.add_watch(path)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    print(f"[WARN] ran out of inotify watches, falling back to polling every {self.no_inotify_interval_s}s")
+                    self.fallback_interval_s = self.no_inotify_interval_s
+                    return
+                continue
+            self.watches[wd] = rel_dir
+            self.watched_dirs[rel_dir] = wd
+
+    def _changed(self, added, removed):
+        self.dirty = True
+        if self.on_change:
+            self.on_change(added, removed)
@@ -0,0 +1,8 @@
+SECOND_NS = 1000000000
+
+
+def align_to_frame(time_ns, frame_rate):
+    """Returns the running time of the first frame at or after time_ns, for a Fraction frame_rate"""
+    frame_ns = SECOND_NS * frame_rate.denominator
+    frame_index = -(-time_ns * frame_rate.numerator // frame_ns)
+    return frame_index * frame_ns // frame_rate.numerator
@@ -0,0 +1,79 @@
+import threading
+
+SERVER_CONTROL_TAG = "#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES"
+# EXT-X-SERVER-CONTROL needs at least version 6 (hlssink writes version 3)
+SERVER_CONTROL_VERSION = 6
+
+
+def get_last_msn(content):
+    """Returns the media sequence number of the last segment in a media playlist, or None if it has no segments"""
+    media_sequence = 0
+    segment_count = 0
+    for line in content.splitlines():
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            media_sequence = int(line.split(":", 1)[1])
+        elif line.startswith("#EXTINF:"):
+            segment_count += 1
+    if segment_count == 0:
+        return None
+    return media_sequence + segment_count - 1
+
+
+def add_server_control(content):
+    """Tells players that they can use _HLS_msn to block until the next segment is ready, raising
+    EXT-X-VERSION to what that tag needs"""
+    if SERVER_CONTROL_TAG in content:
+        return content
+    lines = content.splitlines()
+    version_found = False
+    for i, line in enumerate(lines):
+        if line.startswith("#EXT-X-VERSION:"):
+            version_found = True
+            try:
+                version = int(line.split(":", 1)[1])
+            except ValueError:
+                version = 0
+            lines[i] = f"#EXT-X-VERSION:{max(version, SERVER_CONTROL_VERSION)}"
+    for i, line in enumerate(lines):
+        if line.startswith("#EXT-X-TARGETDURATION:"):
+            lines.insert(i + 1, SERVER_CONTROL_TAG)
+            if not version_found and lines and lines[0] == "#EXTM3U":
+                lines.insert(1, f"#EXT-X-VERSION:{SERVER_CONTROL_VERSION}")
+            return "\n".join(lines) + "\n"
+    return content
+
+
+class PlaylistState:
+    """The latest version of each playlist, as reported by the stream process.
+
+    Requests for a media sequence number that isn't published yet wait on a condition
+    that's notified when the stream publishes a new version, so nothing has to poll.
+    """
+    def __init__(self):
+        self.playlists = {} # name -> (last msn, content)
+        self.condition = threading.Condition()
+
+    def update(self, name, content):
+        with self.condition:
+            self.playlists[name] = (get_last_msn(content), content)
+            self.condition.notify_all()
+
+    def reset(self):
+        with self.condition:
+            self.playlists.clear()
+            self.condition.notify_all()
+
+    def get(self, name):
+        """Returns (last msn, content), or None if the stream hasn't published the playlist yet"""
+        with self.condition:
+            return self.playlists.get(name)
+
+    def wait_for(self, name, msn, timeout_s):
+        """Waits until the playlist contains msn, or for timeout_s. Returns (last msn, content), or None if the stream
+        still hasn't published the playlist. Returns right away if msn is so far ahead that it must be from a previous stream"""
+        def is_ready():
+            playlist = self.playlists.get(name)
+            return playlist is not None and playlist[0] is not None and (playlist[0] >= msn or msn > playlist[0] + 2)
+        with self.condition:
+            self.condition.wait_for(is_ready, timeout_s)
+            return self.playlists.get(name)
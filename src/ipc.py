@@ -0,0 +1,127 @@
+import errno
+import json
+import os
+import socket
+import threading
+
+IPC_FD_ENV = "VTS_IPC_FD"
+MAX_MESSAGE_BYTES = 64 * 1024 # a SEQPACKET message can't be bigger than the socket's send buffer (usually ~200KB)
+# only these mean the other process is gone, any other error just loses one message
+CLOSED_ERRNOS = {errno.EPIPE, errno.ECONNRESET, errno.ENOTCONN}
+
+
+class IpcChannel:
+    """JSON messages over a unix socketpair shared by serve.py and the stream subprocess.
+
+    SOCK_SEQPACKET keeps message boundaries, so each send is exactly one message. Sends never
+    block: if the other process isn't keeping up, the message is dropped.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.send_lock = threading.Lock()
+        self.closed = False
+
+    @classmethod
+    def create_pair(cls):
+        """Returns (channel for this process, socket to pass to the child process)"""
+        parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        return cls(parent_sock), child_sock
+
+    @classmethod
+    def from_env(cls):
+        """Returns the channel passed in by the parent process, or None if there isn't one"""
+        fd = os.environ.get(IPC_FD_ENV)
+        if not fd:
+            return None
+        return cls(socket.socket(fileno=int(fd)))
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, msg_type, **fields):
+        """Returns False if the message was dropped"""
+        data = json.dumps({"type": msg_type, **fields}).encode("utf-8")
+        if len(data) > MAX_MESSAGE_BYTES:
+            print(f"[WARN] dropping a {len(data)} byte {msg_type} IPC message, the limit is {MAX_MESSAGE_BYTES}")
+            return False
+        with self.send_lock:
+            try:
+                self.sock.send(data)
+                return True
+            except BlockingIOError:
+                return False
+            except OSError as e:
+                self._on_error(e)
+                return False
+
+    def send_list(self, msg_type, key, items, **fields):
+        """Sends a list split over as many messages as needed to stay under MAX_MESSAGE_BYTES.
+        Each message has part and parts fields, so the receiver can join the list back together
+        with a ListAssembler. Returns False if any part was dropped"""
+        budget = MAX_MESSAGE_BYTES - len(json.dumps({"type": msg_type, "part": 0, "parts": 0, key: [], **fields})) - 64
+        chunks = [[]]
+        chunk_bytes = 0
+        for item in items:
+            item_bytes = len(json.dumps(item)) + 2
+            if chunks[-1] and chunk_bytes + item_bytes > budget:
+                chunks.append([])
+                chunk_bytes = 0
+            chunks[-1].append(item)
+            chunk_bytes += item_bytes
+        sent = True
+        for i, chunk in enumerate(chunks):
+            sent = self.send(msg_type, part=i, parts=len(chunks), **{key: chunk}, **fields) and sent
+        return sent
+
+    def receive(self):
+        """Returns every message that's currently available, without blocking"""
+        messages = []
+        while True:
+            try:
+                data = self.sock.recv(MAX_MESSAGE_BYTES)
+            except BlockingIOError:
+                return messages
+            except OSError as e:
+                self._on_error(e)
+                return messages
+            if not data:
+                self.closed = True
+                return messages
+            try:
+                messages.append(json.loads(data))
+            except json.JSONDecodeError as e:
+                print(f"Ignoring invalid IPC message: {e}")
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+
+    def _on_error(self, e):
+        if e.errno in CLOSED_ERRNOS:
+            self.closed = True
+        else:
+            print(f"[WARN] IPC error, the message was lost: {e}")
+
+
+class ListAssembler:
+    """Joins the parts of a list sent with IpcChannel.send_list. A list with a missing part is discarded"""
+    def __init__(self):
+        self.items = []
+        self.next_part = 0
+
+    def add(self, message, key):
+        """Returns the whole list once its last part is added, otherwise None"""
+        if message["part"] != self.next_part:
+            self.items = []
+            self.next_part = 0
+            if message["part"] != 0:
+                return None
+        self.items.extend(message[key])
+        self.next_part += 1
+        if self.next_part < message["parts"]:
+            return None
+        items = self.items
+        self.items = []
+        self.next_part = 0
+        return items
@@ -0,0 +1,70 @@
+import bisect
+import json
+import os
+import queue
+import sys
+import threading
+from low_priority import run_low_priority
+
+
+class KeyframeIndex:
+    """Finds the keyframes of files, so clips can start exactly on one instead of wherever a KEY_UNIT seek lands.
+
+    Files are indexed lazily on a background thread, by running keyframe_scan.py in a low priority subprocess.
+    The keyframe timestamps are stored in the MediaInfoCache's database, including an empty list for files
+    without any, so they aren't scanned again.
+    """
+    def __init__(self, media_info_cache, timeout_s=600, read_only=False):
+        self.media_info_cache = media_info_cache
+        self.timeout_s = timeout_s
+        self.read_only = read_only # only look up files that are already indexed
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.queue = queue.Queue()
+        if not read_only:
+            self._thread = threading.Thread(target=self._run, name="keyframe-index", daemon=True)
+            self._thread.start()
+
+    def get(self, path):
+        """Returns the sorted keyframe timestamps (in ms) of path, or None if it isn't indexed yet (in which case it's queued)"""
+        try:
+            stat_result = os.stat(path)
+            keyframes_ms = self.media_info_cache.get_keyframes(path, stat_result)
+        except OSError:
+            return None
+        if keyframes_ms is not None or self.read_only:
+            return keyframes_ms
+        with self.lock:
+            if path not in self.pending:
+                self.pending.add(path)
+                self.queue.put(path)
+        return None
+
+    def snap(self, path, seek_ms, max_ms, min_ms=0):
+        """Returns the first keyframe at or after seek_ms (or the last one before it, if that would be after max_ms).
+        Returns seek_ms itself if path isn't indexed yet, or if no keyframe is within [min_ms, max_ms]"""
+        keyframes_ms = self.get(path)
+        if not keyframes_ms:
+            return seek_ms
+        i = bisect.bisect_left(keyframes_ms, seek_ms)
+        if i < len(keyframes_ms) and keyframes_ms[i] <= max_ms:
+            return keyframes_ms[i]
+        if i > 0 and keyframes_ms[i - 1] >= min_ms:
+            return keyframes_ms[i - 1]
+        return seek_ms
+
+    def _run(self):
+        while True:
+            path = self.queue.get()
+            try:
+                stat_result = os.stat(path)
+                self.media_info_cache.put_keyframes(path, self._index(path), stat_result)
+            except Exception as e:
+                print(f"[WARN] failed to index the keyframes of {path}: {e}")
+            finally:
+                with self.lock:
+                    self.pending.discard(path)
+
+    def _index(self, path):
+        scan_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "keyframe_scan.py")
+        return json.loads(run_low_priority([sys.executable, scan_path, path], self.timeout_s))
@@ -0,0 +1,71 @@
+import argparse
+import gi
+import json
+import sys
+
+gi.require_version("Gst", "1.0")
+from gi.repository import Gst
+
+
+def index_keyframes(path):
+    """Returns the sorted stream times (in ms) of the video keyframes of path"""
+    pipeline = Gst.Pipeline.new("keyframe-index")
+    filesrc = Gst.ElementFactory.make("filesrc", None)
+    parsebin = Gst.ElementFactory.make("parsebin", None)
+    for e in [filesrc, parsebin]:
+        if not e:
+            raise Exception("failed to create a keyframe index element")
+        pipeline.add(e)
+    filesrc.set_property("location", path)
+    filesrc.link(parsebin)
+
+    keyframes_ms = []
+    segment = {}
+    def probe_callback(pad, info):
+        if info.type & Gst.PadProbeType.EVENT_DOWNSTREAM:
+            event = info.get_event()
+            if event.type == Gst.EventType.SEGMENT:
+                segment["value"] = event.parse_segment()
+            return Gst.PadProbeReturn.OK
+        buf = info.get_buffer()
+        if buf and buf.pts != Gst.CLOCK_TIME_NONE and not buf.has_flags(Gst.BufferFlags.DELTA_UNIT) and "value" in segment:
+            # seeks are in stream time, which differs from the buffer pts in files that don't start at 0 (such as .ts)
+            stream_time = segment["value"].to_stream_time(Gst.Format.TIME, buf.pts)
+            if stream_time != Gst.CLOCK_TIME_NONE and stream_time >= 0:
+                # rounded up, since a seek to a time before the keyframe lands on the previous one
+                keyframes_ms.append(-(-stream_time // Gst.MSECOND))
+        return Gst.PadProbeReturn.OK
+
+    def on_pad_added(parsebin, pad):
+        fakesink = Gst.ElementFactory.make("fakesink", None)
+        fakesink.set_property("sync", False)
+        pipeline.add(fakesink)
+        fakesink.sync_state_with_parent()
+        pad.link(fakesink.get_static_pad("sink"))
+        caps = pad.query_caps(None).to_string()
+        if caps.startswith("video/") and not keyframes_ms and "probe" not in segment:
+            segment["probe"] = True
+            pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM, probe_callback)
+    parsebin.connect("pad-added", on_pad_added)
+
+    pipeline.set_state(Gst.State.PLAYING)
+    try:
+        msg = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        if msg.type == Gst.MessageType.ERROR:
+            err, debug = msg.parse_error()
+            raise Exception(f"{err}: {debug}")
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+    return sorted(set(keyframes_ms))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="print the keyframes of a file as JSON (run by KeyframeIndex in a low priority subprocess)")
+    parser.add_argument("path")
+    args = parser.parse_args()
+    Gst.init(None)
+    try:
+        print(json.dumps(index_keyframes(args.path)))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,233 @@
+import bisect
+import json
+import os
+import threading
+
+VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv', '.webm', 'mpeg'}
+
+
+class LibraryIndex:
+    """In-memory index of every video file under root_dir, persisted as a snapshot.
+
+    Each directory is stored with the mtime it had when it was last listed. A refresh only
+    re-lists directories whose mtime changed, so its cost depends on the number of directories
+    rather than the number of files.
+    """
+    def __init__(self, root_dir, extensions=VIDEO_EXTENSIONS, snapshot_path="/metadata/library-index.json"):
+        self.root_dir = root_dir
+        self.extensions = extensions
+        self.snapshot_path = snapshot_path
+        self.dirs = {} # relative dir path -> [mtime_ns, file names, subdir names]
+        self.version = 0
+        self.lock = threading.RLock()
+        self.save_lock = threading.Lock()
+        self._files_cache = {}
+
+    def load(self):
+        """Load the snapshot from disk. Returns False if there's no usable snapshot."""
+        try:
+            with open(self.snapshot_path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Error loading library index snapshot: {e}")
+            return False
+        if not isinstance(data, dict) or data.get("root") != self.root_dir or not isinstance(data.get("dirs"), dict):
+            return False
+        with self.lock:
+            self.dirs = data["dirs"]
+            self._changed()
+        return True
+
+    def save(self):
+        """Atomically write the snapshot to disk. Returns False if it couldn't be written"""
+        with self.lock:
+            data = json.dumps({"root": self.root_dir, "dirs": self.dirs})
+        tmp_path = self.snapshot_path + ".tmp"
+        with self.save_lock:
+            try:
+                with open(tmp_path, "w") as f:
+                    f.write(data)
+                os.replace(tmp_path, self.snapshot_path)
+                return True
+            except OSError as e:
+                print(f"Error saving library index snapshot: {e}")
+                return False
+
+    def refresh(self):
+        """Re-list every directory whose mtime changed. Returns True if the index changed"""
+        with self.lock:
+            changed = False
+            seen = set()
+            stack = [""]
+            while stack:
+                rel_dir = stack.pop()
+                if rel_dir in seen:
+                    continue
+                seen.add(rel_dir)
+                try:
+                    mtime_ns = os.stat(self._abs(rel_dir)).st_mtime_ns
+                except OSError:
+                    continue
+                entry = self.dirs.get(rel_dir)
+                if not entry or entry[0] != mtime_ns:
+                    entry = self._list_dir(rel_dir, mtime_ns)
+                    if entry is None:
+                        continue
+                    if self.dirs.get(rel_dir) != entry:
+                        changed = True
+                    self.dirs[rel_dir] = entry
+                for name in entry[2]:
+                    stack.append(os.path.join(rel_dir, name))
+            for rel_dir in [d for d in self.dirs if d not in seen]:
+                del self.dirs[rel_dir]
+                changed = True
+            if changed:
+                self._changed()
+            return changed
+
+    def add_path(self, rel_path):
+        """Add a single file or directory (including everything under it).
+        Returns the relative paths of the files that weren't indexed before"""
+        with self.lock:
+            parent_dir, name = os.path.split(rel_path)
+            parent = self.dirs.get(parent_dir)
+            if parent is None:
+                return [] # the parent isn't indexed yet, the next refresh will pick it up
+            abs_path = self._abs(rel_path)
+            if os.path.isdir(abs_path):
+                before = set(self._files_under(rel_path))
+                if name not in parent[2]:
+                    bisect.insort(parent[2], name)
+                self._add_tree(rel_path)
+                added = [f for f in self._files_under(rel_path) if f not in before]
+            elif os.path.isfile(abs_path) and os.path.splitext(name)[1].lower() in self.extensions:
+                if name in parent[1]:
+                    return []
+                bisect.insort(parent[1], name)
+                added = [rel_path]
+            else:
+                return []
+            self._changed()
+            return added
+
+    def remove_path(self, rel_path):
+        """Remove a single file or directory (including everything under it).
+        Returns the relative paths of the files that were removed"""
+        with self.lock:
+            parent_dir, name = os.path.split(rel_path)
+            parent = self.dirs.get(parent_dir)
+            removed = self._files_under(rel_path)
+            changed = False
+            if parent is not None:
+                if name in parent[1]:
+                    parent[1].remove(name)
+                    removed.append(rel_path)
+                    changed = True
+                if name in parent[2]:
+                    parent[2].remove(name)
+                    changed = True
+            prefix = rel_path + os.sep
+            for rel_dir in [d for d in self.dirs if d == rel_path or d.startswith(prefix)]:
+                del self.dirs[rel_dir]
+                changed = True
+            if changed:
+                self._changed()
+            return removed
+
+    def apply_changes(self, added, removed):
+        """Add and remove files reported by another process's add_path/remove_path, without touching the disk.
+        Returns (added, removed) with only the files that actually changed, so applying the same changes twice has no effect"""
+        with self.lock:
+            actually_removed = []
+            actually_added = []
+            for rel_path in removed:
+                parent_dir, name = os.path.split(rel_path)
+                parent = self.dirs.get(parent_dir)
+                if parent is not None and name in parent[1]:
+                    parent[1].remove(name)
+                    actually_removed.append(rel_path)
+            for rel_path in added:
+                parent_dir, name = os.path.split(rel_path)
+                parent = self._ensure_dir(parent_dir)
+                if name not in parent[1]:
+                    bisect.insort(parent[1], name)
+                    actually_added.append(rel_path)
+            if actually_added or actually_removed:
+                self._changed()
+            return actually_added, actually_removed
+
+    def get_dirs(self):
+        with self.lock:
+            return list(self.dirs)
+
+    def get_files(self, base_directory=""):
+        """Return the relative paths of all indexed video files under base_directory.
+        The returned list is cached until the index changes, so callers must not modify it"""
+        with self.lock:
+            files = self._files_cache.get(base_directory)
+            if files is not None:
+                return files
+            prefix = base_directory + os.sep if base_directory else ""
+            files = []
+            for rel_dir, entry in sorted(self.dirs.items()):
+                if prefix and not (rel_dir + os.sep).startswith(prefix):
+                    continue
+                files.extend(os.path.join(rel_dir, name) for name in entry[1])
+            self._files_cache[base_directory] = files
+            return files
+
+    def _list_dir(self, rel_dir, mtime_ns):
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(self._abs(rel_dir)) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                    elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in self.extensions:
+                        files.append(entry.name)
+        except OSError as e:
+            print(f"Error listing {self._abs(rel_dir)}: {e}")
+            return None
+        files.sort()
+        subdirs.sort()
+        return [mtime_ns, files, subdirs]
+
+    def _files_under(self, rel_dir):
+        prefix = rel_dir + os.sep
+        return [os.path.join(d, name) for d, entry in self.dirs.items() if d == rel_dir or d.startswith(prefix) for name in entry[1]]
+
+    def _ensure_dir(self, rel_dir):
+        entry = self.dirs.get(rel_dir)
+        if entry is not None:
+            return entry
+        entry = self.dirs[rel_dir] = [0, [], []] # an mtime of 0, so a refresh re-lists it
+        if rel_dir:
+            parent_dir, name = os.path.split(rel_dir)
+            parent = self._ensure_dir(parent_dir)
+            if name not in parent[2]:
+                bisect.insort(parent[2], name)
+        return entry
+
+    def _add_tree(self, rel_dir):
+        stack = [rel_dir]
+        while stack:
+            current_dir = stack.pop()
+            try:
+                mtime_ns = os.stat(self._abs(current_dir)).st_mtime_ns
+            except OSError:
+                continue
+            entry = self._list_dir(current_dir, mtime_ns)
+            if entry is None:
+                continue
+            self.dirs[current_dir] = entry
+            stack.extend(os.path.join(current_dir, name) for name in entry[2])
+
+    def _abs(self, rel_dir):
+        return os.path.join(self.root_dir, rel_dir) if rel_dir else self.root_dir
+
+    def _changed(self):
+        self.version += 1
+        self._files_cache = {}
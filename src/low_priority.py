@@ -0,0 +1,25 @@
+import shutil
+import subprocess
+
+
+def low_priority_command(args):
+    """Prefixes args with nice (and ionice, where they're installed), so the command doesn't compete with the live stream"""
+    command = []
+    if shutil.which("nice"):
+        command += ["nice", "-n", "10"]
+    if shutil.which("ionice"):
+        command += ["ionice", "-c", "3"]
+    return command + args
+
+
+def run_low_priority(args, timeout_s):
+    """Runs args at a low CPU and I/O priority and returns its stdout. Raises an Exception with the last line of
+    its stderr if it fails, and kills it after timeout_s"""
+    try:
+        result = subprocess.run(low_priority_command(args), capture_output=True, text=True, timeout=timeout_s)
+    except subprocess.TimeoutExpired:
+        raise Exception(f"timed out after {timeout_s}s")
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        raise Exception(lines[-1] if lines else f"exited with status {result.returncode}")
+    return result.stdout
@@ -0,0 +1,153 @@
+import os
+from array import array
+import sqlite3
+import threading
+import time
+
+SCHEMA_VERSION = 4
+
+
+class MediaInfo:
+    def __init__(self, duration_ms, width, height, video_codec=None, audio_codec=None, framerate_num=0, framerate_denom=1, par_num=0, par_denom=1):
+        self.duration_ms = duration_ms
+        self.width = width
+        self.height = height
+        self.video_codec = video_codec # caps name of the first video stream, such as video/x-h264
+        self.audio_codec = audio_codec
+        self.framerate_num = framerate_num
+        self.framerate_denom = framerate_denom
+        self.par_num = par_num # pixel aspect ratio, 0 if unknown
+        self.par_denom = par_denom
+
+
+class MediaInfoCache:
+    """Persistent cache of Discoverer results, keyed by path + size + mtime. It also holds the keyframe
+    timestamps found by the KeyframeIndex, which can be of files that were never probed (such as proxies).
+
+    Each table is evicted least-recently-used on its own, once it has more than max_entries or
+    max_keyframe_entries rows. A hit only records its last_used time in memory, and those are
+    written in one batch every flush_interval_s, so lookups don't do any disk writes.
+
+    A read_only cache works on an in-memory copy of the database, so nothing is ever written back.
+    """
+    def __init__(self, db_path="/metadata/media-info.db", max_entries=200000, max_keyframe_entries=10000, flush_interval_s=60, read_only=False):
+        self.db_path = db_path
+        self.max_entries = {"media_info": max_entries, "keyframes": max_keyframe_entries}
+        self.flush_interval_s = flush_interval_s
+        self.hits = 0
+        self.misses = 0
+        self.last_used = {"media_info": {}, "keyframes": {}} # table -> {path: time of a hit that isn't written yet}
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        if read_only:
+            self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+            try:
+                source = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+                source.backup(self.conn)
+                source.close()
+            except sqlite3.Error:
+                pass # no usable database yet, so it starts empty
+        else:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            # it's only a cache, so an outdated schema is simply dropped
+            self.conn.execute("DROP TABLE IF EXISTS media_info")
+            self.conn.execute("DROP TABLE IF EXISTS keyframes")
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS media_info (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                duration_ms INTEGER NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                video_codec TEXT,
+                audio_codec TEXT,
+                framerate_num INTEGER,
+                framerate_denom INTEGER,
+                par_num INTEGER,
+                par_denom INTEGER,
+                last_used REAL NOT NULL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS media_info_last_used ON media_info (last_used)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS keyframes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                keyframes_ms BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS keyframes_last_used ON keyframes (last_used)")
+        self.conn.commit()
+        self.row_counts = {table: self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in self.max_entries}
+
+    def get(self, path, stat_result=None):
+        """Return the cached MediaInfo for path, or None if it's missing or the file has changed"""
+        stat_result = stat_result or os.stat(path)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT duration_ms, width, height, video_codec, audio_codec, framerate_num, framerate_denom, par_num, par_denom FROM media_info WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, stat_result.st_size, stat_result.st_mtime_ns)).fetchone()
+            if not row:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._used("media_info", path)
+        return MediaInfo(*row)
+
+    def put(self, path, info, stat_result=None):
+        stat_result = stat_result or os.stat(path)
+        with self.lock:
+            self._insert("media_info", path, (path, stat_result.st_size, stat_result.st_mtime_ns, info.duration_ms, info.width, info.height,
+                 info.video_codec, info.audio_codec, info.framerate_num, info.framerate_denom, info.par_num, info.par_denom, time.time()))
+
+    def get_keyframes(self, path, stat_result=None):
+        """Return the cached keyframe timestamps (sorted, in ms) of path, or None if they're missing or the file has changed"""
+        stat_result = stat_result or os.stat(path)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT keyframes_ms FROM keyframes WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, stat_result.st_size, stat_result.st_mtime_ns)).fetchone()
+            if not row:
+                return None
+            self._used("keyframes", path)
+        return array("q", row[0])
+
+    def put_keyframes(self, path, keyframes_ms, stat_result=None):
+        stat_result = stat_result or os.stat(path)
+        with self.lock:
+            self._insert("keyframes", path, (path, stat_result.st_size, stat_result.st_mtime_ns, array("q", keyframes_ms).tobytes(), time.time()))
+
+    def flush(self):
+        """Writes the last_used times of recent hits"""
+        with self.lock:
+            self._flush_last_used()
+
+    def _used(self, table, path):
+        self.last_used[table][path] = time.time()
+        if time.monotonic() - self.last_flush > self.flush_interval_s:
+            self._flush_last_used()
+
+    def _insert(self, table, path, values):
+        exists = self.conn.execute(f"SELECT 1 FROM {table} WHERE path = ?", (path,)).fetchone()
+        self.conn.execute(f"INSERT OR REPLACE INTO {table} VALUES ({', '.join('?' * len(values))})", values)
+        self.last_used[table].pop(path, None)
+        if not exists:
+            self.row_counts[table] += 1
+        excess = self.row_counts[table] - self.max_entries[table]
+        if excess > 0:
+            # the eviction order has to include the hits that aren't written yet
+            self._flush_last_used()
+            self.conn.execute(f"DELETE FROM {table} WHERE path IN (SELECT path FROM {table} ORDER BY last_used LIMIT ?)", (excess,))
+            self.row_counts[table] -= excess
+        self.conn.commit()
+
+    def _flush_last_used(self):
+        self.last_flush = time.monotonic()
+        for table, last_used in self.last_used.items():
+            if last_used:
+                self.conn.executemany(f"UPDATE {table} SET last_used = ? WHERE path = ?", [(t, path) for path, t in last_used.items()])
+        self.conn.commit()
+        self.last_used = {table: {} for table in self.last_used}
@@ -0,0 +1,135 @@
+import bisect
+import threading
+
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value):
+        """For counts that are already kept elsewhere (such as SegmentStore.hits), which must only go up"""
+        with self.lock:
+            self.value = value
+
+    def snapshot(self):
+        return {"name": self.name, "type": "counter", "help": self.help, "labels": self.labels, "value": self.value}
+
+
+class Gauge:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return {"name": self.name, "type": "gauge", "help": self.help, "labels": self.labels, "value": self.value}
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=DEFAULT_BUCKETS_MS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # the last one is +Inf
+        self.sum = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            cumulative = []
+            total = 0
+            for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+                total += count
+                cumulative.append([bound, total])
+            return {"name": self.name, "type": "histogram", "help": self.help, "labels": self.labels,
+                    "sum": self.sum, "count": self.count, "buckets": cumulative}
+
+
+class MetricsRegistry:
+    """Holds every metric, keyed by name and labels. Getting a metric creates it the first time,
+    so callers don't need to declare metrics up front.
+
+    Probes call these from GStreamer's streaming threads, so updates are thread safe.
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def counter(self, name, help="", **labels):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help="", **labels):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help="", **labels):
+        return self._get(Histogram, name, help, labels)
+
+    def snapshot(self):
+        """Returns a JSON-serializable list with the current value of every metric"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return [metric.snapshot() for metric in metrics]
+
+    def _get(self, metric_class, name, help, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            metric = self.metrics.get(key)
+            if not metric:
+                metric = self.metrics[key] = metric_class(name, help, labels)
+            return metric
+
+
+registry = MetricsRegistry()
+
+
+def render_prometheus(snapshot, prefix="vts_"):
+    """Formats a snapshot (or several concatenated) in the Prometheus text exposition format"""
+    lines = []
+    described = set()
+    for metric in sorted(snapshot, key=lambda metric: metric["name"]):
+        name = prefix + metric["name"]
+        if name not in described:
+            described.add(name)
+            if metric["help"]:
+                lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+        labels = metric["labels"]
+        if metric["type"] == "histogram":
+            for bound, count in metric["buckets"]:
+                lines.append(f"{name}_bucket{_format_labels(dict(labels, le=bound))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {metric['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {metric['count']}")
+        else:
+            lines.append(f"{name}{_format_labels(labels)} {metric['value']}")
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
@@ -0,0 +1,74 @@
+import gi
+import threading
+import time
+from collections import deque
+
+gi.require_version("Gst", "1.0")
+from gi.repository import Gst
+
+
+class StageTimer:
+    """Measures how long buffers take to get through part of the pipeline, with buffer probes on the pad
+    where buffers go in and the pad where they come out.
+
+    An output buffer is matched to the newest input buffer with the same or an earlier pts, since
+    elements like mpegtsmux don't output exactly one buffer per input buffer.
+    """
+    def __init__(self, histogram, in_pad, out_pad, max_pending=500):
+        self.histogram = histogram
+        self.pending = deque(maxlen=max_pending) # (pts, monotonic ns) of buffers that went in
+        self.lock = threading.Lock()
+        self.in_probe_id = in_pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_FLUSH, self._on_in)
+        self.out_probe_id = out_pad.add_probe(Gst.PadProbeType.BUFFER, self._on_out)
+
+    def _on_in(self, pad, info):
+        if info.type & Gst.PadProbeType.EVENT_FLUSH:
+            # buffers from before a seek will never come out
+            with self.lock:
+                self.pending.clear()
+            return Gst.PadProbeReturn.OK
+        buf = info.get_buffer()
+        if buf and buf.pts != Gst.CLOCK_TIME_NONE:
+            with self.lock:
+                self.pending.append((buf.pts, time.monotonic_ns()))
+        return Gst.PadProbeReturn.OK
+
+    def _on_out(self, pad, info):
+        buf = info.get_buffer()
+        if not buf or buf.pts == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+        matched_ns = None
+        with self.lock:
+            while self.pending and self.pending[0][0] <= buf.pts:
+                matched_ns = self.pending.popleft()[1]
+        if matched_ns is not None:
+            self.histogram.observe((time.monotonic_ns() - matched_ns) / 1e6)
+        return Gst.PadProbeReturn.OK
+
+
+class FrameCounter:
+    """Counts the buffers that pass through a pad"""
+    def __init__(self, counter, pad):
+        self.counter = counter
+        self.probe_id = pad.add_probe(Gst.PadProbeType.BUFFER, self._on_buffer)
+
+    def _on_buffer(self, pad, info):
+        self.counter.inc()
+        return Gst.PadProbeReturn.OK
+
+
+class LatenessProbe:
+    """Records how far behind the pipeline clock each buffer is when it reaches a pad"""
+    def __init__(self, histogram, pipeline, pad):
+        self.histogram = histogram
+        self.pipeline = pipeline
+        self.probe_id = pad.add_probe(Gst.PadProbeType.BUFFER, self._on_buffer)
+
+    def _on_buffer(self, pad, info):
+        buf = info.get_buffer()
+        clock = self.pipeline.get_clock()
+        if not buf or buf.pts == Gst.CLOCK_TIME_NONE or not clock:
+            return Gst.PadProbeReturn.OK
+        running_time = clock.get_time() - self.pipeline.get_base_time()
+        self.histogram.observe(max(0, running_time - buf.pts) / Gst.MSECOND)
+        return Gst.PadProbeReturn.OK
@@ -4,8 +4,8 @@ from typing import List, Dict
 
 
 class PresetManager:
-    def __init__(self):
-        self.filepath = "/metadata/presets.json"
+    def __init__(self, filepath="/metadata/presets.json"):
+        self.filepath = filepath
         self.presets: List[Dict] = self._load_presets()
 
     def _get_default_preset(self) -> Dict:
@@ -54,7 +54,14 @@ class PresetManager:
             "FORCE_CLEANUP_S": os.getenv("FORCE_CLEANUP_S", "2"),
             "HLS_SEG_DURATION_S": os.getenv("HLS_SEG_DURATION_S", "4"),
             "HLS_SEG_COUNT": os.getenv("HLS_SEG_COUNT", "8"),
-            "HLS_SEG_EXTRACOUNT": os.getenv("HLS_SEG_EXTRACOUNT", "5")
+            "HLS_SEG_EXTRACOUNT": os.getenv("HLS_SEG_EXTRACOUNT", "5"),
+            "HLS_OUTPUT_MODE": os.getenv("HLS_OUTPUT_MODE", "hlssink"),
+            "ABR_RENDITIONS": os.getenv("ABR_RENDITIONS", ""),
+            "ENCODER_PROFILE": os.getenv("ENCODER_PROFILE", "balanced"),
+            "PLAN_AHEAD_CLIPS": os.getenv("PLAN_AHEAD_CLIPS", "3"),
+            "FILEBIN_POOL_SIZE": os.getenv("FILEBIN_POOL_SIZE", "1"),
+            "FILEBIN_POOL_MAX_MB": os.getenv("FILEBIN_POOL_MAX_MB", "256"), # compared against an estimate, not measured memory
+            "PROXY_CACHE_MB": os.getenv("PROXY_CACHE_MB", "0")
         }
     def _load_presets(self) -> List[Dict]:
         """Attempt to load presets from file. Fallback to default if file is missing or invalid."""
@@ -0,0 +1,74 @@
+import gi
+import math
+import os
+import threading
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from media_info_cache import MediaInfo
+
+gi.require_version("Gst", "1.0")
+gi.require_version("GstPbutils", "1.0")
+from gi.repository import Gst, GstPbutils
+
+
+class ProbePool:
+    """Resolves MediaInfo on worker threads so the GLib main loop never waits on a Discoverer.
+
+    Each worker has its own synchronous Discoverer. Results are stored in the MediaInfoCache,
+    and a cache hit resolves immediately without touching a worker.
+    """
+    def __init__(self, media_info_cache, worker_count=2, timeout_s=5):
+        self.media_info_cache = media_info_cache
+        self.timeout_s = timeout_s
+        self.executor = ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix="probe")
+        self.local = threading.local()
+
+    def submit(self, path):
+        """Returns a Future that resolves to the MediaInfo of path"""
+        try:
+            stat_result = os.stat(path)
+            media_info = self.media_info_cache.get(path, stat_result)
+        except OSError as e:
+            future = Future()
+            future.set_exception(e)
+            return future
+        if media_info:
+            future = Future()
+            future.set_result(media_info)
+            return future
+        return self.executor.submit(self._probe, path, stat_result)
+
+    def _probe(self, path, stat_result):
+        media_info = self._discover(path)
+        if media_info.duration_ms > 0: # don't cache a file that might still be being copied
+            self.media_info_cache.put(path, media_info, stat_result)
+        return media_info
+
+    def _discover(self, path):
+        discoverer = getattr(self.local, "discoverer", None)
+        if not discoverer:
+            discoverer = self.local.discoverer = GstPbutils.Discoverer.new(self.timeout_s * Gst.SECOND)
+        uri = Path(path).as_uri()
+        info = discoverer.discover_uri(uri)
+        duration_ns = info.get_duration()
+
+        media_info = MediaInfo(math.floor(duration_ns / Gst.MSECOND), None, None)
+        for stream in info.get_video_streams():
+            caps = stream.get_caps()
+            if caps:
+                structure = caps.get_structure(0)
+                media_info.width = structure.get_value("width")
+                media_info.height = structure.get_value("height")
+                media_info.video_codec = structure.get_name()
+            media_info.framerate_num = stream.get_framerate_num()
+            media_info.framerate_denom = stream.get_framerate_denom()
+            media_info.par_num = stream.get_par_num()
+            media_info.par_denom = stream.get_par_denom()
+            break  # Only look at first video stream
+        for stream in info.get_audio_streams():
+            caps = stream.get_caps()
+            if caps:
+                media_info.audio_codec = caps.get_structure(0).get_name()
+            break
+        return media_info
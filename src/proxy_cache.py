@@ -0,0 +1,209 @@
+import argparse
+import gi
+import hashlib
+import os
+import queue
+import sys
+import threading
+import time
+from low_priority import run_low_priority
+
+gi.require_version("Gst", "1.0")
+from gi.repository import Gst
+
+HEAVY_CODECS = {"video/x-h265", "video/x-vp9", "video/x-av1"}
+
+
+class ProxyCache:
+    """Low-bitrate copies of heavy source files, transcoded in the background at the stream's output size.
+
+    Proxies keep the source's aspect ratio (they fit within WIDTHxHEIGHT without borders), so cropping still
+    works on them. The cache is bounded by max_bytes, evicting the least recently used proxy first.
+
+    A read_only cache only returns the proxies that already exist, and never transcodes or evicts.
+    """
+    def __init__(self, cache_dir="/metadata/proxies", max_bytes=0, quantizer=20, timeout_s=3600, read_only=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.quantizer = quantizer
+        self.timeout_s = timeout_s
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        self.proxies = {} # filename -> [size, last_used]
+        self.pending = set() # filenames queued or being transcoded
+        self.queue = queue.Queue()
+        if not read_only:
+            os.makedirs(cache_dir, exist_ok=True)
+        for filename in os.listdir(cache_dir) if os.path.isdir(cache_dir) else []:
+            path = os.path.join(cache_dir, filename)
+            if filename.endswith(".tmp"):
+                if not read_only:
+                    os.remove(path)
+            elif filename.endswith(".mkv"):
+                stat_result = os.stat(path)
+                self.proxies[filename] = [stat_result.st_size, stat_result.st_mtime]
+        if not read_only:
+            self._thread = threading.Thread(target=self._run, name="proxy-cache", daemon=True)
+            self._thread.start()
+
+    def is_heavy(self, media_info, width, height):
+        """Whether decoding the source costs noticeably more than decoding a proxy would"""
+        if not media_info.width or not media_info.height:
+            return False
+        if media_info.video_codec in HEAVY_CODECS:
+            return True
+        return media_info.width * media_info.height > width * height * 2
+
+    def get(self, path, media_info, width, height):
+        """Returns (proxy path, proxy width, proxy height) if there's a proxy for path, otherwise queues
+        a transcode (if the source is heavy) and returns None"""
+        if not self.max_bytes or not self.is_heavy(media_info, width, height):
+            return None
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+        proxy_width, proxy_height = self._get_proxy_size(media_info, width, height)
+        filename = self._get_filename(path, stat_result, proxy_width, proxy_height)
+        with self.lock:
+            entry = self.proxies.get(filename)
+            if entry:
+                proxy_path = os.path.join(self.cache_dir, filename)
+                if not self.read_only:
+                    entry[1] = time.time()
+                    try:
+                        os.utime(proxy_path)
+                    except OSError:
+                        pass
+                return proxy_path, proxy_width, proxy_height
+            if filename not in self.pending and not self.read_only:
+                self.pending.add(filename)
+                self.queue.put((path, filename, media_info, proxy_width, proxy_height))
+        return None
+
+    def set_max_bytes(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def get_total_bytes(self):
+        with self.lock:
+            return sum(entry[0] for entry in self.proxies.values())
+
+    def _get_proxy_size(self, media_info, width, height):
+        scale = min(width / media_info.width, height / media_info.height, 1)
+        # x264 needs even dimensions
+        return max(2, round(media_info.width * scale / 2) * 2), max(2, round(media_info.height * scale / 2) * 2)
+
+    def _get_filename(self, path, stat_result, proxy_width, proxy_height):
+        key = f"{path}\0{stat_result.st_size}\0{stat_result.st_mtime_ns}"
+        return f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}-{proxy_width}x{proxy_height}.mkv"
+
+    def _run(self):
+        while True:
+            path, filename, media_info, proxy_width, proxy_height = self.queue.get()
+            proxy_path = os.path.join(self.cache_dir, filename)
+            temp_path = proxy_path + ".tmp"
+            try:
+                if self.max_bytes:
+                    print(f"[INFO] transcoding a proxy of {path}")
+                    self._transcode(path, temp_path, media_info, proxy_width, proxy_height)
+                    os.replace(temp_path, proxy_path)
+                    with self.lock:
+                        self.proxies[filename] = [os.path.getsize(proxy_path), time.time()]
+                        self._evict()
+            except Exception as e:
+                print(f"[WARN] failed to transcode a proxy of {path}: {e}")
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+            finally:
+                with self.lock:
+                    self.pending.discard(filename)
+
+    def _transcode(self, path, temp_path, media_info, proxy_width, proxy_height):
+        # in a subprocess, so it can run at a low priority without lowering the stream's own threads
+        args = [sys.executable, os.path.abspath(__file__), path, temp_path, str(proxy_width), str(proxy_height), str(self.quantizer)]
+        if media_info.audio_codec:
+            args.append("--audio")
+        run_low_priority(args, self.timeout_s)
+
+    def _evict(self):
+        total_bytes = sum(entry[0] for entry in self.proxies.values())
+        for filename, entry in sorted(self.proxies.items(), key=lambda item: item[1][1]):
+            if total_bytes <= self.max_bytes:
+                return
+            try:
+                os.remove(os.path.join(self.cache_dir, filename))
+            except OSError:
+                pass
+            total_bytes -= entry[0]
+            del self.proxies[filename]
+
+
+def transcode(path, temp_path, proxy_width, proxy_height, quantizer, with_audio):
+    """Transcodes path to an H.264 (and AAC) .mkv at temp_path"""
+    pipeline = Gst.Pipeline.new("proxy-transcode")
+    filesrc = Gst.ElementFactory.make("filesrc", None)
+    decodebin = Gst.ElementFactory.make("decodebin", None)
+    video_elements = [Gst.ElementFactory.make(name, None) for name in ("queue", "videoconvert", "videoscale", "capsfilter", "x264enc", "h264parse", "queue")]
+    audio_elements = [Gst.ElementFactory.make(name, None) for name in ("queue", "audioconvert", "audioresample", "avenc_aac", "queue")] if with_audio else []
+    matroskamux = Gst.ElementFactory.make("matroskamux", None)
+    filesink = Gst.ElementFactory.make("filesink", None)
+    for e in [filesrc, decodebin, matroskamux, filesink] + video_elements + audio_elements:
+        if not e:
+            raise Exception("failed to create a transcode element")
+        pipeline.add(e)
+
+    filesrc.set_property("location", path)
+    video_elements[3].set_property("caps", Gst.Caps.from_string(f"video/x-raw, width={proxy_width}, height={proxy_height}, pixel-aspect-ratio=1/1"))
+    x264enc = video_elements[4]
+    x264enc.set_property("speed-preset", "veryfast")
+    x264enc.set_property("pass", "qual")
+    x264enc.set_property("quantizer", quantizer)
+    # frequent keyframes, so clips can seek anywhere in the proxy cheaply
+    x264enc.set_property("key-int-max", 60)
+    filesink.set_property("location", temp_path)
+
+    filesrc.link(decodebin)
+    for branch in (video_elements, audio_elements):
+        for a, b in zip(branch, branch[1:]):
+            a.link(b)
+        if branch:
+            branch[-1].link(matroskamux)
+    matroskamux.link(filesink)
+
+    def on_pad_added(decodebin, pad):
+        caps = pad.query_caps(None).to_string()
+        if caps.startswith("video/") and not video_elements[0].get_static_pad("sink").is_linked():
+            pad.link(video_elements[0].get_static_pad("sink"))
+        elif caps.startswith("audio/") and audio_elements and not audio_elements[0].get_static_pad("sink").is_linked():
+            pad.link(audio_elements[0].get_static_pad("sink"))
+    decodebin.connect("pad-added", on_pad_added)
+
+    pipeline.set_state(Gst.State.PLAYING)
+    try:
+        msg = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        if msg.type == Gst.MessageType.ERROR:
+            err, debug = msg.parse_error()
+            raise Exception(f"{err}: {debug}")
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="transcode a proxy (run by ProxyCache in a low priority subprocess)")
+    parser.add_argument("path")
+    parser.add_argument("temp_path")
+    parser.add_argument("proxy_width", type=int)
+    parser.add_argument("proxy_height", type=int)
+    parser.add_argument("quantizer", type=int)
+    parser.add_argument("--audio", action="store_true", help="the source has audio")
+    args = parser.parse_args()
+    Gst.init(None)
+    try:
+        transcode(args.path, args.temp_path, args.proxy_width, args.proxy_height, args.quantizer, args.audio)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
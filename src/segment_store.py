@@ -0,0 +1,82 @@
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+
+
+class Segment:
+    def __init__(self, data, mtime_ns):
+        self.data = data
+        self.mtime_ns = mtime_ns
+        self.etag = f'"{mtime_ns:x}-{len(data):x}"'
+        self.last_modified = formatdate(mtime_ns / 1e9, usegmt=True)
+
+
+class SegmentStore:
+    """Keeps the most recent HLS segments in memory, so that every viewer of the stream is
+    served from the same buffer instead of re-reading the file from disk.
+
+    A segment is only re-read if its size or mtime changed (such as when the stream restarts
+    and reuses segment names).
+    """
+    def __init__(self, directory, capacity):
+        self.directory = directory
+        self.capacity = capacity
+        self.segments = OrderedDict() # relative path -> Segment
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, rel_path):
+        """Returns the Segment for a path relative to the directory, or None if it doesn't exist"""
+        rel_path = os.path.normpath(rel_path.lstrip("/"))
+        if rel_path.startswith(".."):
+            return None
+        path = os.path.join(self.directory, rel_path)
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            segment = self.segments.get(rel_path)
+            if segment and segment.mtime_ns == stat_result.st_mtime_ns and len(segment.data) == stat_result.st_size:
+                self.segments.move_to_end(rel_path)
+                self.hits += 1
+                return segment
+            self.misses += 1
+        try:
+            with open(path, "rb") as f:
+                segment = Segment(f.read(), stat_result.st_mtime_ns)
+        except OSError:
+            return None
+        with self.lock:
+            self.segments[rel_path] = segment
+            self.segments.move_to_end(rel_path)
+            while len(self.segments) > self.capacity:
+                self.segments.popitem(last=False)
+        return segment
+
+    def set_capacity(self, capacity):
+        with self.lock:
+            self.capacity = capacity
+
+
+def parse_range(range_header, size):
+    """Parses a single 'bytes=' range. Returns (start, end) inclusive, None if there's no usable
+    range header, or False if the range can't be satisfied"""
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_str, _, end_str = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if not start_str:
+            length = int(end_str)
+            if length <= 0:
+                return False
+            return (max(0, size - length), size - 1)
+        start = int(start_str)
+        end = int(end_str) if end_str else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return (start, min(end, size - 1))
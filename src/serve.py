@@ -1,30 +1,114 @@
 import http.server
-import socketserver
 import functools
 import json
-import re
 import os
 import subprocess
 import atexit
 import signal
-from datetime import datetime, UTC
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import time
+import select
+from urllib.parse import urlsplit, parse_qs
 from preset_manager import PresetManager
+from library_index import LibraryIndex, VIDEO_EXTENSIONS
+from file_watcher import LibraryWatcher
+from file_filter import FileFilter, ClassificationCache
+from ipc import IpcChannel, ListAssembler, IPC_FD_ENV
+from segment_store import SegmentStore, parse_range
+from hls_playlist import PlaylistState, add_server_control
+from metrics import registry, render_prometheus
 
 PORT = 3000
+HTTP_WORKER_COUNT = 32
+HTTP_QUEUE_LENGTH = 64 # connections that can wait for a worker, more than that are turned away with a 503
+HTTP_LONG_POLL_LIMIT = 16 # blocking playlist reloads held at once, so some workers are always left for segments
 DIRECTORY = "serve"
-LAST_ACTIVITY_FILE = "last-activity.txt"
+ACTIVITY_MESSAGE_INTERVAL_S = 0.1
 PRESETS_FILE = "presets.json"
+LIBRARY_SAVE_S = 30
+# these change the pipeline's outputs (FRAME_RATE and HLS_SEG_DURATION_S also set the encoder's keyframe interval)
+RESTART_PRESET_KEYS = ["HLS_OUTPUT_MODE", "ABR_RENDITIONS", "ENCODER_PROFILE", "FRAME_RATE", "HLS_SEG_DURATION_S"]
 
 stream_process = None
+stream_channel = None
+stream_lock = threading.Lock()
+last_activity_sent = 0
+library_index = LibraryIndex("/media", VIDEO_EXTENSIONS)
+library_index.load()
+library_reload_pending = False
+classification_cache = ClassificationCache(library_index)
+segment_store = SegmentStore("/hls", 0)
+playlist_state = PlaylistState()
+stream_metrics = (None, []) # (monotonic time received, snapshot) of the latest metrics from the stream
+long_poll_slots = threading.BoundedSemaphore(HTTP_LONG_POLL_LIMIT)
+
+class PooledHTTPServer(http.server.HTTPServer):
+    """Handles each connection on a bounded pool of worker threads, so one slow client
+    (such as a TV downloading a segment) doesn't block every other client.
+
+    At most queue_length connections wait for a worker. Past that, new connections get a 503
+    right away instead of piling up in the executor's queue.
+    """
+    def __init__(self, server_address, handler_class, worker_count, queue_length):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix="http")
+        self.slots = threading.BoundedSemaphore(worker_count + queue_length)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            registry.counter("http_rejected_total", "Connections turned away because every worker and queue slot was taken").inc()
+            try:
+                request.sendall(b"HTTP/1.0 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Length: 0\r\n\r\n")
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self.executor.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
 
 class RequestHandler(http.server.SimpleHTTPRequestHandler):
     preset_manager = PresetManager()
 
+    def handle_one_request(self):
+        start = time.monotonic()
+        self.response_code = None
+        self.response_length = 0
+        super().handle_one_request()
+        if self.response_code is None:
+            return
+        route = get_route(urlsplit(getattr(self, "path", "")).path)
+        registry.histogram("http_request_ms", "Time to handle a request", route=route).observe((time.monotonic() - start) * 1000)
+        registry.counter("http_requests_total", "Requests handled", route=route, code=self.response_code).inc()
+        if self.command != "HEAD":
+            registry.counter("http_bytes_total", "Response body bytes sent", route=route).inc(self.response_length)
+
+    def send_response(self, code, message=None):
+        self.response_code = code
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == "content-length":
+            self.response_length = int(value)
+        super().send_header(keyword, value)
+
     def end_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, PUT, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Range, Content-Type, Origin, Accept')
-        if self.path.endswith(".m3u8"):
+        if urlsplit(self.path).path.endswith(".m3u8"):
             self.send_header('Cache-Control', 'no-cache')
         super().end_headers()
 
@@ -46,10 +130,25 @@ class RequestHandler(http.server.SimpleHTTPRequestHandler):
         if self.path == "/files":
             self.handle_get_files()
             return
-        if self.path.endswith(".m3u8"):
+        if self.path == "/metrics":
+            self.handle_get_metrics()
+            return
+        path = urlsplit(self.path).path
+        if path.endswith(".m3u8"):
             self.update_last_activity()
+            self.handle_get_playlist()
+            return
+        if path.endswith(".ts"):
+            self.handle_get_segment()
+            return
         super().do_GET()
 
+    def do_HEAD(self):
+        if urlsplit(self.path).path.endswith(".ts"):
+            self.handle_get_segment(head_only=True)
+            return
+        super().do_HEAD()
+
     def do_PUT(self):
         if self.path == "/presets":
             self.handle_put_presets()
@@ -81,8 +180,16 @@ class RequestHandler(http.server.SimpleHTTPRequestHandler):
             if not isinstance(presets, list):
                 self.send_error(400, "Expected a JSON array")
                 return
+            old_preset = self.preset_manager.get_active_preset()
+            old_values = [old_preset.get(key) for key in RESTART_PRESET_KEYS]
             self.preset_manager.set_presets(presets)
-            signal_stream_presets_changed()
+            active_preset = self.preset_manager.get_active_preset()
+            update_segment_capacity(active_preset)
+            if [active_preset.get(key) for key in RESTART_PRESET_KEYS] != old_values:
+                # these change the pipeline's outputs, so the stream has to be rebuilt
+                restart_stream()
+            else:
+                signal_stream_presets_changed()
             self.send_response(200)
             self.send_header("Content-Type", "application/json")
             self.end_headers()
@@ -94,11 +201,102 @@ class RequestHandler(http.server.SimpleHTTPRequestHandler):
 
     def handle_get_files(self):
         active_preset = self.preset_manager.get_active_preset()
-        suppressed_files, neutral_files, boosted_files, excluded_files = get_files(active_preset)
+        body = get_files_json(active_preset)
         self.send_response(200)
         self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_get_metrics(self):
+        received, snapshot = stream_metrics
+        # an old snapshot means the stream's main loop is stuck (or the stream isn't running)
+        age_s = time.monotonic() - received if received else -1
+        registry.gauge("stream_metrics_age_s", "Seconds since the stream last sent metrics, -1 if it never has").set(round(age_s, 3))
+        registry.gauge("stream_running", "Whether the stream subprocess is running").set(1 if stream_process and stream_process.poll() is None else 0)
+        registry.counter("segment_store_hits", "Segment requests answered from memory").set(segment_store.hits)
+        registry.counter("segment_store_misses", "Segment requests that read the file").set(segment_store.misses)
+        # the library is watched here, so the stream only reports this when it runs on its own
+        if library_watcher.last_refresh_ms is not None:
+            registry.gauge("library_refresh_ms", "Duration of the latest library rescan").set(round(library_watcher.last_refresh_ms, 1))
+        body = render_prometheus(registry.snapshot() + [dict(metric, labels=dict(metric["labels"], source="stream")) for metric in snapshot]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_get_playlist(self):
+        url = urlsplit(self.path)
+        name = os.path.normpath(url.path.lstrip("/"))
+        if name.startswith(".."):
+            self.send_error(404, "Playlist not found")
+            return
+        query = parse_qs(url.query)
+        # _HLS_skip is ignored since delta updates aren't advertised, so the full playlist is always sent
+        try:
+            msn = int(query["_HLS_msn"][0]) if "_HLS_msn" in query else None
+        except ValueError:
+            self.send_error(400, "Invalid _HLS_msn")
+            return
+        if msn is not None and long_poll_slots.acquire(blocking=False):
+            # hold the request until the segment is published, for up to 3 target durations like LL-HLS recommends
+            try:
+                timeout_s = 3 * float(self.preset_manager.get_active_preset()["HLS_SEG_DURATION_S"])
+                playlist = playlist_state.wait_for(name, msn, timeout_s)
+            finally:
+                long_poll_slots.release()
+        else:
+            if msn is not None:
+                # every long-poll slot is taken, so answer with the current playlist rather than hold another worker
+                registry.counter("http_long_polls_refused_total", "Blocking playlist reloads answered right away because too many were waiting").inc()
+            playlist = playlist_state.get(name)
+        if playlist:
+            content = playlist[1]
+        else:
+            # the stream hasn't published this playlist over IPC yet
+            try:
+                with open(os.path.join("/hls", name), "r") as f:
+                    content = f.read()
+            except OSError:
+                self.send_error(404, "Playlist not found")
+                return
+        body = add_server_control(content).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.apple.mpegurl")
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
-        self.wfile.write(json.dumps([suppressed_files, neutral_files, boosted_files, excluded_files]).encode("utf-8"))
+        self.wfile.write(body)
+
+    def handle_get_segment(self, head_only=False):
+        segment = segment_store.get(urlsplit(self.path).path)
+        if not segment:
+            self.send_error(404, "Segment not found")
+            return
+        if self.headers.get("If-None-Match") == segment.etag:
+            self.send_response(304)
+            self.send_header("ETag", segment.etag)
+            self.end_headers()
+            return
+        size = len(segment.data)
+        byte_range = parse_range(self.headers.get("Range"), size)
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.end_headers()
+            return
+        start, end = byte_range or (0, size - 1)
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", "video/mp2t")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", segment.etag)
+        self.send_header("Last-Modified", segment.last_modified)
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if not head_only:
+            self.wfile.write(memoryview(segment.data)[start:end + 1])
 
     def handle_restart(self):
         try:
@@ -111,125 +309,101 @@ class RequestHandler(http.server.SimpleHTTPRequestHandler):
             self.send_error(500, f"Failed to restart stream: {e}")
 
     def update_last_activity(self):
-        try:
-            now = datetime.now(UTC)
-            with open(LAST_ACTIVITY_FILE, "w") as f:
-                f.write(now.isoformat())
-        except Exception as e:
-            print(f"Error writing last activity file: {e}")
+        global last_activity_sent
+        now = time.monotonic()
+        if now - last_activity_sent < ACTIVITY_MESSAGE_INTERVAL_S:
+            return
+        last_activity_sent = now
+        channel = stream_channel
+        if channel:
+            channel.send("activity")
 
 def get_files(active_preset):
-    # this is largely copy-pasted from stream.py. 
-    # first recreate stream.py's settings object
-    class Settings:
-        pass
-    settings = Settings()
-    settings.input_root_dir = "/media"
-    video_extensions = {'.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv', '.webm', 'mpeg'}
-    settings.base_directory = active_preset["BASE_DIRECTORY"].strip(" \t\n\r/\\")
-    settings.exclude_startswith_csv = active_preset["EXCLUDE_STARTSWITH_CSV"].strip(" \t\n\r")
-    settings.exclude_contains_csv = active_preset["EXCLUDE_CONTAINS_CSV"].strip(" \t\n\r")
-    settings.exclude_notstartswith_csv = active_preset["EXCLUDE_NOTSTARTSWITH_CSV"].strip(" \t\n\r")
-    settings.exclude_notcontains_csv = active_preset["EXCLUDE_NOTCONTAINS_CSV"].strip(" \t\n\r")
-    settings.boosted_startswith_csv = active_preset["BOOSTED_STARTSWITH_CSV"].strip(" \t\n\r")
-    settings.boosted_contains_csv = active_preset["BOOSTED_CONTAINS_CSV"].strip(" \t\n\r")
-    settings.boosted_notstartswith_csv = active_preset["BOOSTED_NOTSTARTSWITH_CSV"].strip(" \t\n\r")
-    settings.boosted_notcontains_csv = active_preset["BOOSTED_NOTCONTAINS_CSV"].strip(" \t\n\r")
-    settings.boosted_factor = int(active_preset["BOOSTED_FACTOR"])
-    settings.suppressed_startswith_csv = active_preset["SUPPRESSED_STARTSWITH_CSV"].strip(" \t\n\r")
-    settings.suppressed_contains_csv = active_preset["SUPPRESSED_CONTAINS_CSV"].strip(" \t\n\r")
-    settings.suppressed_notstartswith_csv = active_preset["SUPPRESSED_NOTSTARTSWITH_CSV"].strip(" \t\n\r")
-    settings.suppressed_notcontains_csv = active_preset["SUPPRESSED_NOTCONTAINS_CSV"].strip(" \t\n\r")
-    settings.suppressed_factor = int(active_preset["SUPPRESSED_FACTOR"])
-
-    # now the only difference is that we're also tracking excluded_files
-    excluded_files = []
-    suppressed_files = []
-    neutral_files = []
-    boosted_files = []
-    def get_contain_pattern(csv):
-        if not csv:
-            return None
-        lower_terms = [term.strip().lower() for term in csv.split(",") if term.strip()]
-        return re.compile("|".join(re.escape(term) for term in lower_terms))
-    def get_startswith_list(csv):
-        if not csv:
-            return None
-        return [term.strip().lstrip("/").lower() for term in csv.split(",") if term.strip()]
-    exclude_startswith_list = get_startswith_list(settings.exclude_startswith_csv)
-    exclude_contains_pattern = get_contain_pattern(settings.exclude_contains_csv)
-    exclude_notstartswith_list = get_startswith_list(settings.exclude_notstartswith_csv)
-    exclude_notcontains_pattern = get_contain_pattern(settings.exclude_notcontains_csv)
-
-    boosted_startswith_list = get_startswith_list(settings.boosted_startswith_csv)
-    boosted_contains_pattern = get_contain_pattern(settings.boosted_contains_csv)
-    boosted_notstartswith_list = get_startswith_list(settings.boosted_notstartswith_csv)
-    boosted_notcontains_pattern = get_contain_pattern(settings.boosted_notcontains_csv)
-
-    suppressed_startswith_list = get_startswith_list(settings.suppressed_startswith_csv)
-    suppressed_contains_pattern = get_contain_pattern(settings.suppressed_contains_csv)
-    suppressed_notstartswith_list = get_startswith_list(settings.suppressed_notstartswith_csv)
-    suppressed_notcontains_pattern = get_contain_pattern(settings.suppressed_notcontains_csv)
-
-    stack = [os.path.join(settings.input_root_dir, settings.base_directory)]
-    while stack:
-        current_dir = stack.pop()
-        with os.scandir(current_dir) as it:
-            for entry in it:
-                if entry.is_dir():
-                    stack.append(entry.path)
-                elif not entry.is_file():
-                    continue 
-                if not os.path.splitext(entry.name)[1].lower() in video_extensions:
-                    continue
-                path = os.path.relpath(entry.path, start=settings.input_root_dir)
-                if settings.base_directory:
-                    lower_path = path[len(settings.base_directory) + 1:].lower()
-                else:
-                    lower_path = path.lower()
-                if (
-                    (exclude_startswith_list and any(lower_path.startswith(p) for p in exclude_startswith_list))
-                    or (exclude_contains_pattern and bool(exclude_contains_pattern.search(lower_path)))
-                    or (exclude_notstartswith_list and not any(lower_path.startswith(p) for p in exclude_notstartswith_list))
-                    or (exclude_notcontains_pattern and not bool(exclude_notcontains_pattern.search(lower_path)))
-                ):
-                    excluded_files.append(path)
-                    continue
-                bias=0
-                if (
-                    (boosted_startswith_list and any(lower_path.startswith(p) for p in boosted_startswith_list))
-                    or (boosted_contains_pattern and bool(boosted_contains_pattern.search(lower_path)))
-                    or (boosted_notstartswith_list and not any(lower_path.startswith(p) for p in boosted_notstartswith_list))
-                    or (boosted_notcontains_pattern and not bool(boosted_notcontains_pattern.search(lower_path)))
-                ):
-                    bias+=1
-                if (
-                    (suppressed_startswith_list and any(lower_path.startswith(p) for p in suppressed_startswith_list))
-                    or (suppressed_contains_pattern and bool(suppressed_contains_pattern.search(lower_path)))
-                    or (suppressed_notstartswith_list and not any(lower_path.startswith(p) for p in suppressed_notstartswith_list))
-                    or (suppressed_notcontains_pattern and not bool(suppressed_notcontains_pattern.search(lower_path)))
-                ):
-                    bias-=1
-                if bias == -1:
-                    suppressed_files.append(path)
-                elif bias == 0:
-                    neutral_files.append(path)
-                else:
-                    boosted_files.append(path)
-    return (suppressed_files, neutral_files, boosted_files, excluded_files)
+    return classification_cache.get(FileFilter(active_preset))
+
+last_files_response = (None, None) # (classified lists, encoded json)
+def get_files_json(active_preset):
+    global last_files_response
+    files = get_files(active_preset)
+    if files is not last_files_response[0]:
+        last_files_response = (files, json.dumps(list(files)).encode("utf-8"))
+    return last_files_response[1]
+
+def get_route(path):
+    """Groups request paths for metrics, so that each segment doesn't get its own label"""
+    if path in ("/presets", "/files", "/restart", "/metrics"):
+        return path
+    if path.endswith(".m3u8"):
+        return "playlist"
+    if path.endswith(".ts"):
+        return "segment"
+    return "static"
+
+def update_segment_capacity(active_preset):
+    rendition_count = 1 + len([item for item in active_preset.get("ABR_RENDITIONS", "").split(",") if item.strip()])
+    segment_store.set_capacity((int(active_preset["HLS_SEG_COUNT"]) + int(active_preset["HLS_SEG_EXTRACOUNT"])) * rendition_count)
+
+def read_stream_messages(channel):
+    global stream_metrics
+    metrics_assembler = ListAssembler()
+    while not channel.closed:
+        try:
+            select.select([channel], [], [])
+        except (OSError, ValueError):
+            return
+        for message in channel.receive():
+            if message["type"] == "playlist":
+                playlist_state.update(message["name"], message["content"])
+                # load the new segment before players ask for it
+                segments = [line for line in message["content"].splitlines() if line and not line.startswith("#")]
+                if segments:
+                    segment_store.get(os.path.join(os.path.dirname(message["name"]), segments[-1]))
+            elif message["type"] == "metrics":
+                # a large snapshot is split over several messages
+                metrics = metrics_assembler.add(message, "metrics")
+                if metrics is not None:
+                    stream_metrics = (time.monotonic(), metrics)
+        if library_reload_pending:
+            send_library_reload(channel)
+
+def on_library_change(added, removed):
+    """Called on the library watcher's thread. serve.py is the only process that watches the library,
+    so it forwards every change to the stream"""
+    channel = stream_channel
+    if not channel:
+        return
+    # a whole directory can be too big for one message, in which case the stream reloads the snapshot instead
+    if added is None or not channel.send("library_changes", added=added, removed=removed):
+        send_library_reload(channel)
+
+def send_library_reload(channel):
+    """Saves the snapshot and tells the stream to reload it. If that fails, it's retried on the next message from the stream"""
+    global library_reload_pending
+    library_reload_pending = not (library_index.save() and channel.send("library_reload"))
 
 def start_stream():
-    global stream_process
+    global stream_process, stream_channel
     if stream_process and stream_process.poll() is None:
         stop_stream()
     
+    # the stream is told about player activity over a socketpair, instead of a file
+    channel, child_sock = IpcChannel.create_pair()
+    # changes after this point are sent to the stream, and everything before it is in the snapshot it loads
+    stream_channel = channel
+    library_index.save()
     stream_process = subprocess.Popen([
         'python3', '-u', 'stream.py'
-    ])
+    ], pass_fds=[child_sock.fileno()], env=dict(os.environ, **{IPC_FD_ENV: str(child_sock.fileno())}))
+    child_sock.close()
+    playlist_state.reset()
+    threading.Thread(target=read_stream_messages, args=(channel,), name="stream-ipc", daemon=True).start()
     print(f"Started stream process with PID: {stream_process.pid}")
 
 def stop_stream():
-    global stream_process
+    global stream_process, stream_channel
+    if stream_channel:
+        stream_channel.close()
+        stream_channel = None
     if stream_process and stream_process.poll() is None:
         print(f"Stopping stream process {stream_process.pid}")
         stream_process.terminate()
@@ -243,25 +417,33 @@ def stop_stream():
 
 def restart_stream():
     print("Restarting stream...")
-    start_stream()
+    with stream_lock:
+        start_stream()
 
 def signal_stream_presets_changed():
     global stream_process
-    if stream_process and stream_process.poll() is None:
-        try:
-            stream_process.send_signal(signal.SIGUSR1)
-            print("Sent presets changed signal to stream process")
-        except Exception as e:
-            print(f"Failed to signal stream process: {e}")
-    else:
-        print("No running stream process to signal")
+    with stream_lock:
+        if stream_process and stream_process.poll() is None:
+            try:
+                stream_process.send_signal(signal.SIGUSR1)
+                print("Sent presets changed signal to stream process")
+            except Exception as e:
+                print(f"Failed to signal stream process: {e}")
+        else:
+            print("No running stream process to signal")
 
 atexit.register(stop_stream)
 
+library_watcher = LibraryWatcher(library_index, save_interval_s=LIBRARY_SAVE_S, on_change=on_library_change)
+
+update_segment_capacity(RequestHandler.preset_manager.get_active_preset())
+
+library_watcher.start()
+
 start_stream()
 
 handler = functools.partial(RequestHandler, directory=DIRECTORY)
 
-with socketserver.TCPServer(("", PORT), handler) as httpd:
+with PooledHTTPServer(("", PORT), handler, HTTP_WORKER_COUNT, HTTP_QUEUE_LENGTH) as httpd:
     print(f"Serving at http://0.0.0.0:{PORT}")
     httpd.serve_forever()
\ No newline at end of file
@@ -1,42 +1,85 @@
+import argparse
+import contextlib
 import gi
+import json
 import os
 import random
+import sys
 import math
 import re
 import signal
 import glob
-from pathlib import Path
 from fractions import Fraction
 from collections import deque
-from datetime import datetime, timedelta, UTC
+import time
 
 from preset_manager import PresetManager
+from library_index import LibraryIndex, VIDEO_EXTENSIONS
+from file_watcher import LibraryWatcher, Inotify, IN_CLOSE_WRITE, IN_MOVED_TO
+from media_info_cache import MediaInfoCache
+from probe_pool import ProbePool
+from proxy_cache import ProxyCache
+from keyframe_index import KeyframeIndex
+from encoder_profiles import get_encoder_profile, estimate_bitrate_kbps
+from metrics import registry
+from pipeline_metrics import StageTimer, FrameCounter, LatenessProbe
+from clip_planner import ClipPlanner
+from stream_clock import LiveClock, OfflineClock
+from frame_time import align_to_frame
+from file_group import FileGroup
+from file_filter import FileFilter, ClassificationCache, SUPPRESSED, NEUTRAL, BOOSTED
+from ipc import IpcChannel
 
 gi.require_version("Gst", "1.0")
 gi.require_version("GLib", "2.0")
-gi.require_version("GstPbutils", "1.0")
 gi.require_version("GstController", "1.0")
-from gi.repository import Gst, GLib, GObject, GstPbutils, GstController
+from gi.repository import Gst, GLib, GObject, GstController
 
 # the initial pipeline looks like this
 # videotestsrc -> videoconvert -> capsfilter -> compositor c -> textoverlay -> x264enc -> queue -> mpegtsmux m -> hlssink
 # audiomixer am -> avenc_aac -> queue -> m
+# with HLS_OUTPUT_MODE=hlssink2, both queues link directly to hlssink2 (which muxes internally)
+# textoverlay and avenc_aac actually link to a tee, with one x264enc -> mux -> hlssink branch per ABR_RENDITIONS item (plus the main one)
 
 # The filebin element internally contains the following: 
 # filesrc -> decodebin -> [decodebin-video-src] -> video_identity -> videoconvert -> videoscale -> capsfilter -> c
+#  (the videocrop & videoscale are left out for sources that are already at the output size)
 #  [decodebin-audio-src] -> audioconvert -> audioresample -> audio_identity -> am
 Gst.init(None)
 
 class Settings:
     pass
 settings = Settings()
+# the directories can be overridden so that the benchmarks in bench/ can run the stream against a synthetic library
+settings.input_root_dir = os.getenv("VTS_MEDIA_DIR", "/media")
+settings.output_dir = os.getenv("VTS_HLS_DIR", "/hls")
+settings.metadata_dir = os.getenv("VTS_METADATA_DIR", "/metadata")
+settings.seed = int(os.getenv("VTS_SEED")) if os.getenv("VTS_SEED") else None # makes clip selection reproducible
 
 def decimal_to_fraction_string(decimal_value: float, max_denominator: int = 1001) -> str:
     fraction = Fraction(decimal_value).limit_denominator(max_denominator)
     return f"{fraction.numerator}/{fraction.denominator}"
 
+def parse_renditions(renditions_csv: str):
+    """Parses a csv like "640x360:800,960x540:1600" into a list of (name, width, height, bitrate_kbps)"""
+    renditions = []
+    for item in renditions_csv.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        match = re.fullmatch(r"(\d+)x(\d+):(\d+)", item)
+        if not match:
+            print(f"[WARN] ignoring invalid ABR_RENDITIONS item {item}, expected WIDTHxHEIGHT:KBPS")
+            continue
+        width, height, bitrate_kbps = (int(g) for g in match.groups())
+        name = f"{height}p"
+        if any(r[0] == name for r in renditions):
+            name = f"{width}x{height}"
+        renditions.append((name, width, height, bitrate_kbps))
+    return renditions
+
 def update_settings():
-    preset_manager = PresetManager()
+    preset_manager = PresetManager(os.path.join(settings.metadata_dir, "presets.json"))
     active_preset = preset_manager.get_active_preset()
     settings.clip_duration_ms = math.floor(float(active_preset["CLIP_DURATION_S"]) * 1000)
     settings.clip_duration_max_percent = min(float(active_preset["CLIP_DURATION_MAX_PERCENT"]) / 100, 1)
@@ -48,19 +91,8 @@ def update_settings():
     settings.intra_file_min_gap_ms = math.floor(float(active_preset["INTRA_FILE_MIN_GAP_S"]) * 1000)
 
     settings.base_directory = active_preset["BASE_DIRECTORY"].strip(" \t\n\r/\\")
-    settings.exclude_startswith_csv = active_preset["EXCLUDE_STARTSWITH_CSV"].strip(" \t\n\r")
-    settings.exclude_contains_csv = active_preset["EXCLUDE_CONTAINS_CSV"].strip(" \t\n\r")
-    settings.exclude_notstartswith_csv = active_preset["EXCLUDE_NOTSTARTSWITH_CSV"].strip(" \t\n\r")
-    settings.exclude_notcontains_csv = active_preset["EXCLUDE_NOTCONTAINS_CSV"].strip(" \t\n\r")
-    settings.boosted_startswith_csv = active_preset["BOOSTED_STARTSWITH_CSV"].strip(" \t\n\r")
-    settings.boosted_contains_csv = active_preset["BOOSTED_CONTAINS_CSV"].strip(" \t\n\r")
-    settings.boosted_notstartswith_csv = active_preset["BOOSTED_NOTSTARTSWITH_CSV"].strip(" \t\n\r")
-    settings.boosted_notcontains_csv = active_preset["BOOSTED_NOTCONTAINS_CSV"].strip(" \t\n\r")
+    settings.file_filter = FileFilter(active_preset)
     settings.boosted_factor = int(active_preset["BOOSTED_FACTOR"])
-    settings.suppressed_startswith_csv = active_preset["SUPPRESSED_STARTSWITH_CSV"].strip(" \t\n\r")
-    settings.suppressed_contains_csv = active_preset["SUPPRESSED_CONTAINS_CSV"].strip(" \t\n\r")
-    settings.suppressed_notstartswith_csv = active_preset["SUPPRESSED_NOTSTARTSWITH_CSV"].strip(" \t\n\r")
-    settings.suppressed_notcontains_csv = active_preset["SUPPRESSED_NOTCONTAINS_CSV"].strip(" \t\n\r")
     settings.suppressed_factor = int(active_preset["SUPPRESSED_FACTOR"])
 
     settings.width = int(active_preset["WIDTH"])
@@ -77,25 +109,38 @@ def update_settings():
     settings.hls_seg_duration = int(active_preset["HLS_SEG_DURATION_S"])
     settings.hls_seg_count = int(active_preset["HLS_SEG_COUNT"])
     settings.hls_seg_extracount = int(active_preset["HLS_SEG_EXTRACOUNT"])
+    settings.hls_output_mode = active_preset["HLS_OUTPUT_MODE"].strip().lower()
+    if settings.hls_output_mode not in ("hlssink", "hlssink2"):
+        print(f"[WARN] unknown HLS_OUTPUT_MODE {settings.hls_output_mode}, using hlssink")
+        settings.hls_output_mode = "hlssink"
+    settings.abr_renditions = parse_renditions(active_preset["ABR_RENDITIONS"])
+    settings.plan_ahead_clips = max(1, int(active_preset["PLAN_AHEAD_CLIPS"]))
+    settings.filebin_pool_size = max(0, int(active_preset["FILEBIN_POOL_SIZE"]))
+    settings.filebin_pool_max_bytes = math.floor(float(active_preset["FILEBIN_POOL_MAX_MB"]) * 1024 * 1024)
+    settings.encoder_profile = get_encoder_profile(active_preset["ENCODER_PROFILE"])
+    settings.proxy_cache_max_bytes = math.floor(float(active_preset["PROXY_CACHE_MB"]) * 1024 * 1024)
     
 update_settings()
 
-# I might letter make these setting configurable in vts-remote
-# But the quality settings do not function as expected. So I'll just have a constant value that works good
-settings.x264_speed = 4 # 1=ultrafast, 4=faster, 6=medium, 9=veryslow
-settings.x264_quantizer = 18 # high values (> 30) are noticable, but low values (< 20) seem to have no effect on quality or file size)
-
-settings.input_root_dir = "/media"
-settings.output_dir = "/hls"
 settings.bin_creation_ms = 1000
 settings.audio_controller_fix = True
-settings.last_activity_file = "last-activity.txt"
 settings.last_activity_on_startup_s = 30
 settings.recent_file_queue_length = 30
+settings.library_fallback_refresh_s = 300 # how often to diff directory mtimes, in case inotify missed a change (network mounts)
+settings.library_save_s = 30
+settings.probe_ahead_count = 3 # how many upcoming files to select and probe ahead of time
+settings.probe_worker_count = 2
+settings.metrics_sample_ms = 1000
+settings.planner_retry_ms = 100 # how soon to try again when the planner has no clip ready
+settings.proxy_dir = os.path.join(settings.metadata_dir, "proxies")
+settings.offline = False # renders as fast as possible instead of in real time, see --offline
+settings.offline_sink = "hls"
+settings.offline_duration_ms = 0
 settings.settings_change_msg = False
 settings.error_message = ""
 
-def handle_presets_changed(signum, frame):
+def handle_presets_changed():
+    # registered with GLib.unix_signal_add, so this runs on the main loop rather than in the middle of whatever it was doing
     print("presets changed")
     technical_props = [
         "width",
@@ -108,34 +153,48 @@ def handle_presets_changed(signum, frame):
     ]
     old_values = {prop: getattr(settings, prop) for prop in technical_props}
     update_settings()
+    manager.clip_planner.set_depth(settings.plan_ahead_clips)
+    manager.clip_planner.reset()
+    manager.filebin_pool.reset()
+    manager.clipinfo_manager.proxy_cache.set_max_bytes(settings.proxy_cache_max_bytes)
     if any(getattr(settings, prop) != old_values[prop] for prop in technical_props):        
         manager.technical_changes()
     settings.settings_change_msg = True
     def msg_done():
         settings.settings_change_msg = False
-    GLib.timeout_add(2000, msg_done)
-signal.signal(signal.SIGUSR1, handle_presets_changed)
-
-os.makedirs(settings.input_root_dir, exist_ok=True)
-os.makedirs(settings.output_dir, exist_ok=True)
+    manager.stream_clock.timeout_add(2000, msg_done, "settings_msg")
+    return True
 
 class HLSPipelineManager:
     def __init__(self):
-        self.update_last_activity_file()
+        # assume there's activity right after starting up, to ensure we don't immediately pause
+        self.last_activity = time.monotonic() + settings.last_activity_on_startup_s
+        self.ipc_channel = IpcChannel.from_env()
+        if self.ipc_channel:
+            GLib.io_add_watch(self.ipc_channel.fileno(), GLib.PRIORITY_DEFAULT, GLib.IOCondition.IN | GLib.IOCondition.HUP, self.on_ipc_message)
+            self._watch_playlists()
+        else:
+            print("[WARN] not started by serve.py, so auto-pause is disabled")
         self.pipeline = Gst.Pipeline.new("hls-pipeline")
         self.clock = self.pipeline.get_clock()
-        self.clipinfo_manager = ClipInfoManager()
+        # serve.py watches the library and sends the changes, so the stream only watches it when run on its own
+        self.clipinfo_manager = ClipInfoManager(watch_library=not self.ipc_channel)
+        # the clipinfo_manager is only used from the planner's thread after this point
+        self.clip_planner = ClipPlanner(self.clipinfo_manager.next_clipinfo, settings.plan_ahead_clips, on_reset=self.clipinfo_manager.reset_prefetch)
         self.displayed_text = " stream is starting..." if settings.font_size > 0 else ""
         self.clips = []
         self._setup_pipeline()
+        self.filebin_pool = FileBinPool(self.clip_planner, self.stream_clock)
 
     def technical_changes(self):
         print("technical changes to preset")
         self.videocapsfilter.set_property("caps", Gst.Caps.from_string(f"video/x-raw, format=NV12, width={settings.width}, height={settings.height}, framerate={settings.frame_rate_str}, pixel-aspect-ratio=1/1"))
         self.textoverlay.set_property("font-desc", f"Sans, {settings.font_size}")
-        self.hlssink.set_property("target-duration", settings.hls_seg_duration)
-        self.hlssink.set_property("playlist-length", settings.hls_seg_count)
-        self.hlssink.set_property("max-files", settings.hls_seg_count + settings.hls_seg_extracount)
+        for hlssink in self.hlssinks:
+            hlssink.set_property("target-duration", settings.hls_seg_duration)
+            hlssink.set_property("playlist-length", settings.hls_seg_count)
+            hlssink.set_property("max-files", settings.hls_seg_count + settings.hls_seg_extracount)
+        write_master_playlist()
 
     def _setup_pipeline(self):
         # video elements
@@ -144,8 +203,7 @@ class HLSPipelineManager:
         self.videocapsfilter = Gst.ElementFactory.make("capsfilter", None)
         self.compositor = Gst.ElementFactory.make("compositor", None)
         self.textoverlay = Gst.ElementFactory.make("textoverlay", None)
-        x264enc = Gst.ElementFactory.make("x264enc", None)
-        videoqueue = Gst.ElementFactory.make("queue", None)
+        videotee = Gst.ElementFactory.make("tee", None)
         # audio elements
         audiotestsrc = Gst.ElementFactory.make("audiotestsrc", None)
         audioconvert = Gst.ElementFactory.make("audioconvert", None)
@@ -153,15 +211,11 @@ class HLSPipelineManager:
         audiocapsfilter = Gst.ElementFactory.make("capsfilter", None)
         self.audiomixer = Gst.ElementFactory.make("audiomixer", None)
         faac = Gst.ElementFactory.make("avenc_aac", None)
-        audioqueue = Gst.ElementFactory.make("queue", None)
-        # shared ending elements
-        mpegtsmux = Gst.ElementFactory.make("mpegtsmux", None)
-        self.hlssink = Gst.ElementFactory.make("hlssink", None)
+        audiotee = Gst.ElementFactory.make("tee", None)
 
         elements = [
-            videotestsrc, videoconvert, self.videocapsfilter, self.compositor, self.textoverlay, x264enc, videoqueue,
-            audiotestsrc, audioconvert, audioresample, audiocapsfilter, self.audiomixer, faac, audioqueue, 
-            mpegtsmux, self.hlssink
+            videotestsrc, videoconvert, self.videocapsfilter, self.compositor, self.textoverlay, videotee,
+            audiotestsrc, audioconvert, audioresample, audiocapsfilter, self.audiomixer, faac, audiotee
         ]
         for i, e in enumerate(elements):
             if not e:
@@ -169,7 +223,7 @@ class HLSPipelineManager:
             self.pipeline.add(e)
 
         # Properties
-        videotestsrc.set_property("is-live", True)
+        videotestsrc.set_property("is-live", not settings.offline)
         videotestsrc.set_property("pattern", "ball")
         self.videocapsfilter.set_property("caps", Gst.Caps.from_string(f"video/x-raw, format=NV12, width={settings.width}, height={settings.height}, framerate={settings.frame_rate_str}, pixel-aspect-ratio=1/1"))
         
@@ -183,17 +237,7 @@ class HLSPipelineManager:
         self.textoverlay.set_property("draw-outline", False)
         self.textoverlay.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.text_overlay_probe_callback)
 
-
-        self.hlssink.set_property("location", os.path.join(settings.output_dir, "segment%05d.ts"))
-        self.hlssink.set_property("playlist-location", os.path.join(settings.output_dir, "playlist.m3u8"))
-        self.hlssink.set_property("target-duration", settings.hls_seg_duration)
-        self.hlssink.set_property("playlist-length", settings.hls_seg_count)
-        self.hlssink.set_property("max-files", settings.hls_seg_count + settings.hls_seg_extracount)
-
-        x264enc.set_property("speed-preset", settings.x264_speed)
-        x264enc.set_property("quantizer", settings.x264_quantizer)
-        x264enc.set_property("pass", "qual")
-        audiotestsrc.set_property("is-live", True)
+        audiotestsrc.set_property("is-live", not settings.offline)
         audiotestsrc.set_property("wave", "silence")
         audiocapsfilter.set_property("caps", Gst.Caps.from_string("audio/x-raw, format=F32LE,rate=44100,channels=2"))
 
@@ -205,9 +249,11 @@ class HLSPipelineManager:
         compositor_pad.set_property("zorder", 0)
         self.videocapsfilter.get_static_pad("src").link(compositor_pad)
         self.compositor.link(self.textoverlay)
-        self.textoverlay.link(x264enc)
-        x264enc.link(videoqueue)
-        videoqueue.link(mpegtsmux)
+        self.textoverlay.link(videotee)
+        self.stage_timers = [
+            StageTimer(registry.histogram("stage_ms", "Time for a buffer to get through a stage", stage="compositor"), compositor_pad, self.compositor.get_static_pad("src")),
+            StageTimer(registry.histogram("stage_ms", stage="textoverlay"), self.textoverlay.get_static_pad("sink"), self.textoverlay.get_static_pad("src")),
+        ]
 
         # Link audio path
         audiotestsrc.link(audioconvert)
@@ -215,15 +261,105 @@ class HLSPipelineManager:
         audioresample.link(audiocapsfilter)
         audiocapsfilter.link(self.audiomixer)
         self.audiomixer.link(faac)
-        faac.link(audioqueue)
-        audioqueue.link(mpegtsmux)
+        faac.link(audiotee)
+
+        if settings.offline:
+            # without a clock, no element waits for real time
+            self.pipeline.use_clock(None)
+            end_ns = settings.offline_duration_ms * Gst.MSECOND if settings.offline_duration_ms else None
+            self.stream_clock = OfflineClock(self.compositor.get_static_pad("src"), end_ns, self.end_offline_stream)
+            self.stream_clock.follow(self.audiomixer.get_static_pad("src"))
+        else:
+            self.stream_clock = LiveClock(self.pipeline)
 
-        mpegtsmux.link(self.hlssink)
+        # the composite is only made once, then each rendition encodes its own copy of it
+        self.hlssinks = []
+        self.metrics_queues = {} # name -> queue element of the main rendition
+        self._add_rendition(videotee, audiotee, None)
+        for rendition in settings.abr_renditions:
+            self._add_rendition(videotee, audiotee, rendition)
+        write_master_playlist()
 
         self.zorder = 1
         self.is_paused = False
         self.ready_to_create = True
-        GLib.timeout_add(2000, self.timeout_callback)
+        self.timeout_source_id = self.stream_clock.timeout_add(2000, self.timeout_callback, "prepare")
+        self.last_metrics_sample = (time.monotonic(), 0)
+        GLib.timeout_add(settings.metrics_sample_ms, self.sample_metrics)
+
+    def _add_rendition(self, videotee, audiotee, rendition):
+        """Adds a tee -> x264enc -> hlssink branch. rendition is None for the main WIDTHxHEIGHT stream"""
+        videoqueue = Gst.ElementFactory.make("queue", None)
+        x264enc = Gst.ElementFactory.make("x264enc", None)
+        encodedqueue = Gst.ElementFactory.make("queue", None)
+        audioqueue = Gst.ElementFactory.make("queue", None)
+        if settings.offline and settings.offline_sink == "fakesink":
+            mpegtsmux = Gst.ElementFactory.make("mpegtsmux", None)
+            hlssink = Gst.ElementFactory.make("fakesink", None)
+        elif settings.hls_output_mode == "hlssink2":
+            mpegtsmux = None
+            hlssink = Gst.ElementFactory.make("hlssink2", None)
+        else:
+            mpegtsmux = Gst.ElementFactory.make("mpegtsmux", None)
+            hlssink = Gst.ElementFactory.make("hlssink", None)
+        elements = [videoqueue, x264enc, encodedqueue, audioqueue, hlssink] + ([mpegtsmux] if mpegtsmux else [])
+        if rendition:
+            videoscale = Gst.ElementFactory.make("videoscale", None)
+            scalecapsfilter = Gst.ElementFactory.make("capsfilter", None)
+            elements += [videoscale, scalecapsfilter]
+        for i, e in enumerate(elements):
+            if not e:
+                raise Exception(f"[ERROR] Failed to create rendition element {i}")
+            self.pipeline.add(e)
+
+        if hlssink.get_factory().get_name() == "fakesink":
+            hlssink.set_property("sync", False)
+        else:
+            output_dir = os.path.join(settings.output_dir, rendition[0]) if rendition else settings.output_dir
+            os.makedirs(output_dir, exist_ok=True)
+            hlssink.set_property("location", os.path.join(output_dir, "segment%05d.ts"))
+            hlssink.set_property("playlist-location", os.path.join(output_dir, "playlist.m3u8"))
+            hlssink.set_property("target-duration", settings.hls_seg_duration)
+            hlssink.set_property("playlist-length", settings.hls_seg_count)
+            hlssink.set_property("max-files", settings.hls_seg_count + settings.hls_seg_extracount)
+            self.hlssinks.append(hlssink)
+
+        frame_rate = float(Fraction(settings.frame_rate_str))
+        if rendition:
+            settings.encoder_profile.apply(x264enc, rendition[1], rendition[2], frame_rate)
+            x264enc.set_property("pass", "cbr")
+            x264enc.set_property("bitrate", rendition[3])
+        else:
+            settings.encoder_profile.apply(x264enc, settings.width, settings.height, frame_rate)
+        # a keyframe at every segment boundary, so each segment can start playing on its own
+        # (and so players can switch renditions at any segment)
+        x264enc.set_property("key-int-max", max(1, round(Fraction(settings.frame_rate_str) * settings.hls_seg_duration)))
+
+        videotee.request_pad_simple("src_%u").link(videoqueue.get_static_pad("sink"))
+        if rendition:
+            scalecapsfilter.set_property("caps", Gst.Caps.from_string(f"video/x-raw, width={rendition[1]}, height={rendition[2]}, pixel-aspect-ratio=1/1"))
+            videoqueue.link(videoscale)
+            videoscale.link(scalecapsfilter)
+            scalecapsfilter.link(x264enc)
+        else:
+            videoqueue.link(x264enc)
+        x264enc.link(encodedqueue)
+        audiotee.request_pad_simple("src_%u").link(audioqueue.get_static_pad("sink"))
+        if mpegtsmux:
+            encodedqueue.link(mpegtsmux)
+            audioqueue.link(mpegtsmux)
+            mpegtsmux.link(hlssink)
+        else:
+            encodedqueue.get_static_pad("src").link(hlssink.request_pad_simple("video"))
+            audioqueue.get_static_pad("src").link(hlssink.request_pad_simple("audio"))
+
+        if not rendition:
+            self.metrics_queues = {"video_raw": videoqueue, "video_encoded": encodedqueue, "audio": audioqueue}
+            self.stage_timers.append(StageTimer(registry.histogram("stage_ms", stage="x264enc"), x264enc.get_static_pad("sink"), x264enc.get_static_pad("src")))
+            if mpegtsmux:
+                self.stage_timers.append(StageTimer(registry.histogram("stage_ms", stage="mpegtsmux"), encodedqueue.get_static_pad("src"), mpegtsmux.get_static_pad("src")))
+            self.encoded_frame_counter = FrameCounter(registry.counter("encoded_frames_total", "Frames output by the main x264enc"), x264enc.get_static_pad("src"))
+            self.lateness_probe = LatenessProbe(registry.histogram("mux_lateness_ms", "How far behind the pipeline clock encoded video reaches the muxer"), self.pipeline, encodedqueue.get_static_pad("src"))
 
     def timeout_callback(self):
         try:
@@ -231,30 +367,37 @@ class HLSPipelineManager:
             if ms > settings.auto_pause_ms:
                 if not self.is_paused:
                     print(f"pausing stream due to {settings.auto_pause_ms / 1000} seconds of inactivity")
+                    registry.counter("pauses_total", "Times the stream auto-paused").inc()
                     self.pipeline.set_state(Gst.State.PAUSED)
+                    self.stream_clock.pause()
                     self.is_paused = True
-                GLib.timeout_add(1000, self.timeout_callback)
+                # the running time stands still while paused, so checking for activity uses a wall-clock timer
+                self.timeout_source_id = GLib.timeout_add(1000, self.timeout_callback)
                 return False
             if self.is_paused:
                 print(f"resuming stream")
+                registry.counter("resumes_total", "Times the stream resumed after an auto-pause").inc()
                 self.pipeline.set_state(Gst.State.PLAYING)
                 self.is_paused = False
             ns_till_next_prepare = self.prepare_next()
+            self.filebin_pool.fill()
             timeout_ms = min(2000, max(5, ns_till_next_prepare / Gst.MSECOND)) + 5
-            GLib.timeout_add(timeout_ms, self.timeout_callback)
+            self.timeout_source_id = self.stream_clock.timeout_add(timeout_ms, self.timeout_callback, "prepare")
             return False
         except Exception as e:
             print("===================================")
             print(f"Error occurred: {e}")
             print("===================================")
         
-        GLib.timeout_add(2000, self.timeout_callback)
+        self.timeout_source_id = self.stream_clock.timeout_add(2000, self.timeout_callback, "prepare")
         return False # repeat timeout
 
     def prepare_next(self):
         prep_time_needed_ns = (settings.bin_creation_ms + settings.preroll_ms) * Gst.MSECOND
         if not self.clips:
             fadeout_t = self.create_clip(self.get_time() + prep_time_needed_ns)
+            if fadeout_t is None:
+                return settings.planner_retry_ms * Gst.MSECOND
             return fadeout_t - self.get_time() - prep_time_needed_ns
         now = self.get_time()
         existing_clip = max(self.clips, key=lambda clip: clip.fadeout_t)
@@ -262,19 +405,30 @@ class HLSPipelineManager:
         if (remaining_time_ns > prep_time_needed_ns):
             return remaining_time_ns - prep_time_needed_ns
         fadeout_t = self.create_clip(existing_clip.fadeout_t)
+        if fadeout_t is None:
+            return settings.planner_retry_ms * Gst.MSECOND
         return fadeout_t - self.get_time() - prep_time_needed_ns
 
     def create_clip(self, fadein_t):
+        """Returns the new clip's fadeout_t, or None if the planner had no clip ready"""
         def on_ready(filebin):
-            ms_till_fadein = (fadein_t - self.get_time()) / Gst.MSECOND
-            timeout_ms = max(5, ms_till_fadein - settings.preroll_ms)
-            GLib.timeout_add(timeout_ms, lambda: self.add_clip(clip))
-        clip = self.clipinfo_manager.next_clipinfo()
-        clip.fadein_t = fadein_t
+            add_t = max(self.get_time() + 5 * Gst.MSECOND, clip.fadein_t - settings.preroll_ms * Gst.MSECOND)
+            self.stream_clock.add_at(add_t, lambda: self.add_clip(clip), "add_clip")
+        clip = self.filebin_pool.next_clip()
+        if not clip:
+            return None # the planner hasn't caught up yet
+        registry.counter("clips_prepared_total", "Clips whose FileBin was taken from the pool").inc()
+        print(f"planned clips: depth={self.clip_planner.get_queue_depth()}, prewarmed={len(self.filebin_pool.clips)}, ms_till_starvation={self.get_ms_till_starvation()}")
+        # fades start on a frame boundary, so every clip's first composited frame is exactly where it was planned
+        frame_rate = Fraction(settings.frame_rate_str)
+        clip.fadein_t = align_to_frame(fadein_t, frame_rate)
         ms_between_fades = clip.duration_ms - clip.fadeout_ms
-        clip.fadeout_t = fadein_t + ms_between_fades * Gst.MSECOND
-        clip.filebin = FileBin(clip.filepath, clip.seek_ms, clip.width, clip.height)
+        clip.fadeout_t = align_to_frame(clip.fadein_t + ms_between_fades * Gst.MSECOND, frame_rate)
+        # in the offline mode, the stream waits at the fade-in for the clip to be swapped in (a no-op when live)
+        clip.hold_id = self.stream_clock.hold(clip.fadein_t)
         clip.filebin.connect("ready", on_ready)
+        if clip.filebin.is_ready:
+            on_ready(clip.filebin)
         self.clips.append(clip)
         return clip.fadeout_t
 
@@ -297,7 +451,8 @@ class HLSPipelineManager:
         clip.filebin.sync_state_with_parent()
         clip.filebin.unblock_pads()
         def on_started(filebin):
-            GLib.timeout_add(5, lambda: self.swap_clip(clip))
+            registry.counter("clips_started_total", "Clips that started playing").inc()
+            self.stream_clock.timeout_add(5, lambda: self.swap_clip(clip), "swap_clip")
         clip.filebin.connect("started", on_started)
         return False
     
@@ -308,6 +463,7 @@ class HLSPipelineManager:
         interp_mode = GstController.InterpolationMode.LINEAR if transition_ns > 1 else GstController.InterpolationMode.NONE
         now = self.get_time()
         ns_till_swap = new_clip.fadein_t - now
+        registry.histogram("transition_lateness_ms", "How late each crossfade started, relative to when it was planned").observe(max(0, -ns_till_swap) / Gst.MSECOND)
         if ns_till_swap < 0:
             print(f"[WARN] ns_till_swap was negative")
             ns_till_swap = 10 & Gst.MSECOND
@@ -345,7 +501,7 @@ class HLSPipelineManager:
             def try_cleanup():
                 if old_clip.video_finished and old_clip.audio_finished and not old_clip.cleanup_scheduled:
                     old_clip.cleanup_scheduled = True
-                    GLib.timeout_add(settings.postroll_ms, lambda: self.cleanup_clip(old_clip))
+                    self.stream_clock.timeout_add(settings.postroll_ms, lambda: self.cleanup_clip(old_clip), "cleanup_clip")
     
             def detect_end_video(pad, info):
                 buffer = info.get_buffer()
@@ -381,6 +537,7 @@ class HLSPipelineManager:
             def force_cleanup():
                 if not old_clip.cleanup_scheduled:
                     print(f"RESORTING TO FORCE CLEANUP (not good). Filepath = {old_clip.filepath}")
+                    registry.counter("force_cleanups_total", "Clips removed by the timestamp-agnostic fallback").inc()
                     #Are the buffers behind? Or maybe we scheduled beyond the file's end?
                     old_clip.cleanup_scheduled = True
                     if not old_clip.audio_finished and audio_probe_id:
@@ -389,7 +546,8 @@ class HLSPipelineManager:
                         old_compositor_pad.remove_probe(video_probe_id)
                     self.cleanup_clip(old_clip)
             # allow postroll + 2 seconds until we force cleanup
-            GLib.timeout_add((ns_till_swap + transition_ns) / Gst.MSECOND + settings.postroll_ms + settings.force_cleanup_ms, force_cleanup)
+            self.stream_clock.add_at(now + ns_till_swap + transition_ns + (settings.postroll_ms + settings.force_cleanup_ms) * Gst.MSECOND, force_cleanup, "force_cleanup")
+        self.stream_clock.release(new_clip.hold_id)
         return False # Don't repeat timeout
 
     def cleanup_clip(self, clip):
@@ -413,24 +571,101 @@ class HLSPipelineManager:
         return False # Don't repeat timeout
 
     def get_time(self):
-        return self.pipeline.get_clock().get_time() - self.pipeline.get_base_time()
+        return self.stream_clock.get_time()
+
+    def end_offline_stream(self):
+        print(f"[INFO] rendered {settings.offline_duration_ms / 1000}s of stream, ending it")
+        self.pipeline.send_event(Gst.Event.new_eos())
+        return False
+
+    def get_ms_till_starvation(self):
+        """How long the stream can keep playing before it runs out of planned clips"""
+        now = self.get_time()
+        scheduled_ns = max((clip.fadeout_t for clip in self.clips if clip.fadeout_t), default=now) - now
+        return max(0, scheduled_ns // Gst.MSECOND) + self.filebin_pool.get_planned_ms() + self.clip_planner.get_planned_ms()
 
 
     
+    def sample_metrics(self):
+        """Updates the metrics that are sampled rather than counted as they happen"""
+        for name, queue in self.metrics_queues.items():
+            registry.gauge("queue_level_ms", "How much is buffered in a queue", queue=name).set(queue.get_property("current-level-time") / Gst.MSECOND)
+            registry.gauge("queue_level_buffers", queue=name).set(queue.get_property("current-level-buffers"))
+        now = time.monotonic()
+        encoded_frames = registry.counter("encoded_frames_total").value
+        last_sample_time, last_encoded_frames = self.last_metrics_sample
+        if not self.is_paused and now > last_sample_time:
+            fps = (encoded_frames - last_encoded_frames) / (now - last_sample_time)
+            registry.gauge("encoder_fps", "Frames per second output by the main x264enc").set(round(fps, 2))
+            # below 1 means the encoder can't keep up with real time
+            registry.gauge("encoder_speed", "encoder_fps divided by the output frame rate").set(round(fps / float(Fraction(settings.frame_rate_str)), 3))
+        self.last_metrics_sample = (now, encoded_frames)
+        registry.gauge("active_clips", "Clips currently in the compositor").set(len(self.clips))
+        registry.gauge("planned_clips", "Clips planned ahead of time").set(self.clip_planner.get_queue_depth())
+        registry.gauge("prewarmed_filebins", "FileBins opened ahead of time").set(len(self.filebin_pool.clips))
+        registry.gauge("ms_till_starvation", "How long the stream can play before it runs out of planned clips").set(self.get_ms_till_starvation())
+        registry.counter("planner_starvations", "Times a clip was needed before the planner had one ready").set(self.clip_planner.starved_count)
+        registry.gauge("scheduled_events", "Clip events waiting for their deadline").set(len(self.stream_clock.get_pending()))
+        registry.gauge("active_filebins", "FileBins that haven't been garbage collected").set(FileBin._instance_count)
+        clipinfo_manager = self.clipinfo_manager
+        registry.counter("probe_cache_hits", "Media info lookups answered by the cache").set(clipinfo_manager.media_info_cache.hits)
+        registry.counter("probe_cache_misses", "Media info lookups that needed a Discoverer").set(clipinfo_manager.media_info_cache.misses)
+        if clipinfo_manager.library_watcher and clipinfo_manager.library_watcher.last_refresh_ms is not None:
+            registry.gauge("library_refresh_ms", "Duration of the latest library rescan").set(round(clipinfo_manager.library_watcher.last_refresh_ms, 1))
+        for name, group in (("suppressed", clipinfo_manager.suppressed_group), ("neutral", clipinfo_manager.neutral_group), ("boosted", clipinfo_manager.boosted_group)):
+            registry.gauge("group_files", "Files in each selection group", group=name).set(len(group.all_files))
+            registry.counter("group_selections", "Files selected from each group", group=name).set(group.select_count)
+        if self.ipc_channel:
+            self.ipc_channel.send_list("metrics", "metrics", registry.snapshot())
+        return True
+
     def get_ms_since_activity(self):
+        if not self.ipc_channel or settings.offline:
+            return 0
+        return math.floor((time.monotonic() - self.last_activity) * 1000)
+
+    def on_ipc_message(self, fd, condition):
+        for message in self.ipc_channel.receive():
+            if message["type"] == "activity":
+                self.last_activity = time.monotonic()
+                if self.is_paused:
+                    # resume right away, rather than on the next timeout
+                    GLib.source_remove(self.timeout_source_id)
+                    self.timeout_callback()
+            elif message["type"] == "library_changes":
+                self.clipinfo_manager.library_changes.append((message["added"], message["removed"]))
+            elif message["type"] == "library_reload":
+                self.clipinfo_manager.library_changes.append((None, None))
+        return not self.ipc_channel.closed # keep watching until serve.py goes away
+
+    def _watch_playlists(self):
+        # hlssink doesn't tell the application when it writes the playlist, so watch the output dir
+        self.playlist_watch_dirs = {} # wd -> playlist name prefix
         try:
-            with open(settings.last_activity_file, "r") as f:
-                timestamp_str = f.read().strip()
-            last_activity = datetime.fromisoformat(timestamp_str)
-            now = datetime.now(UTC)
-            return math.floor((now - last_activity).total_seconds() * 1000)
-        except Exception as e:
-            print(f"Error reading last activity: {e}")
-            
-    def update_last_activity_file(self): #used when starting up to ensure we don't immediately pause
-        future_time = datetime.now(UTC) + timedelta(seconds=settings.last_activity_on_startup_s)
-        with open(settings.last_activity_file, "w") as f:
-            f.write(future_time.isoformat())
+            self.playlist_inotify = Inotify()
+            for subdir in [""] + [rendition[0] for rendition in settings.abr_renditions]:
+                os.makedirs(os.path.join(settings.output_dir, subdir), exist_ok=True)
+                wd = self.playlist_inotify.add_watch(os.path.join(settings.output_dir, subdir), IN_CLOSE_WRITE | IN_MOVED_TO)
+                self.playlist_watch_dirs[wd] = subdir
+        except (OSError, AttributeError) as e:
+            print(f"[WARN] can't watch {settings.output_dir} ({e}), so blocking playlist reloads are disabled")
+            return
+        GLib.io_add_watch(self.playlist_inotify.fd, GLib.PRIORITY_DEFAULT, GLib.IOCondition.IN, self.on_playlist_written)
+
+    def on_playlist_written(self, fd, condition):
+        names = set(os.path.join(self.playlist_watch_dirs.get(wd, ""), name) for wd, _, _, name in self.playlist_inotify.read_events() if name.endswith(".m3u8"))
+        for name in names:
+            try:
+                with open(os.path.join(settings.output_dir, name), "r") as f:
+                    content = f.read()
+            except OSError:
+                continue
+            # serve.py serves the playlist from this message, so it never sees a partially written file
+            self.ipc_channel.send("playlist", name=name, content=content)
+            if os.path.basename(name) == "playlist.m3u8":
+                # hlssink rewrites the playlist once per new segment
+                registry.counter("segments_written_total", "Segments written by hlssink", playlist=name).inc()
+        return not self.ipc_channel.closed
 
     def text_overlay_probe_callback(self, pad, info):
         if settings.font_size == 0:
@@ -472,7 +707,11 @@ class HLSPipelineManager:
         return Gst.PadProbeReturn.OK
     def run(self):
         self.pipeline.set_state(Gst.State.PLAYING)
-        print(f"[INFO] HLS pipeline is running. Serving segments in {settings.output_dir}")
+        start = time.monotonic()
+        if settings.offline:
+            print(f"[INFO] HLS pipeline is rendering offline, to {settings.output_dir if settings.offline_sink == 'hls' else 'a fakesink'}")
+        else:
+            print(f"[INFO] HLS pipeline is running. Serving segments in {settings.output_dir}")
 
         loop = GLib.MainLoop()
         bus = self.pipeline.get_bus()
@@ -487,38 +726,89 @@ class HLSPipelineManager:
                 err, debug = msg.parse_error()
                 print(f"[ERROR] {err}: {debug}")
                 loop.quit()
+            elif t == Gst.MessageType.STATE_CHANGED and msg.src == self.pipeline:
+                _, new_state, _ = msg.parse_state_changed()
+                if new_state == Gst.State.PLAYING:
+                    # the base time changes every time the pipeline starts playing
+                    self.stream_clock.rearm()
+            elif t == Gst.MessageType.QOS:
+                # an element dropped or was late with a buffer
+                element = msg.src.get_name() if msg.src else "unknown"
+                registry.counter("qos_events_total", "QoS messages (late or dropped buffers)", element=element).inc()
+                _, processed, dropped = msg.parse_qos_stats()
+                registry.gauge("qos_dropped_buffers", "Buffers dropped, as reported in the latest QoS message", element=element).set(dropped)
 
         bus.connect("message", on_message)
 
         loop.run()
+        if settings.offline:
+            elapsed_s = time.monotonic() - start
+            stream_s = self.get_time() / Gst.SECOND
+            print(f"[INFO] rendered {stream_s:.1f}s of stream in {elapsed_s:.1f}s ({stream_s / elapsed_s:.2f}x real time)")
+            self.sample_metrics() # so the benchmark gets the final counts
+        self.stream_clock.stop()
+        self.clipinfo_manager.media_info_cache.flush()
         self.pipeline.set_state(Gst.State.NULL)
         print("[INFO] Pipeline stopped.")
 
 class ClipInfo:
-    def __init__(self, filepath, seek_ms, duration_ms, fadein_ms, fadeout_ms, width, height):
+    def __init__(self, filepath, seek_ms, duration_ms, fadein_ms, fadeout_ms, width, height, fast_path=False, location=None):
         self.filepath = filepath
+        self.location = location or os.path.join(settings.input_root_dir, filepath) # the file to decode, which is a proxy if one exists
         self.seek_ms = seek_ms
         self.duration_ms = duration_ms
         self.fadein_ms = fadein_ms
         self.fadeout_ms = fadeout_ms
         self.width = width
         self.height = height
+        self.fast_path = fast_path
 
         self.fadein_t = None
         self.fadeout_t = None
+        self.hold_id = None
         self.audio_control_source = None
         self.video_finished = None
         self.audio_finished = None
         self.cleanup_scheduled = False
 
+def is_fast_path_compatible(media_info):
+    """Whether the source is already at the output size with square pixels, so its FileBin doesn't need to crop"""
+    if not media_info.width or not media_info.height or not media_info.par_num:
+        return False
+    return (media_info.width == settings.width and media_info.height == settings.height
+            and media_info.par_num == media_info.par_denom)
+
 class ClipInfoManager:
-    def __init__(self):
+    def __init__(self, rng=None, watch_library=True, dry_run=False):
+        """A dry_run manager plans the same clips the stream would, but leaves /metadata untouched: it only reads
+        the media info, keyframe and proxy caches (new probes are kept in memory), and doesn't save the library snapshot"""
+        # every random choice goes through self.rng, so a seeded manager plans the same clips every run
+        self.rng = rng or random.Random(settings.seed)
+        self.deterministic = rng is not None or settings.seed is not None
         self.clipinfo_queue = deque()
-        self.discoverer = GstPbutils.Discoverer.new(5 * Gst.SECOND)
-        self.video_extensions = {'.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv', '.webm', 'mpeg'}
-        self.suppressed_group = FileGroup()
-        self.neutral_group = FileGroup()
-        self.boosted_group = FileGroup()
+        self.media_info_cache = MediaInfoCache(os.path.join(settings.metadata_dir, "media-info.db"), read_only=dry_run)
+        self.probe_pool = ProbePool(self.media_info_cache, settings.probe_worker_count)
+        self.probe_queue = deque() # (filepath, Future of MediaInfo) for files that were selected ahead of time
+        self.proxy_cache = ProxyCache(settings.proxy_dir, settings.proxy_cache_max_bytes, read_only=dry_run)
+        self.keyframe_index = KeyframeIndex(self.media_info_cache, read_only=dry_run)
+        self.library_index = LibraryIndex(settings.input_root_dir, VIDEO_EXTENSIONS, os.path.join(settings.metadata_dir, "library-index.json"))
+        self.library_changes = deque() # (added, removed) files from serve.py, or (None, None) to reload the snapshot
+        self.library_watcher = None
+        if dry_run:
+            self.library_index.load()
+            self.library_index.refresh()
+        elif watch_library:
+            self.library_index.load()
+            self.library_watcher = LibraryWatcher(self.library_index, fallback_interval_s=settings.library_fallback_refresh_s, save_interval_s=settings.library_save_s)
+            self.library_watcher.start()
+            self.library_index.save()
+        elif not self.library_index.load():
+            # serve.py saves the snapshot right before starting the stream, so this only happens if that failed
+            self.library_index.refresh()
+        self.classification_cache = ClassificationCache(self.library_index)
+        self.suppressed_group = FileGroup(settings.recent_file_queue_length, self.rng)
+        self.neutral_group = FileGroup(settings.recent_file_queue_length, self.rng)
+        self.boosted_group = FileGroup(settings.recent_file_queue_length, self.rng)
 
     def next_clipinfo(self):
         if not self.clipinfo_queue:
@@ -528,25 +818,82 @@ class ClipInfoManager:
             raise Exception(f"[ERROR] No clips to queue")
         return self.clipinfo_queue.popleft()
 
+    def prefetch(self):
+        """Select upcoming files and start probing them, so their media info is known before they're needed"""
+        self._apply_library_changes()
+        while len(self.probe_queue) < settings.probe_ahead_count:
+            filepath = self._next_file()
+            self.suppressed_group.cleanup()
+            self.neutral_group.cleanup()
+            self.boosted_group.cleanup()
+            if not filepath:
+                return
+            path = os.path.join(settings.input_root_dir, filepath)
+            self.probe_queue.append((filepath, self.probe_pool.submit(path)))
+
+    def _apply_library_changes(self):
+        while self.library_changes:
+            added, removed = self.library_changes.popleft()
+            if added is None:
+                self.library_index.load()
+                continue
+            # the cached lists are updated in place, so the groups only need the changed files rather than a full sync
+            added, removed = self.classification_cache.apply_changes(added, removed)
+            groups = {SUPPRESSED: self.suppressed_group, NEUTRAL: self.neutral_group, BOOSTED: self.boosted_group}
+            for filepath in removed:
+                for group in groups.values():
+                    group.remove_file(filepath)
+            for filepath in added:
+                if settings.file_filter.in_base_directory(filepath):
+                    group = groups.get(settings.file_filter.classify(filepath))
+                    if group:
+                        group.add_file(filepath)
+
+    def reset_prefetch(self):
+        # clips that were planned with the old presets are dropped along with the files selected with them
+        self.clipinfo_queue.clear()
+        self.probe_queue.clear()
+
+    def _next_probed_file(self):
+        for _ in range(settings.probe_ahead_count * 3):
+            self.prefetch()
+            if not self.probe_queue:
+                break
+            # prefer whichever file finished probing first, and only wait if none have (unless the order has to be reproducible)
+            entry = None if self.deterministic else next((entry for entry in self.probe_queue if entry[1].done()), None)
+            if not entry:
+                if not self.deterministic:
+                    print("[WARN] no upcoming file has finished probing, waiting for one")
+                entry = self.probe_queue[0]
+            self.probe_queue.remove(entry)
+            filepath, future = entry
+            try:
+                return filepath, future.result()
+            except Exception as e:
+                print(f"Error probing {filepath}: {e}")
+        settings.error_message = self._get_error_message()
+        raise FileNotFoundError(f"[ERROR] no video file to play. {settings.error_message}")
+
     def _get_more_clipinfos(self):
-        filepath = self._next_file()
-        self.suppressed_group.cleanup()
-        self.neutral_group.cleanup()
-        self.boosted_group.cleanup()
-
-        if not filepath:
-            settings.error_message = self._get_error_message()
-            raise FileNotFoundError(f"[ERROR] no video file to play. {settings.error_message}")
+        filepath, media_info = self._next_probed_file()
         settings.error_message = ""
-        file_duration_ms, width, height = self._get_media_info(filepath)
+        file_duration_ms, width, height = media_info.duration_ms, media_info.width, media_info.height
+        fast_path = is_fast_path_compatible(media_info)
+        location = None
+        proxy = self.proxy_cache.get(os.path.join(settings.input_root_dir, filepath), media_info, settings.width, settings.height)
+        if proxy:
+            location, width, height = proxy
+            fast_path = (width, height) == (settings.width, settings.height)
+        # clips start exactly on a keyframe (once the file is indexed), so the KEY_UNIT seek lands where the clip was planned
+        keyframe_location = location or os.path.join(settings.input_root_dir, filepath)
         duration_w_inter_transitions = settings.clip_duration_ms + (settings.inter_transition_ms * 2)
 
         def simple_case():
             max_duration_due_to_percent = max(settings.clip_duration_min_ms + (settings.inter_transition_ms * 2), math.floor(file_duration_ms * settings.clip_duration_max_percent))
             clip_duration_ms = min(duration_w_inter_transitions, max_duration_due_to_percent, file_duration_ms)
             startrange_ms = file_duration_ms - clip_duration_ms
-            seek_ms = random.randint(0, startrange_ms)
-            return [ClipInfo(filepath, seek_ms, clip_duration_ms, settings.inter_transition_ms, settings.inter_transition_ms, width, height)]
+            seek_ms = self.keyframe_index.snap(keyframe_location, self.rng.randint(0, startrange_ms), startrange_ms)
+            return [ClipInfo(filepath, seek_ms, clip_duration_ms, settings.inter_transition_ms, settings.inter_transition_ms, width, height, fast_path, location)]
 
         # first check if we're in the simple case where it's obvious there's just 1 clip for this file
         if settings.clips_per_file <= 1 or file_duration_ms < (duration_w_inter_transitions + settings.clip_duration_ms):
@@ -568,24 +915,30 @@ class ClipInfoManager:
         total_space_without_required_gaps = total_space_ms - (gap_count * settings.intra_file_min_gap_ms)
         if total_space_without_required_gaps < 0:
             raise ValueError("total_space_without_required_gaps < 0")
-        raw_randoms = [random.random() for _ in range(space_count)]
+        raw_randoms = [self.rng.random() for _ in range(space_count)]
         raw_sum = sum(raw_randoms)
         spaces = [r / raw_sum * total_space_without_required_gaps for r in raw_randoms]
         for i in range(1, space_count - 1):
             spaces[i] += settings.intra_file_min_gap_ms
 
         # step 3: create clipinfos
+        clip_durations_ms = [settings.clip_duration_ms + settings.inter_transition_ms + settings.intra_transition_ms if i == 0 or i == space_count - 1 else duration_w_intra_transitions for i in range(clip_count)]
         clipinfos = []
-        seek_ms = 0
-        for i in range(space_count - 1):
-            seek_ms += spaces[i]
+        planned_ms = 0
+        prev_end_ms = None
+        for i in range(clip_count):
+            planned_ms += spaces[i]
             fadein_transition_ms = settings.inter_transition_ms if i == 0 else settings.intra_transition_ms
             fadeout_transition_ms = settings.inter_transition_ms if i == (space_count - 1) else settings.intra_transition_ms
-            clip_duration_ms = duration_w_intra_transitions
-            if i == 0 or i == space_count - 1:
-                clip_duration_ms = settings.clip_duration_ms + settings.inter_transition_ms + settings.intra_transition_ms
-            clipinfos.append(ClipInfo(filepath, seek_ms, clip_duration_ms, fadein_transition_ms, fadeout_transition_ms, width, height))
-            seek_ms += clip_duration_ms
+            clip_duration_ms = clip_durations_ms[i]
+            # snapping moves a clip, so keep it after the previous one and leave room for the ones after it
+            min_ms = 0 if prev_end_ms is None else prev_end_ms + settings.intra_file_min_gap_ms
+            max_ms = file_duration_ms - sum(clip_durations_ms[i:]) - (clip_count - 1 - i) * settings.intra_file_min_gap_ms
+            target_ms = min(max(math.floor(planned_ms), min_ms), max_ms)
+            seek_ms = self.keyframe_index.snap(keyframe_location, target_ms, max_ms, min_ms)
+            clipinfos.append(ClipInfo(filepath, seek_ms, clip_duration_ms, fadein_transition_ms, fadeout_transition_ms, width, height, fast_path, location))
+            planned_ms += clip_duration_ms
+            prev_end_ms = seek_ms + clip_duration_ms
         return clipinfos
 
     def _get_error_message(self):
@@ -621,7 +974,7 @@ class ClipInfoManager:
                 self.neutral_group.next_iteration()
                 self.boosted_group.next_iteration()
             boosted_chance = self.boosted_group.remaining_total_file_count / (self.boosted_group.remaining_total_file_count + self.neutral_group.remaining_total_file_count)
-            is_boosted = random.random() < boosted_chance
+            is_boosted = self.rng.random() < boosted_chance
             print(f"neutral={self.neutral_group.remaining_total_file_count}, boosted={self.boosted_group.remaining_total_file_count}, is_boosted={is_boosted}")
             if is_boosted:
                 if not self.boosted_group.eligible_files:
@@ -642,7 +995,7 @@ class ClipInfoManager:
             self.boosted_group.next_iteration()
             not_suppressed_count = self.neutral_group.remaining_total_file_count + self.boosted_group.remaining_total_file_count
         suppressed_chance =  self.suppressed_group.remaining_total_file_count / ( self.suppressed_group.remaining_total_file_count + not_suppressed_count)
-        is_suppressed = random.random() < suppressed_chance
+        is_suppressed = self.rng.random() < suppressed_chance
         if is_suppressed:
             print(f"suppressed={self.suppressed_group.remaining_total_file_count}, neutral={self.neutral_group.remaining_total_file_count}, boosted={self.boosted_group.remaining_total_file_count}, selected=suppressed")
             return self.suppressed_group.select_file()
@@ -656,7 +1009,7 @@ class ClipInfoManager:
             neutral_adjusted_file_count = self.neutral_group.get_adjusted_remaining_total_file_count(settings.suppressed_factor)
             boosted_adjusted_file_count = self.boosted_group.get_adjusted_remaining_total_file_count(settings.suppressed_factor)
         boosted_chance = boosted_adjusted_file_count / (boosted_adjusted_file_count + neutral_adjusted_file_count)
-        is_boosted = random.random() < boosted_chance
+        is_boosted = self.rng.random() < boosted_chance
         if is_boosted:
             print(f"suppressed={self.suppressed_group.remaining_total_file_count}, neutral={self.neutral_group.remaining_total_file_count}, boosted={self.boosted_group.remaining_total_file_count}, selected=boosted")
             if not self.boosted_group.eligible_files:
@@ -668,165 +1021,22 @@ class ClipInfoManager:
 
 
 
-    def _get_media_info(self, filepath):
-        path = os.path.join(settings.input_root_dir, filepath) 
-        uri = Path(path).as_uri()
-        info = self.discoverer.discover_uri(uri)
-        duration_ns = info.get_duration()
-
-        width = height = None
-        for stream in info.get_stream_list():
-            if isinstance(stream, GstPbutils.DiscovererVideoInfo):
-                caps = stream.get_caps()
-                if caps:
-                    structure = caps.get_structure(0)
-                    width = structure.get_value("width")
-                    height = structure.get_value("height")
-                break  # Only look at first video stream
-        return (math.floor(duration_ns / Gst.MSECOND), width, height)
-
     def _get_files(self, enable_filters):
-        suppressed_files = []
-        neutral_files = []
-        boosted_files = []
-        def get_contain_pattern(csv):
-            if not csv:
-                return None
-            lower_terms = [term.strip().lower() for term in csv.split(",") if term.strip()]
-            return re.compile("|".join(re.escape(term) for term in lower_terms))
-        def get_startswith_list(csv):
-            if not csv:
-                return None
-            return [term.strip().lstrip("/").lower() for term in csv.split(",") if term.strip()]
-        exclude_startswith_list = get_startswith_list(settings.exclude_startswith_csv)
-        exclude_contains_pattern = get_contain_pattern(settings.exclude_contains_csv)
-        exclude_notstartswith_list = get_startswith_list(settings.exclude_notstartswith_csv)
-        exclude_notcontains_pattern = get_contain_pattern(settings.exclude_notcontains_csv)
-
-        boosted_startswith_list = get_startswith_list(settings.boosted_startswith_csv)
-        boosted_contains_pattern = get_contain_pattern(settings.boosted_contains_csv)
-        boosted_notstartswith_list = get_startswith_list(settings.boosted_notstartswith_csv)
-        boosted_notcontains_pattern = get_contain_pattern(settings.boosted_notcontains_csv)
-
-        suppressed_startswith_list = get_startswith_list(settings.suppressed_startswith_csv)
-        suppressed_contains_pattern = get_contain_pattern(settings.suppressed_contains_csv)
-        suppressed_notstartswith_list = get_startswith_list(settings.suppressed_notstartswith_csv)
-        suppressed_notcontains_pattern = get_contain_pattern(settings.suppressed_notcontains_csv)
-
-        stack = [settings.input_root_dir]
-        if settings.base_directory:
-            current_dir = os.path.join(settings.input_root_dir, settings.base_directory)
-            if not os.path.isdir(current_dir):
-                return (suppressed_files, neutral_files, boosted_files)
-            stack = [current_dir]
-        while stack:
-            current_dir = stack.pop()
-            with os.scandir(current_dir) as it:
-                for entry in it:
-                    if entry.is_dir():
-                        stack.append(entry.path)
-                    elif not entry.is_file():
-                        continue 
-                    if not os.path.splitext(entry.name)[1].lower() in self.video_extensions:
-                        continue
-                    path = os.path.relpath(entry.path, start=settings.input_root_dir)
-                    if settings.base_directory:
-                        lower_path = path[len(settings.base_directory) + 1:].lower()
-                    else:
-                        lower_path = path.lower()
-                    
-                    if enable_filters and (
-                        (exclude_startswith_list and any(lower_path.startswith(p) for p in exclude_startswith_list))
-                        or (exclude_contains_pattern and bool(exclude_contains_pattern.search(lower_path)))
-                        or (exclude_notstartswith_list and not any(lower_path.startswith(p) for p in exclude_notstartswith_list))
-                        or (exclude_notcontains_pattern and not bool(exclude_notcontains_pattern.search(lower_path)))
-                    ):
-                        continue
-                    bias=0
-                    if (
-                        (boosted_startswith_list and any(lower_path.startswith(p) for p in boosted_startswith_list))
-                        or (boosted_contains_pattern and bool(boosted_contains_pattern.search(lower_path)))
-                        or (boosted_notstartswith_list and not any(lower_path.startswith(p) for p in boosted_notstartswith_list))
-                        or (boosted_notcontains_pattern and not bool(boosted_notcontains_pattern.search(lower_path)))
-                    ):
-                        bias+=1
-                    if (
-                        (suppressed_startswith_list and any(lower_path.startswith(p) for p in suppressed_startswith_list))
-                        or (suppressed_contains_pattern and bool(suppressed_contains_pattern.search(lower_path)))
-                        or (suppressed_notstartswith_list and not any(lower_path.startswith(p) for p in suppressed_notstartswith_list))
-                        or (suppressed_notcontains_pattern and not bool(suppressed_notcontains_pattern.search(lower_path)))
-                    ):
-                        bias-=1
-                    if bias == -1:
-                        suppressed_files.append(path)
-                    elif bias == 0:
-                        neutral_files.append(path)
-                    else:
-                        boosted_files.append(path)
+        suppressed_files, neutral_files, boosted_files, _ = self.classification_cache.get(settings.file_filter, enable_filters)
         return (suppressed_files, neutral_files, boosted_files)
 
-class FileGroup():
-    def __init__(self):
-        self.files_set = set()
-        self.recent_files_queue = deque()
-        self.iteration_index = 0
-        self.cleanup()
-
-
-    def setup(self, files, iteration_count):
-        self.files = files
-        self.iteration_count = iteration_count
-        self.iteration_index %= iteration_count
-        recent_exclude_count = min(settings.recent_file_queue_length, math.floor(len(self.files) / 2))
-        recent_set = set(list(self.recent_files_queue)[-recent_exclude_count:]) if recent_exclude_count > 0 else set()
-        self.eligible_files = [f for f in self.files if f not in self.files_set and f not in recent_set]
-        self.remaining_iteration_file_count = sum(1 for f in self.files if f not in self.files_set)
-        if len(self.eligible_files) == 0 and self.remaining_iteration_file_count > 0:
-            print("[WARN] unexpected situation in random filepicker logic") # I don't think this is possible, but hard to definitively prove
-            self.remaining_iteration_file_count = 0
-        self.remaining_iterations = self.iteration_count - 1 - self.iteration_index
-        self.remaining_total_file_count = self.remaining_iteration_file_count + (self.remaining_iterations * len(self.files))
-
-    def cleanup(self):
-        self.files = None
-        self.eligible_files = None
-        self.iteration_count = None
-        self.remaining_iterations = None
-        self.remaining_iteration_file_count = None
-        self.remaining_total_file_count = None
-
-
-    def get_adjusted_remaining_total_file_count(self, factor):
-        adjusted_iteration_count = self.iteration_count / factor
-        if self.iteration_index >= adjusted_iteration_count:
-            return self.remaining_total_file_count
-        adjusted_remaining_iterations = adjusted_iteration_count - 1 - self.iteration_index
-        return self.remaining_iteration_file_count + (adjusted_remaining_iterations * len(self.files))
-
-    def next_iteration(self):
-        self.files_set.clear()
-        self.iteration_index += 1
-        self.iteration_index %= self.iteration_count
-        self.setup(self.files, self.iteration_count)
-
-    def select_file(self):
-        selected_file = random.choice(self.eligible_files)
-        self.recent_files_queue.append(selected_file)
-        self.files_set.add(selected_file)
-        return selected_file
-
-
 class FileBin(Gst.Bin):
     __gsignals__ = {
         "ready": (GObject.SignalFlags.RUN_FIRST, None, ()),
         "started": (GObject.SignalFlags.RUN_FIRST, None, ())
     }
     _instance_count = 0
-    def __init__(self, filepath, seek_ms, width, height):
+    def __init__(self, stream_clock, filepath, location, seek_ms, width, height, fast_path=False):
         super().__init__()
+        self.stream_clock = stream_clock
         FileBin._instance_count += 1
-        print(f"Created Filebin for {filepath}. Active Filebin Count: {FileBin._instance_count}")
-        location = os.path.join(settings.input_root_dir, filepath)
+        proxy_str = " from proxy" if not location.startswith(settings.input_root_dir + os.sep) else ""
+        print(f"Created Filebin for {filepath}{proxy_str}{' (fast path)' if fast_path else ''}. Active Filebin Count: {FileBin._instance_count}")
         self.seek_ms = seek_ms
         self.pad_states = {"video": False, "audio": False}
         self.video_block_probe_id = None
@@ -836,13 +1046,18 @@ class FileBin(Gst.Bin):
         self.segment_base_ns = None
         self.time_started = None
         self.start_emitted = False
+        self.is_ready = False
+        self.created_ns = time.monotonic_ns()
+        self.stage_timer = None
 
         # Create elements
         filesrc = Gst.ElementFactory.make("filesrc", None)
         self.decodebin = Gst.ElementFactory.make("decodebin", None)
         self.video_identity = Gst.ElementFactory.make("identity", None)
         self.videoconvert = Gst.ElementFactory.make("videoconvert", None)
-        videocrop = Gst.ElementFactory.make("videocrop", None)
+        # the fast path leaves out videocrop, since the source is already at the output size. videoscale stays, because the
+        # decoded caps can still differ from the probed ones (rotation, rounding); when they match it passes frames through
+        videocrop = None if fast_path else Gst.ElementFactory.make("videocrop", None)
         videoscale = Gst.ElementFactory.make("videoscale", None)
         self.vcapsfilter = Gst.ElementFactory.make("capsfilter", None)
         self.audioconvert = Gst.ElementFactory.make("audioconvert", None)
@@ -851,21 +1066,27 @@ class FileBin(Gst.Bin):
         self.audio_identity = Gst.ElementFactory.make("identity", None)
         
         filesrc.set_property("location", location)
-        self._crop(videocrop, width, height)
+        self.videoconvert.set_property("n-threads", settings.encoder_profile.filebin_threads)
+        if not fast_path:
+            self._crop(videocrop, width, height)
         videoscale.set_property("add-borders", True)
+        videoscale.set_property("n-threads", settings.encoder_profile.filebin_threads)
         self.vcapsfilter.set_property("caps", Gst.Caps.from_string(f"video/x-raw, format=NV12, width={settings.width}, height={settings.height}, pixel-aspect-ratio=1/1"))
         audiocapsfilter.set_property("caps", Gst.Caps.from_string("audio/x-raw, format=F32LE,rate=44100,channels=2"))
         elements = [
             filesrc, self.decodebin,
-            self.video_identity, self.videoconvert, videocrop, videoscale, self.vcapsfilter,
-            self.audioconvert, audioresample, audiocapsfilter, self.audio_identity
-        ]
+            self.video_identity, self.videoconvert, self.vcapsfilter,
+            self.audioconvert, audioresample, audiocapsfilter, self.audio_identity, videoscale
+        ] + ([] if fast_path else [videocrop])
         for e in elements:
             self.add(e)
 
         filesrc.link(self.decodebin)
-        self.videoconvert.link(videocrop)
-        videocrop.link(videoscale)
+        if fast_path:
+            self.videoconvert.link(videoscale)
+        else:
+            self.videoconvert.link(videocrop)
+            videocrop.link(videoscale)
         videoscale.link(self.vcapsfilter)
         self.audioconvert.link(audioresample)
         audioresample.link(audiocapsfilter)
@@ -883,6 +1104,7 @@ class FileBin(Gst.Bin):
         if caps.startswith("video/") and not self.pad_states["video"]:
             pad.link(self.video_identity.get_static_pad("sink"))
             self.video_identity.link(self.videoconvert)
+            self.stage_timer = StageTimer(registry.histogram("stage_ms", stage="filebin_convert"), self.video_identity.get_static_pad("sink"), self.vcapsfilter.get_static_pad("src"))
 
             # Add ghost pad
             ghost = Gst.GhostPad.new("video_src", self.vcapsfilter.get_static_pad("src"))
@@ -933,14 +1155,18 @@ class FileBin(Gst.Bin):
         GLib.timeout_add(10, self._perform_seek)
 
     def _perform_seek(self):
+        # the keyframe index rounds keyframe times up to the ms, so the nearest keyframe is the one that was planned
+        # (a plain KEY_UNIT seek snaps back to the keyframe before the target, which would be a whole GOP early)
         success = self.decodebin.seek_simple(
             Gst.Format.TIME,
-            Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT,
+            Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT | Gst.SeekFlags.SNAP_NEAREST,
             self.seek_ms * Gst.MSECOND
         )
         if not success:
             print("Warning: seek failed")
             return False
+        self.is_ready = True
+        registry.histogram("filebin_ready_ms", "Time to open, preroll and seek a file").observe((time.monotonic_ns() - self.created_ns) / 1e6)
         self.emit("ready")
         return False  # Don't repeat timeout
 
@@ -1026,21 +1252,127 @@ class FileBin(Gst.Bin):
             videocrop.set_property('bottom', math.ceil(crop_px / 2))
 
     def _get_time(self):
-        pipeline = self.get_parent()
-        return pipeline.get_clock().get_time() - pipeline.get_base_time()
+        return self.stream_clock.get_time()
+
+class FileBinPool:
+    """Creates the FileBins of upcoming clips well before their fade-in, so they're already
+    prerolled, seeked and blocked at their ghost pads by the time they're needed.
+
+    FILEBIN_POOL_MAX_MB is compared against an estimate of each FileBin's memory (see _estimate_bytes),
+    since what the decoders and decodebin's queues actually hold isn't measured."""
+    def __init__(self, clip_planner, stream_clock):
+        self.clip_planner = clip_planner
+        self.stream_clock = stream_clock
+        self.clips = deque()
+
+    def fill(self):
+        while len(self.clips) < settings.filebin_pool_size:
+            clip = self.clip_planner.peek()
+            if not clip:
+                return
+            if self.get_estimated_bytes() + self._estimate_bytes(clip) > settings.filebin_pool_max_bytes:
+                return
+            self.clips.append(self._create_filebin(self.clip_planner.next_clipinfo()))
 
+    def next_clip(self):
+        """Returns the next clip with its FileBin, or None if the planner has no clip ready"""
+        if not self.clips:
+            clip = self.clip_planner.next_clipinfo()
+            return self._create_filebin(clip) if clip else None
+        return self.clips.popleft()
+
+    def reset(self):
+        for clip in self.clips:
+            clip.filebin.set_state(Gst.State.NULL)
+            clip.filebin = None
+        self.clips.clear()
+
+    def get_planned_ms(self):
+        return sum(clip.duration_ms - clip.fadeout_ms for clip in self.clips)
+
+    def get_estimated_bytes(self):
+        return sum(self._estimate_bytes(clip) for clip in self.clips)
+
+    def _create_filebin(self, clip):
+        clip.filebin = FileBin(self.stream_clock, clip.filepath, clip.location, clip.seek_ms, clip.width, clip.height, clip.fast_path)
+        return clip
+
+    def _estimate_bytes(self, clip):
+        # a prerolled filebin holds a few decoded frames at the source size, plus the demuxed data queued in decodebin
+        source_frame_bytes = (clip.width or settings.width) * (clip.height or settings.height) * 3 // 2
+        output_frame_bytes = settings.width * settings.height * 3 // 2
+        return source_frame_bytes * 8 + output_frame_bytes * 2 + 2 * 1024 * 1024
+
+def write_master_playlist():
+    """Writes master.m3u8, which lists the main stream and every ABR_RENDITIONS rendition"""
+    audio_bps = 128000 # the avenc_aac default
+    frame_rate = float(Fraction(settings.frame_rate_str))
+    if settings.encoder_profile.rate_control == "cbr":
+        main_bps = (settings.encoder_profile.bitrate_kbps or estimate_bitrate_kbps(settings.width, settings.height, frame_rate)) * 1000
+    else:
+        # with a constant quality, the bandwidth is a rough estimate of 0.15 bits per pixel
+        main_bps = math.floor(settings.width * settings.height * frame_rate * 0.15)
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={main_bps + audio_bps},RESOLUTION={settings.width}x{settings.height}")
+    lines.append("playlist.m3u8")
+    for name, width, height, bitrate_kbps in settings.abr_renditions:
+        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={bitrate_kbps * 1000 + audio_bps},RESOLUTION={width}x{height}")
+        lines.append(f"{name}/playlist.m3u8")
+    temp_path = os.path.join(settings.output_dir, ".master.m3u8.tmp")
+    with open(temp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temp_path, os.path.join(settings.output_dir, "master.m3u8"))
 
 def delete_stream_files():
     keep_pattern = re.compile(r"segment0000\d\.ts$") #because of the delay, we must avoid deleting the new .ts files
-    for file_path in glob.glob(os.path.join(settings.output_dir, "*.ts")):
+    for file_path in glob.glob(os.path.join(settings.output_dir, "*.ts")) + glob.glob(os.path.join(settings.output_dir, "*", "*.ts")):
         filename = os.path.basename(file_path)
         if not keep_pattern.match(filename):
             try:
                 os.remove(file_path)
             except Exception as e:
                 print(f"Error deleting {file_path}: {e}")
-# some players don't like having missing .ts files. So to handle a restart better, we delay deleting the .ts files
-GLib.timeout_add(20000, delete_stream_files)
+def dry_run(clip_count):
+    """Prints the next clip_count planned clips as JSON lines, without building a pipeline"""
+    out = sys.stdout
+    # the planner's own logging goes to stderr, so stdout is only the clips
+    with contextlib.redirect_stdout(sys.stderr):
+        clipinfo_manager = ClipInfoManager(dry_run=True)
+        for i in range(clip_count):
+            clip = clipinfo_manager.next_clipinfo()
+            out.write(json.dumps({
+                "index": i,
+                "file": clip.filepath,
+                "group": settings.file_filter.classify(clip.filepath),
+                "seek_ms": clip.seek_ms,
+                "duration_ms": clip.duration_ms,
+                "fadein_ms": clip.fadein_ms,
+                "fadeout_ms": clip.fadeout_ms,
+                "proxy": clip.location != os.path.join(settings.input_root_dir, clip.filepath),
+            }) + "\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", type=int, metavar="N", help="print the next N planned clips and exit, without streaming")
+    parser.add_argument("--seed", type=int, help="seed clip selection, so a run can be replayed (same as VTS_SEED)")
+    parser.add_argument("--offline", action="store_true", help="render as fast as possible instead of in real time, for benchmarking")
+    parser.add_argument("--offline-sink", choices=["hls", "fakesink"], default="hls", help="write the offline render's segments, or discard them")
+    parser.add_argument("--offline-duration-s", type=float, default=0, help="end the offline render after this much stream time")
+    args = parser.parse_args()
+    if args.seed is not None:
+        settings.seed = args.seed
+    settings.offline = args.offline
+    settings.offline_sink = args.offline_sink
+    settings.offline_duration_ms = math.floor(args.offline_duration_s * 1000)
+    if args.dry_run is not None:
+        dry_run(args.dry_run)
+        sys.exit(0)
+
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, handle_presets_changed)
+    os.makedirs(settings.input_root_dir, exist_ok=True)
+    os.makedirs(settings.output_dir, exist_ok=True)
+    manager = HLSPipelineManager()
+    # some players don't like having missing .ts files. So to handle a restart better, we delay deleting the .ts files
+    manager.stream_clock.timeout_add(20000, delete_stream_files, "delete_stream_files")
+    manager.run()
 
-manager = HLSPipelineManager()
-manager.run()
@@ -0,0 +1,255 @@
+import gi
+import heapq
+import itertools
+import threading
+import time
+
+from metrics import registry
+
+gi.require_version("Gst", "1.0")
+gi.require_version("GLib", "2.0")
+from gi.repository import Gst, GLib
+
+
+class StreamClock:
+    """Runs clip events at a point in the pipeline's running time, rather than after a wall-clock delay.
+
+    Every pending event is in one priority queue ordered by its deadline. Subclasses decide how the
+    stream's time is measured and how they're woken up when the earliest event is due. Events always
+    run on the main loop, and how late each one ran is recorded in the scheduler_lateness_ms histogram.
+    """
+    def __init__(self):
+        self.events = [] # heap of (deadline ns, id, interval ms, name, callback)
+        self.cancelled = set()
+        self.ids = itertools.count(1)
+        self.condition = threading.Condition()
+
+    def get_time(self):
+        raise NotImplementedError
+
+    def timeout_add(self, ms, callback, name="timer"):
+        """Runs callback ms after the current running time, and again every ms for as long as it returns True"""
+        return self._add(self.get_time() + round(ms * Gst.MSECOND), ms, name, callback)
+
+    def add_at(self, deadline_ns, callback, name="timer"):
+        """Runs callback once, when the running time reaches deadline_ns"""
+        return self._add(deadline_ns, 0, name, callback)
+
+    def source_remove(self, event_id):
+        with self.condition:
+            self.cancelled.add(event_id)
+
+    def get_pending(self):
+        """Returns (deadline ns, name) of every pending event, earliest first"""
+        with self.condition:
+            return [(event[0], event[3]) for event in sorted(self.events) if event[1] not in self.cancelled]
+
+    def hold(self, deadline_ns):
+        return None
+
+    def release(self, hold_id):
+        pass
+
+    def pause(self):
+        pass
+
+    def rearm(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def _add(self, deadline_ns, interval_ms, name, callback):
+        with self.condition:
+            event_id = next(self.ids)
+            heapq.heappush(self.events, (deadline_ns, event_id, interval_ms, name, callback))
+            if self.events[0][1] == event_id:
+                self._on_earliest_changed()
+            return event_id
+
+    def _on_earliest_changed(self):
+        pass
+
+    def _pop_due(self, time_ns):
+        due = []
+        while self.events and self.events[0][0] <= time_ns:
+            event = heapq.heappop(self.events)
+            if event[1] in self.cancelled:
+                self.cancelled.discard(event[1])
+            else:
+                due.append(event)
+        return due
+
+    def _run(self, due):
+        """Runs due events in deadline order, on the main loop"""
+        for deadline_ns, event_id, interval_ms, name, callback in due:
+            lateness_ns = self.get_time() - deadline_ns
+            registry.histogram("scheduler_lateness_ms", "How late each clip event ran, in pipeline running time", event=name).observe(max(0, lateness_ns) / Gst.MSECOND)
+            try:
+                repeat = callback()
+            except Exception as e:
+                print(f"[ERROR] scheduled {name} event failed: {e}")
+                repeat = False
+            if repeat and interval_ms:
+                with self.condition:
+                    heapq.heappush(self.events, (self.get_time() + round(interval_ms * Gst.MSECOND), event_id, interval_ms, name, callback))
+
+
+class LiveClock(StreamClock):
+    """The pipeline clock's running time. A single-shot clock id is kept waiting for the earliest event,
+    so events fire on the same clock the buffers are timestamped with instead of drifting GLib timeouts.
+
+    The clock keeps going while the pipeline is paused, so pause() stops events from firing until
+    rearm() is called, which must happen whenever the pipeline starts playing (its base time changes).
+    """
+    def __init__(self, pipeline):
+        super().__init__()
+        self.pipeline = pipeline
+        self.clock_id = None
+        self.paused = False
+
+    def get_time(self):
+        clock = self.pipeline.get_clock()
+        if not clock:
+            return 0
+        return clock.get_time() - self.pipeline.get_base_time()
+
+    def pause(self):
+        with self.condition:
+            self.paused = True
+            self._unschedule()
+
+    def rearm(self):
+        with self.condition:
+            self.paused = False
+            self._on_earliest_changed()
+
+    def stop(self):
+        with self.condition:
+            self._unschedule()
+            self.events.clear()
+
+    def _on_earliest_changed(self):
+        self._unschedule()
+        clock = self.pipeline.get_clock()
+        if not self.events or not clock or self.paused:
+            return
+        self.clock_id = clock.new_single_shot_id(self.pipeline.get_base_time() + max(0, self.events[0][0]))
+        Gst.Clock.id_wait_async(self.clock_id, self._on_clock_id, None)
+
+    def _unschedule(self):
+        if self.clock_id:
+            Gst.Clock.id_unschedule(self.clock_id)
+            self.clock_id = None
+
+    def _on_clock_id(self, clock, time_ns, clock_id, user_data):
+        # this is the clock's thread, so the events run on the main loop
+        GLib.idle_add(self._dispatch)
+        return True
+
+    def _dispatch(self):
+        with self.condition:
+            due = [] if self.paused else self._pop_due(self.get_time())
+        self._run(due)
+        with self.condition:
+            self._on_earliest_changed()
+        return False
+
+
+class OfflineClock(StreamClock):
+    """The stream's time for the offline mode, where the pipeline has no clock and runs as fast as it can.
+
+    The time is the pts of the last buffer that got through pad (the compositor's output). When a buffer
+    reaches an event's deadline, the probe holds the streaming thread until the main loop has run the
+    event. That way the clip lifecycle happens at the same stream time it would in the live mode,
+    however fast the pipeline runs.
+
+    hold() also stops the stream at a deadline until release() is called, for things that take wall-clock
+    time (like a FileBin getting ready) and would be late if the stream kept going. follow() makes
+    another pad (the audio) wait for pad, so it doesn't get ahead of the video.
+    """
+    def __init__(self, pad, end_ns=None, on_end=None, hold_timeout_s=30):
+        super().__init__()
+        self.now_ns = 0
+        self.end_ns = end_ns
+        self.on_end = on_end
+        self.hold_timeout_s = hold_timeout_s
+        self.holds = {} # id -> deadline ns
+        self.dispatching = False
+        self.ended = False
+        self.stopped = False
+        self.probe_id = pad.add_probe(Gst.PadProbeType.BUFFER, self._on_buffer)
+
+    def get_time(self):
+        with self.condition:
+            return self.now_ns
+
+    def hold(self, deadline_ns):
+        with self.condition:
+            hold_id = next(self.ids)
+            self.holds[hold_id] = deadline_ns
+            return hold_id
+
+    def release(self, hold_id):
+        with self.condition:
+            self.holds.pop(hold_id, None)
+            self.condition.notify_all()
+
+    def stop(self):
+        """Lets go of every held buffer, so the pipeline can shut down"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def follow(self, pad):
+        pad.add_probe(Gst.PadProbeType.BUFFER, self._on_follower_buffer)
+
+    def _on_earliest_changed(self):
+        self.condition.notify_all()
+
+    def _on_buffer(self, pad, info):
+        buf = info.get_buffer()
+        if not buf or buf.pts == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+        with self.condition:
+            held_since = None
+            while not self.stopped:
+                due = self._pop_due(buf.pts)
+                if due:
+                    self.dispatching = True
+                    GLib.idle_add(self._dispatch, due)
+                if self.dispatching:
+                    self.condition.wait()
+                    continue
+                if not any(deadline <= buf.pts for deadline in self.holds.values()):
+                    break
+                held_since = held_since or time.monotonic()
+                if time.monotonic() - held_since > self.hold_timeout_s:
+                    print(f"[WARN] the offline stream was held for over {self.hold_timeout_s}s, continuing without waiting")
+                    self.holds = {hold_id: deadline for hold_id, deadline in self.holds.items() if deadline > buf.pts}
+                    break
+                self.condition.wait(1)
+            self.now_ns = max(self.now_ns, buf.pts)
+            self.condition.notify_all()
+            if self.end_ns is not None and self.now_ns >= self.end_ns and not self.ended:
+                self.ended = True
+                if self.on_end:
+                    GLib.idle_add(self.on_end)
+        return Gst.PadProbeReturn.OK
+
+    def _on_follower_buffer(self, pad, info):
+        buf = info.get_buffer()
+        if not buf or buf.pts == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+        with self.condition:
+            self.condition.wait_for(lambda: buf.pts <= self.now_ns or self.ended or self.stopped)
+        return Gst.PadProbeReturn.OK
+
+    def _dispatch(self, due):
+        try:
+            self._run(due)
+        finally:
+            with self.condition:
+                self.dispatching = False
+                self.condition.notify_all()
+        return False
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules under src/ are imported as top-level modules, like stream.py and serve.py do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,54 @@
+import os
+
+from file_filter import FILTER_KEYS, FileFilter, ClassificationCache
+from library_index import LibraryIndex
+
+
+def make_filter(**values):
+    preset = {key: "" for key in FILTER_KEYS}
+    preset.update(values)
+    return FileFilter(preset)
+
+
+def make_cache(tmp_path, files):
+    index = LibraryIndex(str(tmp_path), snapshot_path=str(tmp_path / "library-index.json"))
+    index.apply_changes(files, [])
+    return index, ClassificationCache(index, max_entries=2)
+
+
+def test_returns_the_same_lists_until_the_library_changes(tmp_path):
+    index, cache = make_cache(tmp_path, ["a.mp4", "boost.mp4"])
+    file_filter = make_filter(BOOSTED_CONTAINS_CSV="boost")
+    result = cache.get(file_filter)
+    assert result == ([], ["a.mp4"], ["boost.mp4"], [])
+    assert cache.get(make_filter(BOOSTED_CONTAINS_CSV="boost")) is result
+    index.apply_changes(["b.mp4"], [])
+    assert cache.get(file_filter) is not result
+
+
+def test_enable_excludes_is_cached_separately(tmp_path):
+    _, cache = make_cache(tmp_path, ["x.mp4"])
+    file_filter = make_filter(EXCLUDE_CONTAINS_CSV="x")
+    assert cache.get(file_filter) == ([], [], [], ["x.mp4"])
+    assert cache.get(file_filter, False) == ([], ["x.mp4"], [], [])
+
+
+def test_least_recently_used_filter_is_evicted(tmp_path):
+    _, cache = make_cache(tmp_path, ["a.mp4"])
+    filters = [make_filter(BOOSTED_CONTAINS_CSV=term) for term in ("a", "b", "c")]
+    for file_filter in filters:
+        cache.get(file_filter)
+    assert list(cache.entries) == [(filters[1].key, True), (filters[2].key, True)]
+
+
+def test_apply_changes_updates_the_lists_in_place(tmp_path):
+    _, cache = make_cache(tmp_path, [os.path.join("base", "a.mp4"), "other.mp4"])
+    file_filter = make_filter(BASE_DIRECTORY="base", BOOSTED_CONTAINS_CSV="boost")
+    result = cache.get(file_filter)
+    assert result == ([], [os.path.join("base", "a.mp4")], [], [])
+    added = [os.path.join("base", "boost.mp4"), "outside.mp4"]
+    assert cache.apply_changes(added, [os.path.join("base", "a.mp4")]) == (added, [os.path.join("base", "a.mp4")])
+    assert cache.get(file_filter) is result
+    assert result == ([], [], [os.path.join("base", "boost.mp4")], [])
+    assert cache.apply_changes(added, []) == ([], [])
+    assert result == ([], [], [os.path.join("base", "boost.mp4")], [])
@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import namedtuple
+
+import pytest
+
+from clip_planner import ClipPlanner
+
+Clip = namedtuple("Clip", ["index", "duration_ms", "fadeout_ms"])
+
+
+def wait_until(predicate, timeout_s=5):
+    deadline = time.monotonic() + timeout_s
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.005)
+
+
+class Producer:
+    def __init__(self):
+        self.calls = 0
+        self.count = 0
+        self.resets = 0
+        self.gate = threading.Event()
+        self.gate.set()
+        self.error = None
+
+    def produce(self):
+        self.calls += 1
+        self.gate.wait()
+        if self.error:
+            raise self.error
+        self.count += 1
+        return Clip(self.count, 1000, 100)
+
+    def on_reset(self):
+        self.resets += 1
+
+
+def test_fills_the_queue_up_to_its_depth():
+    producer = Producer()
+    planner = ClipPlanner(producer.produce, 3)
+    wait_until(lambda: planner.get_queue_depth() == 3)
+    time.sleep(0.02)
+    assert planner.get_queue_depth() == 3
+    assert planner.get_planned_ms() == 3 * 900
+    assert planner.peek().index == 1
+    assert [planner.next_clipinfo().index for _ in range(3)] == [1, 2, 3]
+    wait_until(lambda: planner.get_queue_depth() == 3)
+    assert planner.next_clipinfo().index == 4
+
+
+def test_next_clipinfo_does_not_wait():
+    producer = Producer()
+    producer.gate.clear()
+    planner = ClipPlanner(producer.produce, 2)
+    assert planner.next_clipinfo() is None
+    assert planner.starved_count == 1
+    assert planner.next_clipinfo() is None
+    assert planner.starved_count == 1
+    producer.gate.set()
+    wait_until(lambda: planner.peek() is not None)
+    assert planner.next_clipinfo().index == 1
+    assert not planner.starving
+
+
+def test_raises_the_planning_error():
+    producer = Producer()
+    producer.error = ValueError("no files")
+    planner = ClipPlanner(producer.produce, 2)
+    wait_until(lambda: planner.error is not None)
+    with pytest.raises(ValueError):
+        planner.next_clipinfo()
+
+
+def test_reset_discards_clips_of_the_previous_generation():
+    producer = Producer()
+    planner = ClipPlanner(producer.produce, 2, on_reset=producer.on_reset)
+    wait_until(lambda: planner.get_queue_depth() == 2)
+    producer.gate.clear()
+    planner.next_clipinfo()
+    # the planner is now producing clip 3 for the old generation
+    wait_until(lambda: producer.calls == 3)
+    planner.reset()
+    assert planner.generation == 1
+    assert planner.get_queue_depth() == 0
+    producer.gate.set()
+    wait_until(lambda: planner.get_queue_depth() == 2)
+    assert producer.resets == 1
+    assert [planner.next_clipinfo().index for _ in range(2)] == [4, 5]
+
+
+def test_set_depth():
+    producer = Producer()
+    planner = ClipPlanner(producer.produce, 1)
+    wait_until(lambda: planner.get_queue_depth() == 1)
+    planner.set_depth(4)
+    wait_until(lambda: planner.get_queue_depth() == 4)
@@ -0,0 +1,137 @@
+import random
+import re
+
+import pytest
+
+from file_filter import FILTER_KEYS, EXCLUDED, SUPPRESSED, NEUTRAL, BOOSTED, FileFilter, PrefixTrie
+
+
+def make_preset(**values):
+    preset = {key: "" for key in FILTER_KEYS}
+    preset.update(values)
+    return preset
+
+
+def old_classify(preset, path, enable_filters=True):
+    """The filter logic of ClipInfoManager._get_files before FileFilter, for one path"""
+    def get_contain_pattern(csv):
+        if not csv:
+            return None
+        lower_terms = [term.strip().lower() for term in csv.split(",") if term.strip()]
+        return re.compile("|".join(re.escape(term) for term in lower_terms))
+    def get_startswith_list(csv):
+        if not csv:
+            return None
+        return [term.strip().lstrip("/").lower() for term in csv.split(",") if term.strip()]
+    def group_matches(prefix):
+        startswith_list = get_startswith_list(preset[f"{prefix}_STARTSWITH_CSV"].strip(" \t\n\r"))
+        contains_pattern = get_contain_pattern(preset[f"{prefix}_CONTAINS_CSV"].strip(" \t\n\r"))
+        notstartswith_list = get_startswith_list(preset[f"{prefix}_NOTSTARTSWITH_CSV"].strip(" \t\n\r"))
+        notcontains_pattern = get_contain_pattern(preset[f"{prefix}_NOTCONTAINS_CSV"].strip(" \t\n\r"))
+        return bool(
+            (startswith_list and any(lower_path.startswith(p) for p in startswith_list))
+            or (contains_pattern and bool(contains_pattern.search(lower_path)))
+            or (notstartswith_list and not any(lower_path.startswith(p) for p in notstartswith_list))
+            or (notcontains_pattern and not bool(notcontains_pattern.search(lower_path)))
+        )
+
+    base_directory = preset["BASE_DIRECTORY"].strip(" \t\n\r/\\")
+    lower_path = path[len(base_directory) + 1:].lower() if base_directory else path.lower()
+    if enable_filters and group_matches("EXCLUDE"):
+        return EXCLUDED
+    bias = 0
+    if group_matches("BOOSTED"):
+        bias += 1
+    if group_matches("SUPPRESSED"):
+        bias -= 1
+    if bias == -1:
+        return SUPPRESSED
+    if bias == 0:
+        return NEUTRAL
+    return BOOSTED
+
+
+def test_prefix_trie_ors_every_matching_prefix():
+    trie = PrefixTrie()
+    trie.add("a", 1)
+    trie.add("ab", 2)
+    trie.add("abc", 4)
+    trie.add("b", 8)
+    trie.add("ab", 16)
+    assert trie.match("abcd") == 1 | 2 | 4 | 16
+    assert trie.match("ab") == 1 | 2 | 16
+    assert trie.match("ax") == 1
+    assert trie.match("x") == 0
+    assert trie.match("") == 0
+
+
+def test_prefix_trie_empty_term_matches_everything():
+    trie = PrefixTrie()
+    trie.add("", 1)
+    assert trie.match("anything") == 1
+    assert trie.match("") == 1
+
+
+@pytest.mark.parametrize("values, path, expected", [
+    ({}, "movies/a.mp4", NEUTRAL),
+    ({"EXCLUDE_STARTSWITH_CSV": "Movies"}, "movies/a.mp4", EXCLUDED),
+    ({"EXCLUDE_STARTSWITH_CSV": "/movies"}, "movies/a.mp4", EXCLUDED),
+    ({"EXCLUDE_CONTAINS_CSV": "trailer, sample"}, "movies/a sample.mp4", EXCLUDED),
+    ({"EXCLUDE_NOTSTARTSWITH_CSV": "shows"}, "movies/a.mp4", EXCLUDED),
+    ({"EXCLUDE_NOTCONTAINS_CSV": "hd"}, "movies/a.mp4", EXCLUDED),
+    ({"BOOSTED_CONTAINS_CSV": "cat"}, "pets/cat.mp4", BOOSTED),
+    ({"SUPPRESSED_STARTSWITH_CSV": "pets"}, "pets/cat.mp4", SUPPRESSED),
+    ({"BOOSTED_CONTAINS_CSV": "cat", "SUPPRESSED_STARTSWITH_CSV": "pets"}, "pets/cat.mp4", NEUTRAL),
+    ({"BASE_DIRECTORY": "/media/", "EXCLUDE_STARTSWITH_CSV": "media"}, "media/clips/a.mp4", NEUTRAL),
+    ({"BASE_DIRECTORY": "media", "BOOSTED_STARTSWITH_CSV": "clips"}, "media/clips/a.mp4", BOOSTED),
+])
+def test_classify(values, path, expected):
+    assert FileFilter(make_preset(**values)).classify(path) == expected
+
+
+def test_classify_without_excludes():
+    file_filter = FileFilter(make_preset(EXCLUDE_CONTAINS_CSV="cat", BOOSTED_CONTAINS_CSV="cat"))
+    assert file_filter.classify("cat.mp4") == EXCLUDED
+    assert file_filter.classify("cat.mp4", enable_excludes=False) == BOOSTED
+
+
+def test_overlapping_contains_terms():
+    # "cat" and "catalog" start at the same position, and only one of them is reported by the regex
+    file_filter = FileFilter(make_preset(BOOSTED_CONTAINS_CSV="catalog", SUPPRESSED_CONTAINS_CSV="cat"))
+    assert file_filter.classify("catalog.mp4") == NEUTRAL
+    assert file_filter.classify("cat.mp4") == SUPPRESSED
+
+
+def test_classify_files():
+    file_filter = FileFilter(make_preset(EXCLUDE_CONTAINS_CSV="x", BOOSTED_CONTAINS_CSV="b", SUPPRESSED_CONTAINS_CSV="s"))
+    assert file_filter.classify_files(["s.mp4", "n.mp4", "b.mp4", "x.mp4"]) == (["s.mp4"], ["n.mp4"], ["b.mp4"], ["x.mp4"])
+
+
+def test_in_base_directory():
+    assert FileFilter(make_preset()).in_base_directory("a/b.mp4")
+    file_filter = FileFilter(make_preset(BASE_DIRECTORY="a"))
+    assert file_filter.in_base_directory("a/b.mp4")
+    assert not file_filter.in_base_directory("ab/c.mp4")
+
+
+def test_matches_old_filter_logic():
+    rng = random.Random(1234)
+    alphabet = "abc/"
+    def random_text(max_length):
+        return "".join(rng.choice(alphabet) for _ in range(rng.randint(1, max_length)))
+    def random_csv():
+        if rng.random() < 0.6:
+            return ""
+        terms = [random_text(3) for _ in range(rng.randint(1, 3))]
+        return ",".join(term.upper() if rng.random() < 0.2 else f" {term} " if rng.random() < 0.2 else term for term in terms)
+
+    for _ in range(500):
+        base_directory = rng.choice(["", "", "base"])
+        preset = make_preset(BASE_DIRECTORY=base_directory, **{key: random_csv() for key in FILTER_KEYS[1:]})
+        file_filter = FileFilter(preset)
+        for _ in range(20):
+            path = random_text(8).strip("/") or "a"
+            if base_directory:
+                path = f"{base_directory}/{path}"
+            for enable_excludes in (True, False):
+                assert file_filter.classify(path, enable_excludes) == old_classify(preset, path, enable_excludes), (preset, path)
@@ -0,0 +1,84 @@
+import random
+
+from file_group import FileGroup, IndexedSet
+
+
+def pick(group, files):
+    group.setup(files, 1)
+    if not group.eligible_files:
+        group.next_iteration()
+    return group.select_file()
+
+
+def test_indexed_set():
+    items = IndexedSet(["a", "b", "c"])
+    items.add("a")
+    assert len(items) == 3
+    items.remove("a")
+    assert "a" not in items and sorted(items) == ["b", "c"]
+    items.discard("a")
+    items.remove("c")
+    assert list(items) == ["b"]
+    assert items.choice(random.Random(0)) == "b"
+
+
+def test_each_iteration_plays_every_file_once():
+    files = [f"{i}.mp4" for i in range(10)]
+    group = FileGroup(recent_window_length=3, rng=random.Random(1))
+    for _ in range(5):
+        picks = [pick(group, files) for _ in range(len(files))]
+        assert sorted(picks) == files
+
+
+def test_recent_files_are_not_repeated():
+    files = [f"{i}.mp4" for i in range(10)]
+    group = FileGroup(recent_window_length=4, rng=random.Random(2))
+    picks = [pick(group, files) for _ in range(200)]
+    for i in range(4, len(picks)):
+        assert picks[i] not in picks[i - 4:i]
+
+
+def test_small_groups_only_hold_half_of_the_files():
+    files = ["a.mp4", "b.mp4"]
+    group = FileGroup(recent_window_length=30, rng=random.Random(3))
+    picks = [pick(group, files) for _ in range(20)]
+    assert set(picks) == set(files)
+
+
+def test_same_seed_picks_the_same_files():
+    files = [f"{i}.mp4" for i in range(20)]
+    picks = []
+    for _ in range(2):
+        group = FileGroup(recent_window_length=5, rng=random.Random(42))
+        picks.append([pick(group, files) for _ in range(50)])
+    assert picks[0] == picks[1]
+
+
+def test_add_and_remove_files():
+    files = [f"{i}.mp4" for i in range(6)]
+    group = FileGroup(recent_window_length=2, rng=random.Random(4))
+    first = pick(group, files)
+    # like the ClassificationCache, the list is changed in place and the group is told about each file
+    files.remove(first)
+    files.append("new.mp4")
+    group.remove_file(first)
+    group.remove_file("missing.mp4")
+    group.add_file("new.mp4")
+    group.add_file("new.mp4")
+    assert first not in group.all_files
+    assert len(group.all_files) == 6
+    group.setup(files, 1)
+    assert group.remaining_iteration_file_count == len(files)
+    picks = [pick(group, files) for _ in range(len(files))]
+    assert sorted(picks) == sorted(files)
+
+
+def test_sync_keeps_the_iteration():
+    files = [f"{i}.mp4" for i in range(6)]
+    group = FileGroup(recent_window_length=1, rng=random.Random(5))
+    played = [pick(group, files) for _ in range(3)]
+    new_files = [f for f in files if f != played[0]] + ["6.mp4"]
+    group.setup(new_files, 1)
+    assert group.remaining_iteration_file_count == 4
+    rest = [pick(group, new_files) for _ in range(4)]
+    assert sorted(played[1:] + rest) == sorted(new_files)
@@ -0,0 +1,19 @@
+from fractions import Fraction
+
+from frame_time import SECOND_NS, align_to_frame
+
+
+def test_align_to_frame():
+    assert align_to_frame(0, Fraction(25, 1)) == 0
+    assert align_to_frame(1, Fraction(25, 1)) == 40000000
+    assert align_to_frame(40000000, Fraction(25, 1)) == 40000000
+    assert align_to_frame(SECOND_NS, Fraction(25, 1)) == SECOND_NS
+
+
+def test_align_to_ntsc_frames():
+    frame_rate = Fraction(30000, 1001)
+    # frame 1 starts at 1001/30000 s, which isn't a whole number of ns
+    assert align_to_frame(1, frame_rate) == 33366666
+    assert align_to_frame(33366666, frame_rate) == 33366666
+    assert align_to_frame(33366667, frame_rate) == 66733333
+    assert align_to_frame(1001 * SECOND_NS, frame_rate) == 1001 * SECOND_NS
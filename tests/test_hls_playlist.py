@@ -0,0 +1,71 @@
+import threading
+
+from hls_playlist import SERVER_CONTROL_TAG, PlaylistState, add_server_control, get_last_msn
+
+PLAYLIST = """#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-MEDIA-SEQUENCE:5
+#EXT-X-TARGETDURATION:2
+#EXTINF:2.0,
+segment00005.ts
+#EXTINF:2.0,
+segment00006.ts
+"""
+
+
+def test_get_last_msn():
+    assert get_last_msn(PLAYLIST) == 6
+    assert get_last_msn("#EXTM3U\n#EXTINF:2.0,\na.ts\n") == 0
+    assert get_last_msn("#EXTM3U\n#EXT-X-MEDIA-SEQUENCE:5\n") is None
+
+
+def test_add_server_control():
+    lines = add_server_control(PLAYLIST).splitlines()
+    assert lines[lines.index("#EXT-X-TARGETDURATION:2") + 1] == SERVER_CONTROL_TAG
+    assert "#EXT-X-VERSION:6" in lines and "#EXT-X-VERSION:3" not in lines
+    assert add_server_control(add_server_control(PLAYLIST)) == add_server_control(PLAYLIST)
+
+
+def test_add_server_control_adds_a_version():
+    lines = add_server_control(PLAYLIST.replace("#EXT-X-VERSION:3\n", "")).splitlines()
+    assert lines[:2] == ["#EXTM3U", "#EXT-X-VERSION:6"]
+    assert SERVER_CONTROL_TAG in lines
+
+
+def test_add_server_control_keeps_newer_versions():
+    assert "#EXT-X-VERSION:9" in add_server_control(PLAYLIST.replace("VERSION:3", "VERSION:9")).splitlines()
+
+
+def test_add_server_control_needs_a_target_duration():
+    content = "#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1\nlow.m3u8\n"
+    assert add_server_control(content) == content
+
+
+def test_wait_for_published_msn():
+    state = PlaylistState()
+    state.update("live.m3u8", PLAYLIST)
+    assert state.wait_for("live.m3u8", 6, 0) == (6, PLAYLIST)
+    assert state.wait_for("live.m3u8", 7, 0.01) == (6, PLAYLIST)
+    # so far ahead that it must be from a previous stream
+    assert state.wait_for("live.m3u8", 100, 10) == (6, PLAYLIST)
+
+
+def test_wait_for_blocks_until_the_first_publish():
+    state = PlaylistState()
+    assert state.wait_for("live.m3u8", 5, 0.01) is None
+    timer = threading.Timer(0.05, state.update, ("live.m3u8", PLAYLIST))
+    timer.start()
+    assert state.wait_for("live.m3u8", 6, 10) == (6, PLAYLIST)
+    timer.join()
+
+
+def test_wait_for_next_segment():
+    state = PlaylistState()
+    state.update("live.m3u8", PLAYLIST)
+    newer = PLAYLIST + "#EXTINF:2.0,\nsegment00007.ts\n"
+    timer = threading.Timer(0.05, state.update, ("live.m3u8", newer))
+    timer.start()
+    assert state.wait_for("live.m3u8", 7, 10) == (7, newer)
+    timer.join()
+    state.reset()
+    assert state.get("live.m3u8") is None
@@ -0,0 +1,65 @@
+import socket
+
+import pytest
+
+from ipc import MAX_MESSAGE_BYTES, IpcChannel, ListAssembler
+
+
+@pytest.fixture
+def channels():
+    a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    sender, receiver = IpcChannel(a), IpcChannel(b)
+    yield sender, receiver
+    sender.close()
+    receiver.close()
+
+
+def test_send_and_receive(channels):
+    sender, receiver = channels
+    assert sender.send("activity", at=1)
+    assert sender.send("reset")
+    assert receiver.receive() == [{"type": "activity", "at": 1}, {"type": "reset"}]
+    assert receiver.receive() == []
+
+
+def test_oversized_messages_are_rejected(channels):
+    sender, receiver = channels
+    assert not sender.send("metrics", metrics="x" * MAX_MESSAGE_BYTES)
+    assert receiver.receive() == []
+    assert not sender.closed
+
+
+def test_send_list_round_trip(channels):
+    sender, receiver = channels
+    items = [{"name": f"metric_{i}", "labels": {"group": "neutral"}, "value": i} for i in range(1000)]
+    assert sender.send_list("metrics", "metrics", items, sent_at=5)
+    messages = receiver.receive()
+    assert len(messages) > 1
+    assert all(message["parts"] == len(messages) and message["sent_at"] == 5 for message in messages)
+    assembler = ListAssembler()
+    results = [assembler.add(message, "metrics") for message in messages]
+    assert results[:-1] == [None] * (len(messages) - 1)
+    assert results[-1] == items
+
+
+def test_small_list_is_one_message(channels):
+    sender, receiver = channels
+    assert sender.send_list("metrics", "metrics", [1, 2, 3])
+    messages = receiver.receive()
+    assert len(messages) == 1
+    assert ListAssembler().add(messages[0], "metrics") == [1, 2, 3]
+
+
+def test_list_with_a_missing_part_is_discarded():
+    assembler = ListAssembler()
+    assert assembler.add({"part": 0, "parts": 3, "metrics": [1]}, "metrics") is None
+    assert assembler.add({"part": 2, "parts": 3, "metrics": [3]}, "metrics") is None
+    assert assembler.add({"part": 0, "parts": 2, "metrics": [4]}, "metrics") is None
+    assert assembler.add({"part": 1, "parts": 2, "metrics": [5]}, "metrics") == [4, 5]
+
+
+def test_closed_when_the_other_end_is_gone(channels):
+    sender, receiver = channels
+    receiver.close()
+    assert not sender.send("activity")
+    assert sender.closed
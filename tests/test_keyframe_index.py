@@ -0,0 +1,113 @@
+import itertools
+import os
+import threading
+
+import pytest
+
+import media_info_cache
+from keyframe_index import KeyframeIndex
+from media_info_cache import MediaInfoCache
+
+
+class FakeScan:
+    """Stands in for the keyframe_scan.py subprocess"""
+    def __init__(self, results):
+        self.results = results
+        self.calls = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, path):
+        self.calls.append(os.path.basename(path))
+        self.gate.wait()
+        return self.results[os.path.basename(path)]
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = {}
+    for name in ("a.mp4", "b.mp4", "c.mp4"):
+        path = tmp_path / name
+        path.write_bytes(b"x")
+        paths[name] = str(path)
+    return paths
+
+
+def make_index(monkeypatch, results):
+    scan = FakeScan(results)
+    index = KeyframeIndex(MediaInfoCache(":memory:"))
+    monkeypatch.setattr(index, "_index", scan)
+    return index, scan
+
+
+def wait_for_keyframes(index, path):
+    for _ in range(500):
+        if index.media_info_cache.get_keyframes(path) is not None:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("timed out")
+
+
+def test_unindexed_files_are_queued_once(monkeypatch, files):
+    index, scan = make_index(monkeypatch, {"a.mp4": [0, 2000, 4000]})
+    scan.gate.clear()
+    assert index.get(files["a.mp4"]) is None
+    assert index.get(files["a.mp4"]) is None
+    scan.gate.set()
+    wait_for_keyframes(index, files["a.mp4"])
+    assert list(index.get(files["a.mp4"])) == [0, 2000, 4000]
+    assert scan.calls == ["a.mp4"]
+
+
+def test_files_without_keyframes_are_not_scanned_again(monkeypatch, files):
+    index, scan = make_index(monkeypatch, {"b.mp4": []})
+    assert index.get(files["b.mp4"]) is None
+    wait_for_keyframes(index, files["b.mp4"])
+    assert index.snap(files["b.mp4"], 1234, 5000) == 1234
+    assert scan.calls == ["b.mp4"]
+
+
+@pytest.mark.parametrize("seek_ms, max_ms, min_ms, expected", [
+    (0, 10000, 0, 0),
+    (1, 10000, 0, 2000),
+    (2000, 10000, 0, 2000),
+    (5000, 10000, 0, 6000),
+    # the next keyframe is after max_ms, so the one before seek_ms
+    (5000, 5500, 0, 4000),
+    # neither fits between min_ms and max_ms
+    (5000, 5500, 4500, 5000),
+    (9000, 9500, 0, 8000),
+])
+def test_snap(monkeypatch, files, seek_ms, max_ms, min_ms, expected):
+    index, scan = make_index(monkeypatch, {})
+    index.media_info_cache.put_keyframes(files["c.mp4"], [0, 2000, 4000, 6000, 8000])
+    assert index.snap(files["c.mp4"], seek_ms, max_ms, min_ms) == expected
+    assert scan.calls == []
+
+
+def test_snap_passes_unindexed_files_through(monkeypatch, files, tmp_path):
+    index, _ = make_index(monkeypatch, {"a.mp4": [0]})
+    assert index.snap(files["a.mp4"], 1234, 5000) == 1234
+    assert index.snap(str(tmp_path / "missing.mp4"), 1234, 5000) == 1234
+
+
+def test_keyframes_are_evicted_by_their_own_lru(monkeypatch, files):
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(media_info_cache.time, "time", lambda: float(next(ticks)))
+    cache = MediaInfoCache(":memory:", max_keyframe_entries=2, flush_interval_s=3600)
+    cache.put_keyframes(files["a.mp4"], [0])
+    cache.put_keyframes(files["b.mp4"], [])
+    assert list(cache.get_keyframes(files["a.mp4"])) == [0]
+    cache.put_keyframes(files["c.mp4"], [0, 1000])
+    assert cache.get_keyframes(files["b.mp4"]) is None
+    assert list(cache.get_keyframes(files["a.mp4"])) == [0]
+    assert cache.row_counts == {"media_info": 0, "keyframes": 2}
+
+
+def test_read_only_index_only_looks_up(files):
+    cache = MediaInfoCache(":memory:")
+    cache.put_keyframes(files["c.mp4"], [0, 2000])
+    index = KeyframeIndex(cache, read_only=True)
+    assert index.snap(files["c.mp4"], 1, 5000) == 2000
+    assert index.get(files["a.mp4"]) is None
+    assert index.queue.empty() and not index.pending
@@ -0,0 +1,91 @@
+import os
+
+from library_index import LibraryIndex
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w"):
+        pass
+
+
+def make_index(tmp_path):
+    root = tmp_path / "media"
+    root.mkdir()
+    return LibraryIndex(str(root), snapshot_path=str(tmp_path / "library-index.json"))
+
+
+def test_refresh_finds_video_files(tmp_path):
+    index = make_index(tmp_path)
+    touch(os.path.join(index.root_dir, "a.mp4"))
+    touch(os.path.join(index.root_dir, "notes.txt"))
+    touch(os.path.join(index.root_dir, "shows", "b.MKV"))
+    assert index.refresh()
+    assert index.get_files() == ["a.mp4", os.path.join("shows", "b.MKV")]
+    assert index.get_files("shows") == [os.path.join("shows", "b.MKV")]
+    assert not index.refresh()
+
+
+def test_refresh_only_relists_changed_dirs(tmp_path):
+    index = make_index(tmp_path)
+    touch(os.path.join(index.root_dir, "shows", "b.mp4"))
+    index.refresh()
+    version = index.version
+    os.remove(os.path.join(index.root_dir, "shows", "b.mp4"))
+    os.rmdir(os.path.join(index.root_dir, "shows"))
+    assert index.refresh()
+    assert index.version > version
+    assert index.get_files() == []
+    assert index.get_dirs() == [""]
+
+
+def test_get_files_is_cached_until_a_change(tmp_path):
+    index = make_index(tmp_path)
+    touch(os.path.join(index.root_dir, "a.mp4"))
+    index.refresh()
+    files = index.get_files()
+    assert index.get_files() is files
+    touch(os.path.join(index.root_dir, "b.mp4"))
+    index.refresh()
+    assert index.get_files() is not files
+
+
+def test_save_and_load(tmp_path):
+    index = make_index(tmp_path)
+    touch(os.path.join(index.root_dir, "shows", "b.mp4"))
+    index.refresh()
+    assert index.save()
+    loaded = LibraryIndex(index.root_dir, snapshot_path=index.snapshot_path)
+    assert loaded.load()
+    assert loaded.get_files() == index.get_files()
+    assert not LibraryIndex("/elsewhere", snapshot_path=index.snapshot_path).load()
+    assert not LibraryIndex(index.root_dir, snapshot_path=str(tmp_path / "missing.json")).load()
+
+
+def test_add_and_remove_paths(tmp_path):
+    index = make_index(tmp_path)
+    index.refresh()
+    touch(os.path.join(index.root_dir, "a.mp4"))
+    touch(os.path.join(index.root_dir, "shows", "s1", "b.mp4"))
+    assert index.add_path("a.mp4") == ["a.mp4"]
+    assert index.add_path("a.mp4") == []
+    assert index.add_path(os.path.join("missing", "c.mp4")) == []
+    assert index.add_path("shows") == [os.path.join("shows", "s1", "b.mp4")]
+    assert index.get_files() == ["a.mp4", os.path.join("shows", "s1", "b.mp4")]
+    assert index.remove_path("shows") == [os.path.join("shows", "s1", "b.mp4")]
+    assert index.remove_path("a.mp4") == ["a.mp4"]
+    assert index.get_files() == []
+    assert index.get_dirs() == [""]
+
+
+def test_apply_changes_is_idempotent(tmp_path):
+    index = make_index(tmp_path)
+    index.refresh()
+    added = [os.path.join("new", "dir", "c.mp4")]
+    assert index.apply_changes(added, []) == (added, [])
+    assert index.apply_changes(added, []) == ([], [])
+    assert index.get_files() == added
+    version = index.version
+    assert index.apply_changes([], added + ["missing.mp4"]) == ([], added)
+    assert index.apply_changes([], added) == ([], [])
+    assert index.version == version + 1
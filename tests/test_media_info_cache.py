@@ -0,0 +1,109 @@
+import itertools
+import os
+import sqlite3
+
+import pytest
+
+import media_info_cache
+from media_info_cache import SCHEMA_VERSION, MediaInfo, MediaInfoCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A time.time that moves forward on every call, so last_used never ties"""
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(media_info_cache.time, "time", lambda: float(next(ticks)))
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for i in range(5):
+        path = tmp_path / f"{i}.mp4"
+        path.write_bytes(b"x" * i)
+        paths.append(str(path))
+    return paths
+
+
+def paths_in(cache):
+    return sorted(os.path.basename(row[0]) for row in cache.conn.execute("SELECT path FROM media_info"))
+
+
+def test_get_and_put(files):
+    cache = MediaInfoCache(":memory:")
+    assert cache.get(files[0]) is None
+    cache.put(files[0], MediaInfo(1000, 640, 480, "video/x-h264", None, 30, 1, 1, 1))
+    info = cache.get(files[0])
+    assert (info.duration_ms, info.width, info.height, info.video_codec, info.framerate_num) == (1000, 640, 480, "video/x-h264", 30)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_changed_file_is_a_miss(files):
+    cache = MediaInfoCache(":memory:")
+    cache.put(files[1], MediaInfo(1000, 640, 480))
+    with open(files[1], "ab") as f:
+        f.write(b"more")
+    assert cache.get(files[1]) is None
+
+
+def test_least_recently_used_is_evicted(files, clock):
+    cache = MediaInfoCache(":memory:", max_entries=3, flush_interval_s=3600)
+    for path in files[:3]:
+        cache.put(path, MediaInfo(1000, 640, 480))
+    # only in memory until a flush, but an eviction has to take it into account
+    cache.get(files[0])
+    cache.put(files[3], MediaInfo(1000, 640, 480))
+    assert paths_in(cache) == ["0.mp4", "2.mp4", "3.mp4"]
+    assert cache.row_counts["media_info"] == 3
+    cache.put(files[3], MediaInfo(2000, 640, 480))
+    assert cache.row_counts["media_info"] == 3
+    cache.put(files[4], MediaInfo(1000, 640, 480))
+    assert paths_in(cache) == ["0.mp4", "3.mp4", "4.mp4"]
+    assert cache.row_counts["media_info"] == cache.conn.execute("SELECT COUNT(*) FROM media_info").fetchone()[0]
+
+
+def test_hits_are_written_on_flush(files, clock):
+    cache = MediaInfoCache(":memory:", flush_interval_s=3600)
+    cache.put(files[0], MediaInfo(1000, 640, 480))
+    written = cache.conn.execute("SELECT last_used FROM media_info").fetchone()[0]
+    cache.get(files[0])
+    assert cache.conn.execute("SELECT last_used FROM media_info").fetchone()[0] == written
+    cache.flush()
+    assert cache.conn.execute("SELECT last_used FROM media_info").fetchone()[0] > written
+    assert cache.last_used["media_info"] == {}
+
+
+def test_hits_are_written_after_the_flush_interval(files, clock):
+    cache = MediaInfoCache(":memory:", flush_interval_s=0)
+    cache.put(files[0], MediaInfo(1000, 640, 480))
+    written = cache.conn.execute("SELECT last_used FROM media_info").fetchone()[0]
+    cache.get(files[0])
+    assert cache.conn.execute("SELECT last_used FROM media_info").fetchone()[0] > written
+
+
+def test_outdated_schema_is_dropped(files, tmp_path):
+    db_path = str(tmp_path / "media-info.db")
+    cache = MediaInfoCache(db_path)
+    cache.put(files[0], MediaInfo(1000, 640, 480))
+    cache.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION - 1}")
+    cache.conn.commit()
+    cache.conn.close()
+    cache = MediaInfoCache(db_path)
+    assert cache.get(files[0]) is None
+    assert cache.row_counts["media_info"] == 0
+    assert sqlite3.connect(db_path).execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+
+
+def test_read_only_cache_never_writes(files, tmp_path):
+    db_path = str(tmp_path / "media-info.db")
+    cache = MediaInfoCache(db_path)
+    cache.put(files[0], MediaInfo(1000, 640, 480))
+    cache.conn.close()
+    read_only = MediaInfoCache(db_path, read_only=True)
+    assert read_only.get(files[0]).duration_ms == 1000
+    read_only.put(files[1], MediaInfo(2000, 640, 480))
+    read_only.flush()
+    assert read_only.get(files[1]).duration_ms == 2000
+    assert paths_in(MediaInfoCache(db_path)) == ["0.mp4"]
+    assert MediaInfoCache(str(tmp_path / "missing.db"), read_only=True).get(files[0]) is None
+    assert not os.path.exists(tmp_path / "missing.db")
@@ -0,0 +1,70 @@
+from metrics import Histogram, MetricsRegistry, render_prometheus
+
+
+def test_registry_returns_the_same_metric_per_name_and_labels():
+    registry = MetricsRegistry()
+    assert registry.counter("requests", route="a") is registry.counter("requests", route="a")
+    assert registry.counter("requests", route="a") is not registry.counter("requests", route="b")
+
+
+def test_counter_and_gauge():
+    registry = MetricsRegistry()
+    registry.counter("requests", "Requests handled").inc()
+    registry.counter("requests", "Requests handled").inc(2)
+    registry.counter("hits", "Hits").set(7)
+    registry.gauge("clips", "Active clips").set(3)
+    assert render_prometheus(registry.snapshot()) == "\n".join([
+        "# HELP vts_clips Active clips",
+        "# TYPE vts_clips gauge",
+        "vts_clips 3",
+        "# HELP vts_hits Hits",
+        "# TYPE vts_hits counter",
+        "vts_hits 7",
+        "# HELP vts_requests Requests handled",
+        "# TYPE vts_requests counter",
+        "vts_requests 3",
+    ]) + "\n"
+
+
+def test_help_and_type_once_per_name():
+    registry = MetricsRegistry()
+    registry.counter("requests", "Requests handled", route="a").inc()
+    registry.counter("requests", "Requests handled", route="b").inc()
+    registry.gauge("no_help").set(1)
+    lines = render_prometheus(registry.snapshot()).splitlines()
+    assert lines.count("# TYPE vts_requests counter") == 1
+    assert lines.count("# HELP vts_requests Requests handled") == 1
+    assert 'vts_requests{route="a"} 1' in lines and 'vts_requests{route="b"} 1' in lines
+    assert "# TYPE vts_no_help gauge" in lines
+    assert not any(line.startswith("# HELP vts_no_help") for line in lines)
+
+
+def test_histogram():
+    histogram = Histogram("ready_ms", "Ready time", {"stage": "seek"}, buckets=(10, 100))
+    for value in (5, 10, 50, 500):
+        histogram.observe(value)
+    assert render_prometheus([histogram.snapshot()]).splitlines() == [
+        "# HELP vts_ready_ms Ready time",
+        "# TYPE vts_ready_ms histogram",
+        'vts_ready_ms_bucket{stage="seek",le="10"} 2',
+        'vts_ready_ms_bucket{stage="seek",le="100"} 3',
+        'vts_ready_ms_bucket{stage="seek",le="+Inf"} 4',
+        'vts_ready_ms_sum{stage="seek"} 565',
+        'vts_ready_ms_count{stage="seek"} 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.gauge("file", path='a "quoted"\\path\nnext').set(1)
+    assert render_prometheus(registry.snapshot()).splitlines()[-1] == 'vts_file{path="a \\"quoted\\"\\\\path\\nnext"} 1'
+
+
+def test_concatenated_snapshots():
+    server = MetricsRegistry()
+    stream = MetricsRegistry()
+    server.gauge("up").set(1)
+    stream.gauge("up").set(0)
+    snapshot = server.snapshot() + [dict(metric, labels=dict(metric["labels"], source="stream")) for metric in stream.snapshot()]
+    lines = render_prometheus(snapshot).splitlines()
+    assert lines == ["# TYPE vts_up gauge", "vts_up 1", 'vts_up{source="stream"} 0']
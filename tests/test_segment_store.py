@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from segment_store import SegmentStore, parse_range
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("items=0-1", None),
+    ("bytes=0-1,5-6", None),
+    ("bytes=a-b", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=10-", (10, 99)),
+    ("bytes=10-1000", (10, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-1000", (0, 99)),
+    ("bytes=-0", False),
+    ("bytes=100-", False),
+    ("bytes=50-10", False),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+def test_segments_are_cached_until_they_change(tmp_path):
+    store = SegmentStore(str(tmp_path), capacity=1)
+    path = tmp_path / "0.ts"
+    path.write_bytes(b"abc")
+    segment = store.get("/0.ts")
+    assert segment.data == b"abc"
+    assert store.get("0.ts") is segment
+    assert (store.hits, store.misses) == (1, 1)
+    path.write_bytes(b"abcd")
+    os.utime(path, ns=(segment.mtime_ns + 1000, segment.mtime_ns + 1000))
+    assert store.get("0.ts").data == b"abcd"
+
+
+def test_capacity_and_paths_outside_the_directory(tmp_path):
+    store = SegmentStore(str(tmp_path / "hls"), capacity=1)
+    os.makedirs(store.directory)
+    (tmp_path / "secret.ts").write_bytes(b"x")
+    for name in ("0.ts", "1.ts"):
+        (tmp_path / "hls" / name).write_bytes(b"x")
+        store.get(name)
+    assert list(store.segments) == ["1.ts"]
+    assert store.get("../secret.ts") is None
+    assert store.get("missing.ts") is None
@@ -432,6 +432,48 @@ const Settings = () => {
                             settingChanged={settingChanged}
                             description="The number of segment files in addition to HLS_SEG_COUNT that should be kept on disk. For example, if count was 8 and extracount was 5, the server would only keep 13 segment files at a time. As additional segments are made, the oldest ones are auto-removed."
                         />
+                        <SettingItem
+                            name="HLS_OUTPUT_MODE"
+                            preset={preset}
+                            settingChanged={settingChanged}
+                            description="Either hlssink or hlssink2. hlssink2 closes each segment as soon as its last frame is encoded, so with a HLS_SEG_DURATION_S of 1 or 2 the stream delay drops to a few seconds. Changing this restarts the stream"
+                        />
+                        <SettingItem
+                            name="ABR_RENDITIONS"
+                            preset={preset}
+                            settingChanged={settingChanged}
+                            description="Additional lower resolution versions of the stream, as a csv of WIDTHxHEIGHT:KBPS (for example 640x360:800,960x540:1600). Players that load /master.m3u8 switch between them based on their bandwidth. Each one costs an extra encode, but the clips are only decoded and composited once. Changing this restarts the stream"
+                        />
+                        <SettingItem
+                            name="ENCODER_PROFILE"
+                            preset={preset}
+                            settingChanged={settingChanged}
+                            description="How much CPU the encoder uses. low-power suits a Raspberry Pi class box, balanced is the default, quality uses more cores and a slower x264 preset for a better picture, and capped uses a constant bitrate for clients on limited connections. Changing this restarts the stream"
+                        />
+                        <SettingItem
+                            name="PLAN_AHEAD_CLIPS"
+                            preset={preset}
+                            settingChanged={settingChanged}
+                            description="The number of upcoming clips that are selected and probed in the background ahead of time. A higher value protects against slow disks causing late transitions, but settings changes take a bit longer to affect which files are selected"
+                        />
+                        <SettingItem
+                            name="FILEBIN_POOL_SIZE"
+                            preset={preset}
+                            settingChanged={settingChanged}
+                            description="The number of upcoming clips whose video file is opened, decoded and seeked ahead of time. This keeps transitions on time with slow-to-open files (such as HEVC), at the cost of memory. Set it to 0 to only open files right before they're needed"
+                        />
+                        <SettingItem
+                            name="FILEBIN_POOL_MAX_MB"
+                            preset={preset}
+                            settingChanged={settingChanged}
+                            description="A budget (in megabytes) for files opened ahead of time due to FILEBIN_POOL_SIZE. Each file's memory use is estimated from its resolution rather than measured, so this is a rough guide, not a hard limit. Large (such as 4K) files will be opened on demand if their estimate would exceed it"
+                        />
+                        <SettingItem
+                            name="PROXY_CACHE_MB"
+                            preset={preset}
+                            settingChanged={settingChanged}
+                            description="The disk space (in megabytes) for low-bitrate copies of heavy files (such as 4K or HEVC), which are transcoded to WIDTHxHEIGHT in the background after they're first played, and then used instead of the original. The least recently played copies are removed first. 0 disables this"
+                        />
                     </div>
                 </div>
                 <Footer></Footer>
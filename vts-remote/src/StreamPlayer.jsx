@@ -6,7 +6,7 @@ const StreamPlayer = () => {
 
   useEffect(() => {
     const video = videoRef.current;
-    const src = '/playlist.m3u8'
+    const src = '/master.m3u8'
     if (Hls.isSupported()) {
       const hls = new Hls();
       hls.loadSource(src);